@@ -6,7 +6,8 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from .models import Conversacion, Mensaje
 from .serializers import ConversacionSerializer
-from .views import procesar_mensaje
+from .views import preparar_respuesta_cacheada, procesar_mensaje
+from .streaming import respuesta_sse
 
 # Obtener el logger
 logger = logging.getLogger(__name__)
@@ -50,6 +51,13 @@ class ChatbotAPIView(APIView):
             es_usuario=True
         )
 
+        # Con "stream": true la respuesta se envía como Server-Sent Events a medida que se genera
+        if str(request.data.get('stream', '')).lower() in ('1', 'true'):
+            return respuesta_sse(
+                conversacion, preparar_respuesta_cacheada(mensaje_usuario, request.user),
+                modelo_seleccionado, mipyme_id=request.user.mipyme_id
+            )
+
         # Procesar el mensaje para obtener la respuesta del asistente
         respuesta_asistente = procesar_mensaje(mensaje_usuario, request.user, modelo_seleccionado)
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AsistenteConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "asistente"
+
+    def ready(self):
+        import asistente.signals
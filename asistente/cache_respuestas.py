@@ -0,0 +1,166 @@
+# asistente/cache_respuestas.py
+"""
+Caché de respuestas del asistente.
+
+Guarda dos tipos de respuesta en memoria del proceso, con vencimiento (TTL) y
+desalojo de las menos usadas (LRU) cuando se llega al máximo de entradas:
+
+- 'datos': las respuestas que se calculan con los datos de la Mipyme
+  ("productos", "insumos", "moneda"...), por mensaje normalizado.
+- 'ia': las respuestas de los modelos, por hash del prompt y modelo.
+
+Las claves incluyen la versión de datos de la Mipyme (produccion.version_datos),
+así cualquier cambio en sus datos deja obsoletas sus respuestas. Si llegan a la vez
+varias peticiones con la misma clave, solo una genera la respuesta y las demás la
+esperan (single-flight). Los mensajes que ejecutan consultas o código del usuario
+no se cachean (asistente.intenciones.NO_CACHEABLES). Las métricas permiten ver
+cuántas consultas y cuánto tiempo de espera se ahorran.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+from produccion.version_datos import version_mipyme
+
+def normalizar(texto):
+    """Minúsculas, espacios colapsados y sin signos de puntuación en los extremos."""
+    return ' '.join(texto.casefold().split()).strip(' ?¿!¡.')
+
+
+def _hash(texto):
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+def clave_datos(mipyme_id, mensaje):
+    return f'datos:{mipyme_id}:{version_mipyme(mipyme_id)}:{_hash(normalizar(mensaje))}'
+
+
+def clave_ia(mipyme_id, prompt, modelo):
+    return f'ia:{mipyme_id}:{version_mipyme(mipyme_id)}:{modelo}:{_hash(normalizar(prompt))}'
+
+
+class _Vuelo:
+    """Generación en curso de una clave; las peticiones repetidas esperan su resultado."""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class CacheRespuestas:
+    def __init__(self, max_entradas=500, ttl=600, espera_maxima=180):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.espera_maxima = espera_maxima
+        self._entradas = OrderedDict()  # clave -> (expira, valor, segundos que costó generarla)
+        self._en_curso = {}
+        self._lock = threading.Lock()
+        self._metricas = Counter()
+        self._segundos_ahorrados = Counter()
+
+    def _tipo(self, clave):
+        return clave.split(':', 1)[0]
+
+    def _vigente(self, clave):
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        if entrada[0] <= time.monotonic():
+            del self._entradas[clave]
+            return None
+        self._entradas.move_to_end(clave)
+        return entrada
+
+    def obtener(self, clave):
+        """Devuelve la respuesta cacheada o None, y cuenta el acierto o el fallo."""
+        tipo = self._tipo(clave)
+        with self._lock:
+            entrada = self._vigente(clave)
+            self._metricas[f'{tipo}:consultas'] += 1
+            if entrada is None:
+                self._metricas[f'{tipo}:fallos'] += 1
+                return None
+            self._metricas[f'{tipo}:aciertos'] += 1
+            self._segundos_ahorrados[tipo] += entrada[2]
+            return entrada[1]
+
+    def guardar(self, clave, valor, segundos=0.0):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor, segundos)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                desalojada, _ = self._entradas.popitem(last=False)
+                self._metricas[f'{self._tipo(desalojada)}:desalojos'] += 1
+
+    def obtener_o_generar(self, clave, generar):
+        """
+        Devuelve la respuesta cacheada o la genera con `generar()`. Las excepciones de
+        `generar` no se cachean y se propagan también a las peticiones que esperaban.
+        """
+        tipo = self._tipo(clave)
+        with self._lock:
+            self._metricas[f'{tipo}:consultas'] += 1
+            entrada = self._vigente(clave)
+            if entrada is not None:
+                self._metricas[f'{tipo}:aciertos'] += 1
+                self._segundos_ahorrados[tipo] += entrada[2]
+                return entrada[1]
+            vuelo = self._en_curso.get(clave)
+            es_lider = vuelo is None
+            if es_lider:
+                vuelo = self._en_curso[clave] = _Vuelo()
+                self._metricas[f'{tipo}:fallos'] += 1
+            else:
+                self._metricas[f'{tipo}:agrupadas'] += 1
+
+        if not es_lider:
+            if vuelo.evento.wait(self.espera_maxima):
+                if vuelo.error is not None:
+                    raise vuelo.error
+                return vuelo.valor
+            # La generación original tarda demasiado: se genera de forma independiente
+            return generar()
+
+        inicio = time.monotonic()
+        try:
+            vuelo.valor = generar()
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                self._en_curso.pop(clave, None)
+            vuelo.evento.set()
+        self.guardar(clave, vuelo.valor, time.monotonic() - inicio)
+        return vuelo.valor
+
+    def metricas(self):
+        """Consultas, aciertos, fallos y peticiones agrupadas por tipo, con la tasa de aciertos."""
+        with self._lock:
+            resultado = {'entradas': len(self._entradas)}
+            for tipo in ('datos', 'ia'):
+                datos = {
+                    campo: self._metricas[f'{tipo}:{campo}']
+                    for campo in ('consultas', 'aciertos', 'fallos', 'agrupadas', 'desalojos')
+                }
+                ahorradas = datos['aciertos'] + datos['agrupadas']
+                datos['tasa_aciertos'] = round(ahorradas / datos['consultas'], 4) if datos['consultas'] else 0.0
+                datos['segundos_ahorrados'] = round(self._segundos_ahorrados[tipo], 3)
+                resultado[tipo] = datos
+            return resultado
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._metricas.clear()
+            self._segundos_ahorrados.clear()
+
+
+cache_respuestas = CacheRespuestas(
+    max_entradas=getattr(settings, 'ASISTENTE_CACHE_MAX_ENTRADAS', 500),
+    ttl=getattr(settings, 'ASISTENTE_CACHE_TTL', 600),
+)
@@ -0,0 +1,173 @@
+# asistente/contexto.py
+"""
+Contexto de la empresa que se envía al modelo de lenguaje.
+
+En lugar de volcar todo el historial, se arma un resumen acotado: los productos
+más vendidos con su receta, el inventario, los procesos y las ventas de los
+últimos meses desde el resumen mensual. El resultado se recorta hasta entrar en
+un presupuesto de tokens y se guarda en caché por Mipyme y versión de datos
+(produccion.version_datos), así solo se recalcula cuando algo cambió.
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, Sum
+from django.utils import timezone
+
+from produccion.models import Producto, Insumo, Proceso, Formulacion, PasoDeProduccion, ResumenVentasMensual
+from produccion.version_datos import version_mipyme
+
+MESES_VENTAS = 6
+TTL_CONTEXTO = 60 * 60
+# Orden en que se recortan las listas cuando el contexto excede el presupuesto
+LISTAS_RECORTABLES = ['insumos', 'procesos', 'productos', 'top_productos', 'ventas_mensuales']
+
+
+def estimar_tokens(texto):
+    """Estimación rápida: unos 4 caracteres por token en español/JSON."""
+    return len(texto) // 4 + 1
+
+
+def _presupuesto():
+    return getattr(settings, 'ASISTENTE_CONTEXTO_MAX_TOKENS', 3000)
+
+
+def _inicio_meses(meses):
+    hoy = timezone.localdate().replace(day=1)
+    anio, mes = hoy.year, hoy.month - (meses - 1)
+    while mes <= 0:
+        mes += 12
+        anio -= 1
+    return datetime.date(anio, mes, 1)
+
+
+def _datos_completos(mipyme):
+    desde = _inicio_meses(MESES_VENTAS)
+    resumen = ResumenVentasMensual.objects.filter(mipyme=mipyme, mes__gte=desde)
+
+    ventas_mensuales = [
+        {
+            'mes': fila['mes'].strftime('%Y-%m'),
+            'ingresos': float(fila['ingresos']),
+            'unidades': fila['unidades'],
+            'costo': float(fila['costo']),
+        }
+        for fila in resumen.values('mes').annotate(
+            ingresos=Sum('ingresos'), unidades=Sum('unidades'), costo=Sum('costo')
+        ).order_by('-mes')
+    ]
+    top = list(
+        resumen.values('producto_id', 'producto__nombre')
+        .annotate(ingresos=Sum('ingresos'), unidades=Sum('unidades'))
+        .order_by('-ingresos')[:10]
+    )
+    top_productos = [
+        {'producto': fila['producto__nombre'], 'ingresos': float(fila['ingresos']), 'unidades': fila['unidades']}
+        for fila in top
+    ]
+
+    # Los productos más vendidos van primero: si hay que recortar, se pierden los menos relevantes
+    orden_ventas = {fila['producto_id']: posicion for posicion, fila in enumerate(top)}
+    productos = list(
+        Producto.objects.filter(mipyme=mipyme)
+        .prefetch_related(
+            Prefetch('formulacion', queryset=Formulacion.objects.select_related('insumo__unidad')),
+            Prefetch('pasodeproduccion_set', queryset=PasoDeProduccion.objects.select_related('proceso')),
+        )
+        .order_by('nombre')
+    )
+    productos.sort(key=lambda p: orden_ventas.get(p.pk, len(orden_ventas)))
+
+    return {
+        'nombre': mipyme.nombre,
+        'telefono': mipyme.numero_telefono,
+        'correo': mipyme.correo,
+        'tipo': mipyme.tipo.nombre if mipyme.tipo else None,
+        'sector': mipyme.sector.nombre if mipyme.sector else None,
+        'moneda_predeterminada': mipyme.moneda_predeterminada,
+        'totales': {
+            'productos': len(productos),
+            'insumos': Insumo.objects.filter(mipyme=mipyme).count(),
+            'procesos': Proceso.objects.filter(mipyme=mipyme).count(),
+        },
+        'ventas_mensuales': ventas_mensuales,
+        'top_productos': top_productos,
+        'productos': [
+            {
+                'nombre': p.nombre,
+                'precio_venta': float(p.precio_venta) if p.precio_venta else None,
+                'costo_produccion': float(p.costo_produccion_cache),
+                'stock_actual': p.stock_actual,
+                'formulacion': [
+                    {
+                        'insumo': f.insumo.nombre,
+                        'unidad': f.insumo.unidad.abreviatura,
+                        'cantidad': float(f.cantidad),
+                        'porcentaje_desperdicio': float(f.porcentaje_desperdicio)
+                    } for f in p.formulacion.all()
+                ],
+                'pasos_produccion': [
+                    {
+                        'proceso': pdp.proceso.nombre,
+                        'tiempo_minutos': pdp.tiempo_en_minutos
+                    } for pdp in p.pasodeproduccion_set.all()
+                ]
+            } for p in productos
+        ],
+        'insumos': [
+            {
+                'nombre': i.nombre,
+                'costo_unitario': float(i.costo_unitario) if i.costo_unitario else None,
+                'stock_actual': float(i.stock_actual) if i.stock_actual else None
+            } for i in Insumo.objects.filter(mipyme=mipyme).order_by('stock_actual', 'nombre')
+        ],
+        'procesos': [
+            {
+                'nombre': pr.nombre,
+                'costo_por_hora': float(pr.costo_por_hora)
+            } for pr in Proceso.objects.filter(mipyme=mipyme).order_by('nombre')
+        ],
+    }
+
+
+def recortar(datos, presupuesto):
+    """
+    Recorta el contexto hasta que su JSON entre en `presupuesto` tokens. Primero quita
+    el detalle de receta de los productos que no están entre los primeros y luego
+    acorta las listas a la mitad, en el orden de LISTAS_RECORTABLES. Anota en
+    'omitidos' cuántos elementos se quitaron de cada lista.
+    """
+    if estimar_tokens(json.dumps(datos)) <= presupuesto:
+        return datos
+
+    for producto in datos['productos'][5:]:
+        producto.pop('formulacion', None)
+        producto.pop('pasos_produccion', None)
+
+    omitidos = {}
+    totales = {lista: len(datos[lista]) for lista in LISTAS_RECORTABLES}
+    while estimar_tokens(json.dumps(datos)) > presupuesto:
+        lista = max(
+            (nombre for nombre in LISTAS_RECORTABLES if datos[nombre]),
+            key=lambda nombre: len(json.dumps(datos[nombre])),
+            default=None,
+        )
+        if lista is None:
+            break
+        datos[lista] = datos[lista][:len(datos[lista]) // 2]
+        omitidos[lista] = totales[lista] - len(datos[lista])
+        datos['omitidos'] = omitidos
+    return datos
+
+
+def construir_contexto(mipyme, presupuesto=None):
+    """Devuelve el contexto acotado de la Mipyme, desde la caché si sus datos no cambiaron."""
+    presupuesto = presupuesto or _presupuesto()
+    clave = f'asistente:contexto:{mipyme.pk}:{version_mipyme(mipyme.pk)}:{presupuesto}'
+    datos = cache.get(clave)
+    if datos is None:
+        datos = recortar(_datos_completos(mipyme), presupuesto)
+        cache.set(clave, datos, TTL_CONTEXTO)
+    return datos
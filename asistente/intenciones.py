@@ -0,0 +1,168 @@
+# asistente/intenciones.py
+"""
+Clasificación de los mensajes del asistente por intención.
+
+Las palabras clave fijas y las frases de las guías de usuario activas
+(GuiaUsuario.palabras_clave) se compilan en una sola expresión regular. Cada
+mensaje se recorre una vez para obtener todas las palabras que contiene y la
+intención se decide con las reglas de REGLAS, en orden de prioridad.
+
+El índice guarda también el contenido de las guías, así que responder con una
+guía solo lee la versión de las guías. Se reconstruye solo cuando cambia una guía:
+las señales cambian esa versión en la caché 'compartida', que ven todos los
+procesos, y cada uno la compara con la del índice que tiene en memoria.
+"""
+import re
+import threading
+import uuid
+from typing import NamedTuple, Optional
+
+from django.core.cache import caches
+from django.db import transaction
+
+# Palabras que indican que el mensaje trata sobre la gestión de la mipyme
+TEMAS = [
+    'produccion', 'insumo', 'venta', 'proceso', 'formulacion', 'producto', 'mipyme',
+    'empresa', 'ventas', 'facturacion', 'estandarizar', 'sql', 'codigo', 'grafico',
+    'agregar', 'registrar', 'crear', 'materia prima', 'materias primas', 'pasos produccion',
+    'produccion pasos', 'datos empresa', 'datos', 'informacion', 'moneda', 'predeterminada',
+    'cómo', 'guía', 'ayuda', 'instructivo', 'impuestos', 'negocio', 'pymes',
+]
+VERBOS_AGREGAR = ['agregar', 'añadir', 'registrar', 'crear']
+MATERIAS_PRIMAS = ['insumo', 'insumos', 'materia prima', 'materias primas']
+
+# (intención, grupos): gana la primera regla en la que cada grupo tiene alguna palabra presente
+REGLAS = [
+    ('estandarizar', [['estandarizar']]),
+    ('datos_empresa', [['datos empresa', 'empresa', 'datos']]),
+    ('moneda', [['moneda']]),
+    ('ultima_venta', [['productos'], ['ultima venta']]),
+    ('guia_agregar_producto', [VERBOS_AGREGAR, ['producto']]),
+    ('productos', [['productos']]),
+    ('insumos', [['insumos']]),
+    ('ventas', [['ventas', 'facturacion']]),
+    ('procesos', [['procesos']]),
+    ('impuestos', [['impuestos']]),
+    ('formulacion', [['formulacion']]),
+    ('pasos_produccion', [['pasos produccion', 'produccion pasos']]),
+    ('sql', [['sql']]),
+    ('codigo', [['codigo', 'code']]),
+    ('grafico', [['grafico', 'graph']]),
+    ('guia_agregar_insumo', [VERBOS_AGREGAR + ['agrego'], MATERIAS_PRIMAS]),
+]
+
+# Frase que se busca en las guías para cada intención de guía
+FRASES_GUIA = {
+    'guia_agregar_producto': 'agregar producto',
+    'guia_agregar_insumo': 'agregar insumo',
+}
+
+# Intenciones que ejecutan consultas o código del usuario, o que ya se resuelven
+# desde el índice en memoria: no pasan por la caché de respuestas
+NO_CACHEABLES = {'sql', 'codigo', 'grafico', 'guia', *FRASES_GUIA}
+
+
+class Guia(NamedTuple):
+    titulo: str
+    descripcion: str
+    pasos: str
+
+
+class Intencion(NamedTuple):
+    nombre: str
+    guia: Optional[Guia] = None
+
+
+def frases_de(palabras_clave):
+    """Separa GuiaUsuario.palabras_clave en frases normalizadas."""
+    return [frase.strip().lower() for frase in re.split(r'[,;\n]', palabras_clave or '') if frase.strip()]
+
+
+class IndiceIntenciones:
+    def __init__(self, guias, version=None):
+        """`guias` son diccionarios con titulo, descripcion, pasos y palabras_clave, ordenados por prioridad."""
+        self.version = version
+        self.guias_por_frase = {}
+        for guia in guias:
+            contenido = Guia(guia['titulo'], guia['descripcion'] or '', guia['pasos'])
+            for frase in frases_de(guia['palabras_clave']):
+                self.guias_por_frase.setdefault(frase, contenido)
+        # Guía para cada intención de guía: la primera cuyas frases contienen la buscada
+        self.guias_por_intencion = {
+            intencion: next(
+                (g for frase_guia, g in self.guias_por_frase.items() if frase in frase_guia), None
+            )
+            for intencion, frase in FRASES_GUIA.items()
+        }
+
+        palabras = set(TEMAS) | set(self.guias_por_frase)
+        for _, grupos in REGLAS:
+            for grupo in grupos:
+                palabras.update(grupo)
+        # Si aparece una palabra, aparecen también las que contiene ("productos" -> "producto")
+        self.contenidas = {p: {q for q in palabras if q in p} for p in palabras}
+        # Las alternativas más largas primero y con lookahead: en cada posición del
+        # mensaje se obtiene la palabra más larga que empieza ahí, y con `contenidas`
+        # el resultado equivale a comprobar cada palabra por separado
+        alternativas = '|'.join(re.escape(p) for p in sorted(palabras, key=len, reverse=True))
+        self.patron = re.compile(f'(?=({alternativas}))')
+        self.temas = set(TEMAS) | set(self.guias_por_frase)
+
+    def palabras_en(self, mensaje):
+        encontradas = set()
+        for coincidencia in self.patron.finditer(mensaje.lower()):
+            encontradas |= self.contenidas[coincidencia.group(1)]
+        return encontradas
+
+    def clasificar(self, mensaje):
+        encontradas = self.palabras_en(mensaje)
+        if not encontradas & self.temas:
+            return Intencion('fuera_de_tema')
+        for nombre, grupos in REGLAS:
+            if all(encontradas.intersection(grupo) for grupo in grupos):
+                return Intencion(nombre, self.guias_por_intencion.get(nombre))
+        # Antes de recurrir a la IA, una guía cuyas frases aparezcan en el mensaje
+        guia = next((self.guias_por_frase[frase] for frase in self.guias_por_frase if frase in encontradas), None)
+        if guia:
+            return Intencion('guia', guia)
+        return Intencion('general')
+
+
+# --- ÍNDICE COMPARTIDO POR PROCESO ---
+_CLAVE_VERSION = 'asistente:version_guias'
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def _version_guias():
+    versiones = caches['compartida']
+    version = versiones.get(_CLAVE_VERSION)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not versiones.add(_CLAVE_VERSION, version, None):
+            version = versiones.get(_CLAVE_VERSION) or version
+    return version
+
+
+def indice():
+    """Devuelve el índice de intenciones, reconstruyéndolo si cambiaron las guías."""
+    global _indice
+    version = _version_guias()
+    if _indice is None or _indice.version != version:
+        from .models import GuiaUsuario
+        with _indice_lock:
+            if _indice is None or _indice.version != version:
+                guias = GuiaUsuario.objects.filter(activo=True).order_by('pk').values(
+                    'titulo', 'descripcion', 'pasos', 'palabras_clave'
+                )
+                _indice = IndiceIntenciones(list(guias), version)
+    return _indice
+
+
+def clasificar(mensaje):
+    return indice().clasificar(mensaje)
+
+
+def invalidar_guias():
+    """Cambia la versión de las guías al confirmar la transacción para que cada proceso reconstruya su índice."""
+    transaction.on_commit(lambda: caches['compartida'].set(_CLAVE_VERSION, uuid.uuid4().hex, None))
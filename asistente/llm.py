@@ -0,0 +1,403 @@
+# asistente/llm.py
+"""
+Configuración, límites y llamadas en streaming a los proveedores de IA del asistente.
+
+Cada proveedor tiene su configuración (ASISTENTE_PROVEEDORES en settings, sobre
+PROVEEDORES_POR_DEFECTO y LIMITES_POR_DEFECTO): URL base y modelo, segundos
+máximos sin recibir datos, duración máxima de una respuesta, llamadas simultáneas
+por proceso, segundos de espera por un turno libre, reintentos y el circuito.
+
+- Si el proveedor sigue saturado pasado el tiempo de espera se lanza
+  ProveedorOcupadoError en lugar de acumular peticiones bloqueadas.
+- Tras `umbral_fallos` fallos seguidos el circuito se abre: durante `enfriamiento`
+  segundos las llamadas fallan de inmediato con ProveedorNoDisponibleError, y luego
+  se deja pasar una llamada de prueba.
+- Cada llamada registra su latencia y sus tokens en las métricas del proveedor.
+
+Las llamadas síncronas están en asistente/proveedores.py; stream_respuesta() pide
+la respuesta en streaming con aiohttp y entrega el texto a medida que llega. Como
+el cliente síncrono, reutiliza las conexiones (una ClientSession por proveedor y
+event loop, que se cierran con cerrar_sesiones() al apagar el servidor ASGI) y
+reintenta con backoff exponencial los errores de conexión y las respuestas 429/5xx
+mientras abre el stream, antes de recibir el primer byte.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+
+import aiohttp
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LIMITES_POR_DEFECTO = {
+    'timeout': 30, 'timeout_total': 180, 'concurrencia': 2, 'espera': 5,
+    'reintentos': 2, 'backoff': 0.5, 'umbral_fallos': 5, 'enfriamiento': 30,
+}
+
+# 'api' indica el formato: 'openai' (chat/completions, también DeepSeek) o 'gemini'
+PROVEEDORES_POR_DEFECTO = {
+    'openai': {'api': 'openai', 'url': 'https://api.openai.com/v1', 'modelo': 'gpt-3.5-turbo', 'clave_env': 'OPENAI_API_KEY'},
+    'deepseek': {'api': 'openai', 'url': 'https://api.deepseek.com', 'modelo': 'deepseek-chat', 'clave_env': 'deepseek_API_KEY'},
+    'gemini': {
+        'api': 'gemini', 'url': 'https://generativelanguage.googleapis.com/v1beta',
+        'modelo': 'gemini-1.5-flash', 'clave_env': 'GEMINI_API_KEY',
+    },
+}
+PROVEEDORES = list(PROVEEDORES_POR_DEFECTO)
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+
+class SolicitudIA(NamedTuple):
+    """Respuesta que debe generar un modelo de IA a partir de `prompt`; `markdown` indica si se convierte a HTML."""
+    prompt: str
+    markdown: bool = True
+
+
+class ProveedorError(Exception):
+    """El proveedor respondió con un error, no respondió a tiempo o no existe."""
+
+
+class ProveedorOcupadoError(ProveedorError):
+    """El proveedor ya tiene el máximo de llamadas simultáneas y no se liberó un turno a tiempo."""
+
+
+class ProveedorNoDisponibleError(ProveedorError):
+    """El circuito del proveedor está abierto por fallos recientes."""
+
+
+def configuracion(proveedor):
+    if proveedor not in PROVEEDORES_POR_DEFECTO:
+        raise ProveedorError(f"Proveedor desconocido: {proveedor}")
+    configurados = getattr(settings, 'ASISTENTE_PROVEEDORES', {}).get(proveedor, {})
+    return {**LIMITES_POR_DEFECTO, **PROVEEDORES_POR_DEFECTO[proveedor], **configurados}
+
+
+# --- ESTADO POR PROVEEDOR: TURNOS, CIRCUITO Y MÉTRICAS ---
+
+class Circuito:
+    def __init__(self, umbral_fallos, enfriamiento):
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            if self.fallos < self.umbral_fallos:
+                return True
+            ahora = time.monotonic()
+            if ahora < self.abierto_hasta:
+                return False
+            # Semiabierto: una sola llamada de prueba por cada periodo de enfriamiento
+            self.abierto_hasta = ahora + self.enfriamiento
+            return True
+
+    def exito(self):
+        with self._lock:
+            self.fallos = 0
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            if self.fallos >= self.umbral_fallos:
+                self.abierto_hasta = time.monotonic() + self.enfriamiento
+
+    @property
+    def abierto(self):
+        return self.fallos >= self.umbral_fallos
+
+
+class MetricasProveedor:
+    CONTADORES = ('llamadas', 'errores', 'cancelados', 'ocupado', 'circuito_abierto', 'tokens_prompt', 'tokens_respuesta')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = dict.fromkeys(self.CONTADORES, 0)
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+
+    def contar(self, contador, cantidad=1):
+        with self._lock:
+            self._contadores[contador] += cantidad
+
+    def registrar(self, latencia, tokens_prompt=0, tokens_respuesta=0, error=False):
+        with self._lock:
+            self._contadores['llamadas'] += 1
+            self._contadores['errores'] += int(error)
+            self._contadores['tokens_prompt'] += tokens_prompt or 0
+            self._contadores['tokens_respuesta'] += tokens_respuesta or 0
+            self._latencia_total += latencia
+            self._latencia_max = max(self._latencia_max, latencia)
+
+    def resumen(self):
+        with self._lock:
+            llamadas = self._contadores['llamadas']
+            return {
+                **self._contadores,
+                'latencia_media_ms': round(self._latencia_total / llamadas * 1000) if llamadas else 0,
+                'latencia_max_ms': round(self._latencia_max * 1000),
+            }
+
+
+class EstadoProveedor:
+    """Semáforo, circuito y métricas de un proveedor, compartidos por las llamadas síncronas y asíncronas del proceso."""
+
+    def __init__(self, nombre):
+        config = configuracion(nombre)
+        self.nombre = nombre
+        self.semaforo = threading.BoundedSemaphore(config['concurrencia'])
+        self.circuito = Circuito(config['umbral_fallos'], config['enfriamiento'])
+        self.metricas = MetricasProveedor()
+
+    def verificar_circuito(self):
+        if not self.circuito.permitir():
+            self.metricas.contar('circuito_abierto')
+            raise ProveedorNoDisponibleError(
+                f"{self.nombre} no está disponible por fallos recientes. Intenta de nuevo en unos segundos."
+            )
+
+    def registrar(self, inicio, tokens=(0, 0), error=None):
+        latencia = time.monotonic() - inicio
+        self.metricas.registrar(latencia, *tokens, error=error is not None)
+        if error is None:
+            self.circuito.exito()
+        else:
+            self.circuito.fallo()
+        logger.info(
+            "proveedor=%s latencia_ms=%d tokens_prompt=%s tokens_respuesta=%s error=%s",
+            self.nombre, latencia * 1000, tokens[0], tokens[1], error,
+        )
+
+    def cancelada(self, inicio):
+        """La llamada se cortó antes de terminar (el cliente se desconectó): no es éxito ni fallo del proveedor."""
+        self.metricas.contar('cancelados')
+        logger.info("proveedor=%s latencia_ms=%d cancelada", self.nombre, (time.monotonic() - inicio) * 1000)
+
+
+_estados = {}
+_estados_lock = threading.Lock()
+
+
+def estado_proveedor(nombre):
+    with _estados_lock:
+        if nombre not in _estados:
+            _estados[nombre] = EstadoProveedor(nombre)
+        return _estados[nombre]
+
+
+def metricas_proveedores():
+    with _estados_lock:
+        estados = list(_estados.values())
+    return {
+        estado.nombre: {**estado.metricas.resumen(), 'circuito_abierto_ahora': estado.circuito.abierto}
+        for estado in estados
+    }
+
+
+def reiniciar_estados():
+    """Descarta semáforos, circuitos y métricas (por ejemplo, tras cambiar la configuración)."""
+    with _estados_lock:
+        _estados.clear()
+
+
+def _mensaje_ocupado(proveedor):
+    return f"El asistente está atendiendo muchas consultas con {proveedor}. Intenta de nuevo en unos segundos."
+
+
+@contextmanager
+def turno(proveedor):
+    """Ocupa un turno del proveedor durante una llamada síncrona."""
+    estado = estado_proveedor(proveedor)
+    if not estado.semaforo.acquire(timeout=configuracion(proveedor)['espera']):
+        estado.metricas.contar('ocupado')
+        raise ProveedorOcupadoError(_mensaje_ocupado(proveedor))
+    try:
+        yield
+    finally:
+        estado.semaforo.release()
+
+
+async def _esperar_turno(semaforo, espera):
+    # Se sondea sin bloquear el event loop; cancelar la espera nunca deja un turno tomado
+    limite = time.monotonic() + espera
+    while not semaforo.acquire(blocking=False):
+        if time.monotonic() >= limite:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+
+# --- FORMATO DE LAS PETICIONES Y RESPUESTAS ---
+
+def peticion(proveedor, prompt, stream=False):
+    """Devuelve (url, params, headers, cuerpo) para pedir la respuesta al proveedor."""
+    config = configuracion(proveedor)
+    clave = os.getenv(config['clave_env'], '')
+    url = config['url'].rstrip('/')
+    if config['api'] == 'gemini':
+        accion = 'streamGenerateContent' if stream else 'generateContent'
+        params = {'key': clave, **({'alt': 'sse'} if stream else {})}
+        cuerpo = {'contents': [{'parts': [{'text': prompt}]}]}
+        return f"{url}/models/{config['modelo']}:{accion}", params, {}, cuerpo
+    cuerpo = {'model': config['modelo'], 'messages': [{'role': 'user', 'content': prompt}]}
+    if stream:
+        cuerpo.update(stream=True, stream_options={'include_usage': True})
+    return f"{url}/chat/completions", None, {'Authorization': f"Bearer {clave}"}, cuerpo
+
+
+def texto_de(api, datos, stream=False):
+    """Texto de una respuesta completa o de un evento del stream."""
+    if api == 'gemini':
+        return ''.join(
+            parte.get('text') or ''
+            for candidato in datos.get('candidates') or []
+            for parte in (candidato.get('content') or {}).get('parts') or []
+        )
+    clave = 'delta' if stream else 'message'
+    return ''.join((opcion.get(clave) or {}).get('content') or '' for opcion in datos.get('choices') or [])
+
+
+def tokens_de(api, datos):
+    """(tokens del prompt, tokens de la respuesta) informados por el proveedor, si los incluye."""
+    if api == 'gemini':
+        uso = datos.get('usageMetadata') or {}
+        return uso.get('promptTokenCount', 0), uso.get('candidatesTokenCount', 0)
+    uso = datos.get('usage') or {}
+    return uso.get('prompt_tokens', 0), uso.get('completion_tokens', 0)
+
+
+async def _eventos_sse(respuesta):
+    """Recorre las líneas 'data:' de una respuesta SSE y devuelve cada evento JSON."""
+    async for linea in respuesta.content:
+        linea = linea.decode('utf-8').strip()
+        if not linea.startswith('data:'):
+            continue
+        datos = linea[len('data:'):].strip()
+        if datos == '[DONE]':
+            return
+        try:
+            yield json.loads(datos)
+        except ValueError:
+            continue
+
+
+# --- SESIONES Y REINTENTOS DEL STREAMING ---
+# aiohttp ata cada ClientSession a su event loop: con uvicorn hay una por proveedor;
+# async_to_sync (WSGI, pruebas) crea un loop por llamada y sus sesiones se descartan
+# cuando ese loop ya se cerró.
+_sesiones = {}
+_sesiones_lock = threading.Lock()
+
+
+def _sesion(proveedor, config):
+    loop = asyncio.get_running_loop()
+    with _sesiones_lock:
+        for clave in [clave for clave in _sesiones if clave[1].is_closed()]:
+            _sesiones.pop(clave).detach()
+        sesion = _sesiones.get((proveedor, loop))
+        if sesion is None or sesion.closed:
+            conector = aiohttp.TCPConnector(limit=config['concurrencia'])
+            sesion = _sesiones[(proveedor, loop)] = aiohttp.ClientSession(connector=conector)
+        return sesion
+
+
+async def cerrar_sesiones():
+    """Cierra las sesiones HTTP del event loop actual (al apagar el servidor ASGI)."""
+    loop = asyncio.get_running_loop()
+    with _sesiones_lock:
+        sesiones = [_sesiones.pop(clave) for clave in list(_sesiones) if clave[1] is loop]
+    for sesion in sesiones:
+        await sesion.close()
+
+
+def _espera_reintento(config, intento, respuesta=None):
+    # Se respeta Retry-After (429/503) sin esperar más que el timeout de la llamada
+    retry_after = respuesta.headers.get('Retry-After', '') if respuesta is not None else ''
+    if retry_after.isdigit():
+        return min(int(retry_after), config['timeout'])
+    return config['backoff'] * 2 ** intento
+
+
+async def _abrir_stream(sesion, config, url, params, headers, cuerpo, timeout):
+    """
+    Envía la petición y devuelve la respuesta sin leer su cuerpo. Reintenta los errores
+    de conexión y los 429/5xx; un timeout no se reintenta: duplicaría la espera del usuario.
+    """
+    for intento in range(config['reintentos'] + 1):
+        ultimo = intento == config['reintentos']
+        try:
+            respuesta = await sesion.post(url, params=params, headers=headers, json=cuerpo, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise
+        except aiohttp.ClientConnectionError:
+            if ultimo:
+                raise
+            await asyncio.sleep(_espera_reintento(config, intento))
+            continue
+        if ultimo or respuesta.status not in ESTADOS_REINTENTABLES:
+            return respuesta
+        espera = _espera_reintento(config, intento, respuesta)
+        # Devuelve la conexión al pool para el siguiente intento
+        respuesta.release()
+        await asyncio.sleep(espera)
+
+
+async def stream_respuesta(prompt, proveedor='openai'):
+    """
+    Generador asíncrono con los fragmentos de texto de la respuesta del proveedor.
+    Lanza ProveedorOcupadoError si no hay turno libre y ProveedorError si la llamada falla.
+    """
+    config = configuracion(proveedor)
+    estado = estado_proveedor(proveedor)
+    estado.verificar_circuito()
+    if not await _esperar_turno(estado.semaforo, config['espera']):
+        estado.metricas.contar('ocupado')
+        raise ProveedorOcupadoError(_mensaje_ocupado(proveedor))
+    inicio = time.monotonic()
+    tokens = (0, 0)
+    error = None
+    cancelada = False
+    try:
+        url, params, headers, cuerpo = peticion(proveedor, prompt, stream=True)
+        timeout = aiohttp.ClientTimeout(
+            total=config['timeout_total'], sock_connect=config['timeout'], sock_read=config['timeout'],
+        )
+        sesion = _sesion(proveedor, config)
+        async with await _abrir_stream(sesion, config, url, params, headers, cuerpo, timeout) as respuesta:
+            if respuesta.status >= 400:
+                detalle = (await respuesta.text())[:200]
+                raise ProveedorError(f"{proveedor} respondió {respuesta.status}: {detalle}")
+            async for evento in _eventos_sse(respuesta):
+                tokens = tuple(max(a, b) for a, b in zip(tokens, tokens_de(config['api'], evento)))
+                texto = texto_de(config['api'], evento, stream=True)
+                if texto:
+                    yield texto
+    except asyncio.TimeoutError:
+        error = ProveedorError(f"{proveedor} no respondió a tiempo.")
+        raise error
+    except aiohttp.ClientError as e:
+        error = ProveedorError(f"Error con {proveedor}: {e}")
+        raise error
+    except ProveedorError as e:
+        error = e
+        raise
+    except (GeneratorExit, asyncio.CancelledError):
+        # El cliente se desconectó a mitad de la respuesta: no cierra un circuito semiabierto
+        cancelada = True
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        estado.semaforo.release()
+        if cancelada:
+            estado.cancelada(inicio)
+        else:
+            estado.registrar(inicio, tokens, error)
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:06
+
+import markdown
+from django.db import migrations, models
+
+
+def renderizar_mensajes_existentes(apps, schema_editor):
+    Mensaje = apps.get_model('asistente', 'Mensaje')
+    pendientes = []
+    for mensaje in Mensaje.objects.filter(es_usuario=False).only('id', 'contenido').iterator(chunk_size=500):
+        mensaje.contenido_html = markdown.markdown(mensaje.contenido, extensions=['extra'])
+        pendientes.append(mensaje)
+        if len(pendientes) >= 500:
+            Mensaje.objects.bulk_update(pendientes, ['contenido_html'])
+            pendientes = []
+    if pendientes:
+        Mensaje.objects.bulk_update(pendientes, ['contenido_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("asistente", "0002_guiausuario"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mensaje",
+            name="contenido_html",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddIndex(
+            model_name="mensaje",
+            index=models.Index(fields=["conversacion", "-id"], name="mensaje_conversacion_id_idx"),
+        ),
+        migrations.RunPython(renderizar_mensajes_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("asistente", "0003_mensaje_contenido_html"),
+        ("cuentas", "0026_mipyme_variantes_imagen"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SesionConsulta",
+            fields=[
+                ("pid", models.IntegerField(primary_key=True, serialize=False)),
+                ("mipyme", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="+", to="cuentas.mipyme")),
+            ],
+        ),
+    ]
@@ -1,5 +1,10 @@
+import markdown
 from django.db import models
-from cuentas.models import Usuario
+from cuentas.models import Mipyme, Usuario
+
+
+def renderizar_markdown(texto):
+    return markdown.markdown(texto, extensions=['extra'])
 
 class Conversacion(models.Model):
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='conversaciones')
@@ -14,6 +19,21 @@ class Mensaje(models.Model):
     contenido = models.TextField()
     es_usuario = models.BooleanField(default=True)  # True si es mensaje del usuario, False si es respuesta del asistente
     fecha = models.DateTimeField(auto_now_add=True)
+    # HTML de las respuestas del asistente, renderizado una sola vez al guardar
+    contenido_html = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Paginación del historial de la conversación del más reciente al más antiguo
+            models.Index(fields=['conversacion', '-id'], name='mensaje_conversacion_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.es_usuario:
+            self.contenido_html = renderizar_markdown(self.contenido)
+            if kwargs.get('update_fields') is not None and 'contenido' in kwargs['update_fields']:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'contenido_html'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         tipo = "Usuario" if self.es_usuario else "Asistente"
@@ -28,3 +48,12 @@ class GuiaUsuario(models.Model):
 
     def __str__(self):
         return self.titulo
+
+class SesionConsulta(models.Model):
+    """
+    Mipyme a la que está acotada cada conexión del rol de solo lectura que ejecuta el
+    SQL del chat: las vistas del esquema asistente_consultas filtran por la fila de
+    su pg_backend_pid() (ver asistente/sandbox.py). Ese rol no puede escribir aquí.
+    """
+    pid = models.IntegerField(primary_key=True)
+    mipyme = models.ForeignKey(Mipyme, on_delete=models.CASCADE, related_name='+')
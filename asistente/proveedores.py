@@ -0,0 +1,100 @@
+# asistente/proveedores.py
+"""
+Cliente síncrono de los proveedores de IA del asistente.
+
+Cada proveedor tiene un cliente por proceso con una requests.Session persistente:
+las conexiones HTTP (y el handshake TLS) se reutilizan entre turnos del chat en
+lugar de abrirse en cada mensaje. La sesión reintenta con backoff exponencial los
+errores de conexión y las respuestas 429/5xx; los turnos, el circuito y las
+métricas son los de asistente/llm.py, compartidos con el streaming.
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .llm import ESTADOS_REINTENTABLES, ProveedorError, configuracion, estado_proveedor, peticion, reiniciar_estados, texto_de, tokens_de, turno
+
+
+class ClienteProveedor:
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.config = configuracion(nombre)
+        reintentos = Retry(
+            total=self.config['reintentos'],
+            connect=self.config['reintentos'],
+            status=self.config['reintentos'],
+            # Un timeout de lectura no se reintenta: duplicaría la espera del usuario
+            read=0,
+            backoff_factor=self.config['backoff'],
+            status_forcelist=ESTADOS_REINTENTABLES,
+            allowed_methods=frozenset({'POST'}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=self.config['concurrencia'], max_retries=reintentos)
+        self.sesion = requests.Session()
+        self.sesion.headers['Content-Type'] = 'application/json'
+        self.sesion.mount('https://', adaptador)
+        self.sesion.mount('http://', adaptador)
+
+    def completar(self, prompt):
+        """Devuelve el texto de la respuesta; lanza ProveedorError (o sus subclases) si falla."""
+        estado = estado_proveedor(self.nombre)
+        estado.verificar_circuito()
+        with turno(self.nombre):
+            inicio = time.monotonic()
+            url, params, headers, cuerpo = peticion(self.nombre, prompt)
+            try:
+                respuesta = self.sesion.post(
+                    url, params=params, headers=headers, json=cuerpo,
+                    timeout=(self.config['timeout'], self.config['timeout_total']),
+                )
+                if respuesta.status_code >= 400:
+                    raise ProveedorError(f"{self.nombre} respondió {respuesta.status_code}: {respuesta.text[:200]}")
+                datos = respuesta.json()
+                texto = texto_de(self.config['api'], datos)
+            except requests.Timeout as e:
+                error = ProveedorError(f"{self.nombre} no respondió a tiempo.")
+                estado.registrar(inicio, error=error)
+                raise error from e
+            except (requests.RequestException, ValueError) as e:
+                error = ProveedorError(f"Error con {self.nombre}: {e}")
+                estado.registrar(inicio, error=error)
+                raise error from e
+            except ProveedorError as e:
+                estado.registrar(inicio, error=e)
+                raise
+            estado.registrar(inicio, tokens_de(self.config['api'], datos))
+            return texto
+
+    def cerrar(self):
+        self.sesion.close()
+
+
+_clientes = {}
+_clientes_lock = threading.Lock()
+
+
+def cliente(nombre):
+    with _clientes_lock:
+        if nombre not in _clientes:
+            _clientes[nombre] = ClienteProveedor(nombre)
+        return _clientes[nombre]
+
+
+def completar(prompt, proveedor='openai'):
+    """Respuesta completa del proveedor para `prompt`."""
+    return cliente(proveedor).completar(prompt)
+
+
+def reiniciar():
+    """Cierra las sesiones y descarta el estado de los proveedores; se recrean con la configuración actual."""
+    with _clientes_lock:
+        clientes = list(_clientes.values())
+        _clientes.clear()
+    for c in clientes:
+        c.cerrar()
+    reiniciar_estados()
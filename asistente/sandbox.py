@@ -0,0 +1,491 @@
+# asistente/sandbox.py
+"""
+Ejecución aislada de las consultas SQL, el código y los gráficos que se piden en el chat.
+
+Nada de eso corre en el hilo que atiende la petición: se envía a un pool de
+procesos iniciados con 'spawn', con límites por tarea (ver ASISTENTE_SANDBOX en
+settings):
+
+- tiempo de CPU (RLIMIT_CPU) y de reloj (SIGALRM), y memoria (RLIMIT_AS);
+- las consultas SQL corren en una transacción de solo lectura con statement_timeout
+  y se leen con fetchmany hasta un máximo de filas;
+- el código y los gráficos corren en otro pool, sin Django configurado.
+
+En PostgreSQL el SQL del chat corre con un rol propio (base de datos 'asistente',
+ASISTENTE_DATABASE_URL) sin permisos sobre las tablas de la aplicación: solo puede
+leer las vistas del esquema asistente_consultas, una por tabla de
+TABLAS_CONSULTABLES, que filtran a la Mipyme registrada en SesionConsulta para el
+pg_backend_pid() de su conexión. El aislamiento lo dan los permisos del rol, no el
+texto de la consulta: funciones como query_to_xml o los identificadores U&"..."
+tampoco llegan a otras tablas. Las vistas se recrean en cada migrate
+(crear_vistas_consultables). Sin ese rol configurado el SQL del chat no se ejecuta.
+En SQLite (desarrollo y pruebas) las tablas se acotan con CTEs sobre la conexión
+principal.
+
+El pool de código no es un límite de seguridad para los secretos del servidor:
+vaciar os.environ no impide que el código lea archivos como .env o
+/proc/<pid>/environ, ni que use os o subprocess. Solo se limitan sus recursos.
+
+Cada proceso de trabajo atiende una tarea a la vez. Si una tarea no termina a
+tiempo o su proceso muere (por ejemplo, por exceder la memoria) solo se reemplaza
+ese proceso: las tareas de otros usuarios siguen en los suyos.
+"""
+import base64
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LIMITES_POR_DEFECTO = {
+    'procesos': 2,
+    'cpu_segundos': 5,
+    'reloj_segundos': 10,
+    'memoria_mb': 1536,
+    'max_filas': 200,
+    'max_caracteres': 4000,
+    # Ejecuta en el mismo proceso, sin pool (pruebas y desarrollo)
+    'en_proceso': False,
+}
+
+# Tablas que se pueden consultar: nombre en la consulta -> (modelo, condición que la limita a la Mipyme)
+TABLAS_CONSULTABLES = {
+    'productos': ('produccion.Producto', 't.mipyme_id = {mipyme}'),
+    'insumos': ('produccion.Insumo', 't.mipyme_id = {mipyme}'),
+    'procesos': ('produccion.Proceso', 't.mipyme_id = {mipyme}'),
+    'impuestos': ('produccion.Impuesto', 't.mipyme_id = {mipyme}'),
+    'ventas': ('produccion.Venta', 't.mipyme_id = {mipyme}'),
+    'resumen_ventas': ('produccion.ResumenVentasMensual', 't.mipyme_id = {mipyme}'),
+    'venta_items': ('produccion.VentaItem', 't.venta_id IN (SELECT id FROM produccion_venta WHERE mipyme_id = {mipyme})'),
+    'formulaciones': ('produccion.Formulacion', 't.producto_id IN (SELECT id FROM produccion_producto WHERE mipyme_id = {mipyme})'),
+    'pasos_produccion': ('produccion.PasoDeProduccion', 't.producto_id IN (SELECT id FROM produccion_producto WHERE mipyme_id = {mipyme})'),
+}
+# Base de datos (rol de solo lectura) y esquema de vistas del SQL del chat en PostgreSQL
+BASE_DATOS_CONSULTAS = 'asistente'
+ESQUEMA_CONSULTAS = 'asistente_consultas'
+# Catálogos del sistema que nunca se pueden nombrar en una consulta
+_PROHIBIDOS = re.compile(r'\b(pg_\w*|information_schema|sqlite_\w*)\b', re.IGNORECASE)
+# Variables de entorno que conserva el pool de código
+_ENTORNO_CODIGO = ('PATH', 'HOME', 'LANG', 'TMPDIR', 'MPLCONFIGDIR')
+
+
+class ConsultaNoPermitidaError(Exception):
+    """La consulta no es una única sentencia SELECT sobre las tablas permitidas."""
+
+
+class LimiteExcedidoError(Exception):
+    """La tarea superó su tiempo de CPU o de reloj."""
+
+
+class TareaNoDisponibleError(Exception):
+    """No hubo un proceso libre para la tarea a tiempo; se puede reintentar."""
+
+
+def limites():
+    return {**LIMITES_POR_DEFECTO, **getattr(settings, 'ASISTENTE_SANDBOX', {})}
+
+
+# --- LÍMITES DENTRO DEL PROCESO DE TRABAJO ---
+
+def _limite_excedido(signum, frame):
+    raise LimiteExcedidoError("La tarea superó el tiempo máximo permitido.")
+
+
+def _aplicar_limites_proceso(config):
+    import resource
+    memoria = config['memoria_mb'] * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memoria, memoria))
+    # SIGXCPU llega al superar el límite de CPU; si el código lo ignora, ejecutar() descarta el proceso
+    signal.signal(signal.SIGXCPU, _limite_excedido)
+    signal.signal(signal.SIGALRM, _limite_excedido)
+
+
+@contextlib.contextmanager
+def _limites_tarea(config):
+    """Limita el tiempo de CPU y de reloj de una tarea dentro del proceso de trabajo."""
+    if config['en_proceso']:
+        # Sin pool no hay un proceso propio al que limitar
+        yield
+        return
+    import resource
+    usado = resource.getrusage(resource.RUSAGE_SELF)
+    # RLIMIT_CPU cuenta todo el tiempo del proceso: el límite se corre en cada tarea
+    blando = int(usado.ru_utime + usado.ru_stime) + config['cpu_segundos']
+    _, duro = resource.getrlimit(resource.RLIMIT_CPU)
+    if duro != resource.RLIM_INFINITY:
+        blando = min(blando, duro)
+    resource.setrlimit(resource.RLIMIT_CPU, (blando, duro))
+    signal.alarm(config['reloj_segundos'])
+    try:
+        yield
+    finally:
+        signal.alarm(0)
+        resource.setrlimit(resource.RLIMIT_CPU, (duro, duro))
+
+
+def _inicializar_sql(config):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mipymes_project.settings')
+    import django
+    django.setup()
+    _aplicar_limites_proceso(config)
+
+
+def _inicializar_codigo(config):
+    for variable in list(os.environ):
+        if variable not in _ENTORNO_CODIGO:
+            del os.environ[variable]
+    os.environ.update({'MPLBACKEND': 'Agg', 'OPENBLAS_NUM_THREADS': '1', 'OMP_NUM_THREADS': '1'})
+    _aplicar_limites_proceso(config)
+
+
+# --- TAREAS ---
+
+def _validar_consulta(consulta):
+    import sqlparse
+    sentencias = [s for s in sqlparse.parse(consulta.strip().rstrip(';')) if str(s).strip()]
+    if len(sentencias) != 1 or sentencias[0].get_type() != 'SELECT':
+        raise ConsultaNoPermitidaError("Solo se permite una consulta SELECT.")
+    if _PROHIBIDOS.search(consulta):
+        raise ConsultaNoPermitidaError("La consulta no puede leer tablas del sistema.")
+
+    from django.db import connection
+    reales = set(connection.introspection.table_names())
+    nombradas = {palabra.lower() for palabra in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', consulta)}
+    if nombradas & reales:
+        raise ConsultaNoPermitidaError(
+            "Consulta las tablas por su nombre en el asistente: " + ', '.join(sorted(TABLAS_CONSULTABLES)) + "."
+        )
+    return str(sentencias[0]).strip()
+
+
+def _consulta_acotada(consulta, mipyme_id):
+    """
+    Antepone una CTE por cada tabla permitida, filtrada a la Mipyme, con el nombre
+    que usa la consulta. Devuelve (sql, params).
+    """
+    from django.apps import apps
+    ctes, params = [], []
+    for nombre, (modelo, condicion) in TABLAS_CONSULTABLES.items():
+        tabla = apps.get_model(modelo)._meta.db_table
+        ctes.append(f'{nombre} AS (SELECT t.* FROM {tabla} t WHERE {condicion.format(mipyme="%s")})')
+        params.append(mipyme_id)
+    # Los % de la consulta del usuario son literales, no parámetros
+    consulta = consulta.replace('%', '%%')
+    recursiva = ''
+    coincidencia = re.match(r'\s*WITH\s+(RECURSIVE\s+)?', consulta, re.IGNORECASE)
+    if coincidencia:
+        recursiva = 'RECURSIVE ' if coincidencia.group(1) else ''
+        return f"WITH {recursiva}{', '.join(ctes)}, {consulta[coincidencia.end():]}", params
+    return f"WITH {', '.join(ctes)} {consulta}", params
+
+
+def _solo_lectura(cursor, vendor, config):
+    if vendor == 'postgresql':
+        cursor.execute('SET TRANSACTION READ ONLY')
+        cursor.execute('SET LOCAL statement_timeout = %s', [config['reloj_segundos'] * 1000])
+        cursor.execute(f'SET LOCAL search_path TO {ESQUEMA_CONSULTAS}')
+    elif vendor == 'sqlite':
+        cursor.execute('PRAGMA query_only = ON')
+
+
+def _conexion_consultas():
+    from django.db import connections
+    if BASE_DATOS_CONSULTAS not in settings.DATABASES:
+        raise ConsultaNoPermitidaError(
+            "Las consultas SQL del asistente necesitan su rol de solo lectura (ASISTENTE_DATABASE_URL)."
+        )
+    return connections[BASE_DATOS_CONSULTAS]
+
+
+@contextlib.contextmanager
+def _sesion_mipyme(conexion, mipyme_id):
+    """Acota las vistas del esquema de consultas a la Mipyme mientras dura la consulta."""
+    from .models import SesionConsulta
+    with conexion.cursor() as cursor:
+        cursor.execute('SELECT pg_backend_pid()')
+        pid = cursor.fetchone()[0]
+    # Se escribe con la conexión principal: el rol de consultas no tiene permisos sobre la tabla
+    SesionConsulta.objects.update_or_create(pid=pid, defaults={'mipyme_id': mipyme_id})
+    try:
+        yield
+    finally:
+        SesionConsulta.objects.filter(pid=pid).delete()
+
+
+def ejecutar_sql(consulta, mipyme_id, config):
+    """Tarea del pool SQL: devuelve (columnas, filas, truncado)."""
+    from django.db import connection, transaction
+    consulta = _validar_consulta(consulta)
+    if connection.vendor == 'postgresql':
+        conexion = _conexion_consultas()
+        sql, params = consulta, None
+        sesion = _sesion_mipyme(conexion, mipyme_id)
+    else:
+        conexion = connection
+        sql, params = _consulta_acotada(consulta, mipyme_id)
+        sesion = contextlib.nullcontext()
+    with _limites_tarea(config), sesion, transaction.atomic(using=conexion.alias):
+        with conexion.cursor() as cursor:
+            _solo_lectura(cursor, conexion.vendor, config)
+            try:
+                cursor.execute(sql, params)
+                columnas = [columna[0] for columna in cursor.description]
+                filas = []
+                while len(filas) <= config['max_filas']:
+                    lote = cursor.fetchmany(min(100, config['max_filas'] + 1 - len(filas)))
+                    if not lote:
+                        break
+                    filas.extend(tuple(fila) for fila in lote)
+            finally:
+                if conexion.vendor == 'sqlite':
+                    cursor.execute('PRAGMA query_only = OFF')
+    truncado = len(filas) > config['max_filas']
+    return columnas, filas[:config['max_filas']], truncado
+
+
+# --- VISTAS POR MIPYME (POSTGRESQL) ---
+
+def sentencias_vistas_consultables():
+    """SQL que crea el esquema de consultas con una vista por tabla de TABLAS_CONSULTABLES."""
+    from django.apps import apps
+    from .models import SesionConsulta
+    mipyme = (
+        f'(SELECT s.mipyme_id FROM {SesionConsulta._meta.db_table} s WHERE s.pid = pg_backend_pid())'
+    )
+    sentencias = [f'CREATE SCHEMA {ESQUEMA_CONSULTAS}']
+    for nombre, (modelo, condicion) in TABLAS_CONSULTABLES.items():
+        tabla = apps.get_model(modelo)._meta.db_table
+        # security_barrier: los filtros de la consulta del usuario se evalúan después que el de la Mipyme
+        sentencias.append(
+            f'CREATE VIEW {ESQUEMA_CONSULTAS}.{nombre} WITH (security_barrier) AS '
+            f'SELECT t.* FROM {tabla} t WHERE {condicion.format(mipyme=mipyme)}'
+        )
+    return sentencias
+
+
+def eliminar_vistas_consultables(conexion):
+    """Las vistas dependen de las columnas de las tablas: se quitan antes de migrar."""
+    if conexion.vendor == 'postgresql':
+        with conexion.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {ESQUEMA_CONSULTAS} CASCADE')
+
+
+def crear_vistas_consultables(conexion):
+    """Recrea las vistas y da permiso de lectura sobre ellas, y nada más, al rol de consultas."""
+    if conexion.vendor != 'postgresql':
+        return
+    from django.apps import apps
+    from .models import SesionConsulta
+    necesarias = {SesionConsulta._meta.db_table} | {apps.get_model(m)._meta.db_table for m, _ in TABLAS_CONSULTABLES.values()}
+    if not necesarias <= set(conexion.introspection.table_names()):
+        # Base migrada solo en parte: se crean en el próximo migrate completo
+        return
+    rol = settings.DATABASES.get(BASE_DATOS_CONSULTAS, {}).get('USER')
+    with conexion.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {ESQUEMA_CONSULTAS} CASCADE')
+        for sentencia in sentencias_vistas_consultables():
+            cursor.execute(sentencia)
+        if not rol:
+            return
+        cursor.execute('SELECT 1 FROM pg_roles WHERE rolname = %s', [rol])
+        if cursor.fetchone() is None:
+            logger.warning("No existe el rol %s de ASISTENTE_DATABASE_URL: el SQL del chat no podrá leer las vistas.", rol)
+            return
+        rol = conexion.ops.quote_name(rol)
+        cursor.execute(f'GRANT USAGE ON SCHEMA {ESQUEMA_CONSULTAS} TO {rol}')
+        cursor.execute(f'GRANT SELECT ON ALL TABLES IN SCHEMA {ESQUEMA_CONSULTAS} TO {rol}')
+
+
+def _globales_codigo():
+    globales = {}
+    try:
+        import pandas as pd
+        globales['pd'] = pd
+    except ImportError:
+        pass
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        globales['plt'] = plt
+    except ImportError:
+        pass
+    return globales
+
+
+def ejecutar_codigo(codigo, config):
+    """Tarea del pool de código: ejecuta `codigo` y devuelve lo que imprimió, recortado."""
+    salida = io.StringIO()
+    with _limites_tarea(config), contextlib.redirect_stdout(salida):
+        exec(codigo, _globales_codigo())
+    return salida.getvalue()[:config['max_caracteres']]
+
+
+def generar_grafico(codigo, config):
+    """Tarea del pool de código: ejecuta `codigo` y devuelve la figura actual como PNG en base64."""
+    globales = _globales_codigo()
+    if 'plt' not in globales:
+        raise RuntimeError("matplotlib no está instalado.")
+    plt = globales['plt']
+    try:
+        with _limites_tarea(config):
+            exec(codigo, globales)
+            buf = io.BytesIO()
+            plt.savefig(buf, format='png')
+        return base64.b64encode(buf.getvalue()).decode('utf-8')
+    finally:
+        plt.close('all')
+
+
+# --- POOLS ---
+
+def _bucle_trabajador(conexion, inicializar, config):
+    inicializar(config)
+    while True:
+        try:
+            tarea = conexion.recv()
+        except EOFError:
+            return
+        if tarea is None:
+            return
+        funcion, args = tarea
+        try:
+            resultado = (True, funcion(*args))
+        except BaseException as e:
+            resultado = (False, e)
+        try:
+            conexion.send(resultado)
+        except Exception:
+            # El error original no se puede serializar (por ejemplo, uno del driver de la base)
+            conexion.send((False, RuntimeError(f"{type(resultado[1]).__name__}: {resultado[1]}")))
+
+
+class _Trabajador:
+    """Un proceso de trabajo y la conexión por la que recibe sus tareas."""
+
+    def __init__(self, tipo, config):
+        contexto = multiprocessing.get_context('spawn')
+        self.conexion, hijo = contexto.Pipe()
+        self.proceso = contexto.Process(
+            target=_bucle_trabajador, args=(hijo, _INICIALIZADORES[tipo], config), daemon=True,
+        )
+        self.proceso.start()
+        hijo.close()
+
+    def ejecutar(self, funcion, args, espera):
+        """Devuelve (ok, resultado o excepción); lanza TimeoutError si no respondió en `espera` segundos."""
+        self.conexion.send((funcion, args))
+        if not self.conexion.poll(espera):
+            raise TimeoutError
+        return self.conexion.recv()
+
+    def terminar(self, forzar=False):
+        if not forzar:
+            try:
+                self.conexion.send(None)
+            except OSError:
+                pass
+            self.proceso.join(1)
+        if self.proceso.is_alive():
+            self.proceso.kill()
+            self.proceso.join()
+        self.conexion.close()
+
+
+class _Pool:
+    """Hasta `procesos` trabajadores de un tipo; se crean al necesitarse y se reutilizan."""
+
+    def __init__(self, tipo, config):
+        self.tipo = tipo
+        self.config = config
+        self.turnos = threading.BoundedSemaphore(config['procesos'])
+        self.libres = []
+        self.cerrado = False
+        self._lock = threading.Lock()
+
+    def tomar(self):
+        # Esperar un proceso libre no cuenta para el límite de la tarea
+        if not self.turnos.acquire(timeout=self.config['reloj_segundos']):
+            raise TareaNoDisponibleError("El asistente está ejecutando muchas tareas. Intenta de nuevo en unos segundos.")
+        with self._lock:
+            if self.libres:
+                return self.libres.pop()
+        try:
+            return _Trabajador(self.tipo, self.config)
+        except BaseException:
+            self.turnos.release()
+            raise
+
+    def devolver(self, trabajador):
+        with self._lock:
+            if not self.cerrado:
+                self.libres.append(trabajador)
+                trabajador = None
+        if trabajador is not None:
+            trabajador.terminar()
+        self.turnos.release()
+
+    def descartar(self, trabajador):
+        trabajador.terminar(forzar=True)
+        self.turnos.release()
+
+    def cerrar(self):
+        """Termina los procesos libres; los ocupados terminan al devolverse."""
+        with self._lock:
+            self.cerrado = True
+            libres, self.libres = self.libres, []
+        for trabajador in libres:
+            trabajador.terminar()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_INICIALIZADORES = {'sql': _inicializar_sql, 'codigo': _inicializar_codigo}
+
+
+def _pool(tipo, config):
+    with _pools_lock:
+        if tipo not in _pools:
+            _pools[tipo] = _Pool(tipo, config)
+        return _pools[tipo]
+
+
+def ejecutar(tipo, funcion, *args):
+    """Ejecuta `funcion(*args, config)` en el pool `tipo` ('sql' o 'codigo') y devuelve su resultado."""
+    config = limites()
+    if config['en_proceso']:
+        return funcion(*args, config)
+    pool = _pool(tipo, config)
+    trabajador = pool.tomar()
+    try:
+        # Margen para que el proceso aplique sus propios límites antes de descartarlo
+        ok, resultado = trabajador.ejecutar(funcion, (*args, config), config['reloj_segundos'] + 5)
+    except TimeoutError:
+        # Solo se termina el proceso de esta tarea
+        pool.descartar(trabajador)
+        raise LimiteExcedidoError("La tarea superó el tiempo máximo permitido.")
+    except (EOFError, OSError):
+        pool.descartar(trabajador)
+        raise LimiteExcedidoError("La tarea superó los recursos permitidos y fue detenida.")
+    pool.devolver(trabajador)
+    if ok:
+        return resultado
+    if isinstance(resultado, MemoryError):
+        raise LimiteExcedidoError("La tarea superó la memoria permitida.")
+    raise resultado
+
+
+def cerrar_pools():
+    """Detiene los procesos de trabajo; los pools se vuelven a crear al usarse."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.cerrar()
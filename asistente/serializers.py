@@ -4,7 +4,7 @@ from .models import Mensaje, Conversacion
 class MensajeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Mensaje
-        fields = ['id', 'contenido', 'es_usuario', 'fecha']
+        fields = ['id', 'contenido', 'contenido_html', 'es_usuario', 'fecha']
 
 class ConversacionSerializer(serializers.ModelSerializer):
     mensajes = MensajeSerializer(many=True, read_only=True)
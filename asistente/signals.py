@@ -0,0 +1,27 @@
+# asistente/signals.py
+from django.db import connections
+from django.db.models.signals import post_save, post_delete, post_migrate, pre_migrate
+from django.dispatch import receiver
+from .models import GuiaUsuario
+from .intenciones import invalidar_guias
+from .sandbox import crear_vistas_consultables, eliminar_vistas_consultables
+
+@receiver(post_save, sender=GuiaUsuario)
+@receiver(post_delete, sender=GuiaUsuario)
+def recargar_indice_intenciones(sender, instance, **kwargs):
+    """
+    Las guías forman parte del índice de intenciones: cualquier cambio hace que
+    cada proceso lo reconstruya en su próximo mensaje.
+    """
+    invalidar_guias()
+
+@receiver(pre_migrate)
+def quitar_vistas_consultables(sender, using, **kwargs):
+    # Las vistas del SQL del chat impedirían borrar o cambiar las columnas que leen
+    if sender.name == 'asistente':
+        eliminar_vistas_consultables(connections[using])
+
+@receiver(post_migrate)
+def recrear_vistas_consultables(sender, using, **kwargs):
+    if sender.name == 'asistente':
+        crear_vistas_consultables(connections[using])
@@ -0,0 +1,70 @@
+# asistente/streaming.py
+"""
+Respuestas del asistente como Server-Sent Events.
+
+El navegador recibe un evento 'token' por cada fragmento de texto que llega del
+proveedor y un evento 'fin' con la respuesta completa, su HTML y el id de la
+conversación. El mensaje del asistente se guarda al terminar el stream.
+Las respuestas de IA completas se guardan en la caché de respuestas; si el mismo
+prompt ya está cacheado se envía de una vez sin llamar al proveedor.
+"""
+import json
+import time
+
+import markdown
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+
+from .cache_respuestas import cache_respuestas, clave_ia
+from .llm import ProveedorError, ProveedorOcupadoError, SolicitudIA, stream_respuesta
+from .models import Mensaje
+
+
+def evento_sse(nombre, datos):
+    return f"event: {nombre}\ndata: {json.dumps(datos)}\n\n"
+
+
+async def _eventos(conversacion, resultado, modelo, mipyme_id):
+    if isinstance(resultado, SolicitudIA):
+        clave = await sync_to_async(clave_ia)(mipyme_id, resultado.prompt, modelo) if mipyme_id else None
+        respuesta = cache_respuestas.obtener(clave) if clave else None
+        if respuesta is not None:
+            yield evento_sse('token', {'texto': respuesta})
+        else:
+            partes = []
+            inicio = time.monotonic()
+            try:
+                async for texto in stream_respuesta(resultado.prompt, modelo):
+                    partes.append(texto)
+                    yield evento_sse('token', {'texto': texto})
+                respuesta = ''.join(partes)
+                if clave:
+                    cache_respuestas.guardar(clave, respuesta, time.monotonic() - inicio)
+            except ProveedorOcupadoError as e:
+                respuesta = str(e)
+            except ProveedorError as e:
+                respuesta = ''.join(partes) or str(e)
+        if resultado.markdown:
+            respuesta = markdown.markdown(respuesta, extensions=['extra'])
+    else:
+        # Respuesta calculada con los datos de la Mipyme: se envía completa
+        respuesta = resultado
+        yield evento_sse('token', {'texto': respuesta})
+
+    mensaje = await sync_to_async(Mensaje.objects.create)(conversacion=conversacion, contenido=respuesta, es_usuario=False)
+    yield evento_sse('fin', {'respuesta': respuesta, 'html': mensaje.contenido_html, 'conversacion_id': conversacion.id})
+
+
+def respuesta_sse(conversacion, resultado, modelo, mipyme_id=None):
+    """
+    StreamingHttpResponse con la respuesta del asistente. `resultado` es el texto de la
+    respuesta o una SolicitudIA que se resuelve en streaming con el proveedor `modelo`;
+    con `mipyme_id` la respuesta de IA se cachea con la versión de datos de esa Mipyme.
+    """
+    response = StreamingHttpResponse(
+        _eventos(conversacion, resultado, modelo, mipyme_id), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Evita que un proxy intermedio acumule los eventos antes de enviarlos
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,3 +1,4 @@
+import os
 import pytest
 from django.contrib.auth import get_user_model
 from asistente.models import Conversacion, Mensaje, GuiaUsuario
@@ -10,6 +11,8 @@ def setup_asistente():
     """
     Fixture para configurar los datos necesarios para las pruebas del asistente.
     """
+    from asistente.cache_respuestas import cache_respuestas
+    cache_respuestas.limpiar()
     user = User.objects.create_user(username='test_user', email='test@test.com', password='password')
     sector = SectorEconomico.objects.create(nombre='Tecnología')
     mipyme = Mipyme.objects.create(propietario=user, nombre='MiPyME Tech', sector=sector)
@@ -51,4 +54,444 @@ def test_crear_guia_usuario():
     )
     assert guia.titulo == 'Guía de Inicio Rápido'
     assert guia.pasos == 'Paso 1: Hacer esto. Paso 2: Hacer aquello.'
-    assert str(guia) == 'Guía de Inicio Rápido'
\ No newline at end of file
+    assert str(guia) == 'Guía de Inicio Rápido'
+@pytest.mark.django_db
+def test_contexto_empresa_acotado_y_cacheado(setup_asistente, django_assert_num_queries, django_capture_on_commit_callbacks):
+    """
+    El contexto del asistente respeta el presupuesto de tokens, se sirve desde la
+    caché y se regenera cuando cambian los datos de la Mipyme.
+    """
+    import json
+    from asistente.contexto import construir_contexto, estimar_tokens
+    from produccion.models import Producto
+    user, conversacion = setup_asistente
+    mipyme = user.mipyme
+    with django_capture_on_commit_callbacks(execute=True):
+        for i in range(60):
+            Producto.objects.create(nombre=f'Producto con nombre largo {i}', descripcion='x', mipyme=mipyme)
+
+    contexto = construir_contexto(mipyme, presupuesto=500)
+    assert estimar_tokens(json.dumps(contexto)) <= 500
+    assert contexto['totales']['productos'] == 60
+    assert contexto['omitidos']['productos'] > 0
+
+    # Solo se lee la versión de datos, que está en la caché compartida (tabla de la base)
+    with django_assert_num_queries(1):
+        assert construir_contexto(mipyme, presupuesto=500) == contexto
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Producto.objects.create(nombre='Producto nuevo', mipyme=mipyme)
+    assert construir_contexto(mipyme, presupuesto=500)['totales']['productos'] == 61
+
+@pytest.mark.django_db
+def test_asistente_stream_envia_eventos_y_guarda_respuesta(setup_asistente, client, monkeypatch):
+    """
+    La vista en streaming envía un evento por fragmento y uno final, y guarda la
+    respuesta completa del asistente al terminar.
+    """
+    import json
+    from django.urls import reverse
+    from asistente import streaming
+
+    user, conversacion = setup_asistente
+    client.force_login(user)
+
+    async def stream_falso(prompt, proveedor='openai'):
+        assert proveedor == 'deepseek'
+        for texto in ['Hola ', '**mundo**']:
+            yield texto
+
+    monkeypatch.setattr(streaming, 'stream_respuesta', stream_falso)
+
+    url = reverse('asistente:asistente_conversacion_stream', args=[conversacion.id])
+    response = client.post(url, {'mensaje': '¿Cómo mejoro mi negocio?', 'modelo': 'deepseek'})
+    assert response['Content-Type'] == 'text/event-stream'
+    cuerpo = b''.join(response).decode()
+
+    eventos = [
+        (bloque.split('\n')[0][len('event: '):], json.loads(bloque.split('\n')[1][len('data: '):]))
+        for bloque in cuerpo.strip().split('\n\n')
+    ]
+    assert [nombre for nombre, _ in eventos] == ['token', 'token', 'fin']
+    assert eventos[-1][1] == {
+        'respuesta': '<p>Hola <strong>mundo</strong></p>',
+        'html': '<p>Hola <strong>mundo</strong></p>',
+        'conversacion_id': conversacion.id,
+    }
+    assert list(conversacion.mensajes.order_by('id').values_list('es_usuario', 'contenido')) == [
+        (True, '¿Cómo mejoro mi negocio?'),
+        (False, '<p>Hola <strong>mundo</strong></p>'),
+    ]
+
+    # Las respuestas que no necesitan IA se envían completas en un solo evento
+    response = client.post(url, {'mensaje': '¿Cuál es mi moneda?'})
+    cuerpo = b''.join(response).decode()
+    assert cuerpo.count('event: token') == 1 and 'event: fin' in cuerpo
+
+@pytest.mark.django_db
+def test_cache_respuestas_reutiliza_y_agrupa(setup_asistente, monkeypatch, django_capture_on_commit_callbacks):
+    """
+    Las respuestas de IA se reutilizan mientras no cambien los datos de la Mipyme, y
+    las peticiones simultáneas con la misma clave generan la respuesta una sola vez.
+    """
+    import threading
+    import time
+    from asistente import proveedores, views
+    from asistente.cache_respuestas import CacheRespuestas, cache_respuestas
+
+    user, _ = setup_asistente
+    llamadas = []
+
+    def proveedor_falso(prompt, model='openai'):
+        llamadas.append(model)
+        return 'Respuesta'
+
+    monkeypatch.setattr(proveedores, 'completar', proveedor_falso)
+    mensaje = '¿Cómo mejoro mi negocio?'
+    assert views.procesar_mensaje(mensaje, user) == '<p>Respuesta</p>'
+    assert views.procesar_mensaje('  ¿cómo MEJORO mi negocio ', user) == '<p>Respuesta</p>'
+    assert views.procesar_mensaje(mensaje, user, 'gemini') == '<p>Respuesta</p>'
+    assert llamadas == ['openai', 'gemini']
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.mipyme.nombre = 'Otro nombre'
+        user.mipyme.save()
+    views.procesar_mensaje(mensaje, user)
+    assert llamadas == ['openai', 'gemini', 'openai']
+    metricas = cache_respuestas.metricas()
+    assert metricas['ia']['aciertos'] == 1 and metricas['ia']['fallos'] == 3
+
+    cache = CacheRespuestas(max_entradas=2, ttl=60)
+    liberar = threading.Event()
+    generaciones = []
+
+    def generar():
+        generaciones.append(1)
+        liberar.wait(5)
+        return 'valor'
+
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(cache.obtener_o_generar('ia:x', generar))) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    while cache.metricas()['ia']['consultas'] < 4:
+        time.sleep(0.001)
+    liberar.set()
+    for hilo in hilos:
+        hilo.join()
+    assert resultados == ['valor'] * 4 and len(generaciones) == 1
+    assert cache.metricas()['ia']['agrupadas'] == 3
+
+    # LRU: al superar el máximo se descarta la entrada usada hace más tiempo
+    cache.guardar('datos:a', 1)
+    cache.obtener('ia:x')
+    cache.guardar('datos:b', 2)
+    assert cache.obtener('datos:a') is None and cache.obtener('ia:x') == 'valor'
+
+@pytest.mark.django_db
+def test_historial_conversacion_paginado_con_html_prerenderizado(setup_asistente, client, settings, django_assert_max_num_queries):
+    """
+    Las respuestas guardan su HTML al escribirse y la conversación se muestra
+    por páginas, de la más reciente a la más antigua.
+    """
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}}
+    from django.urls import reverse
+    from asistente.views import MENSAJES_POR_PAGINA
+
+    user, conversacion = setup_asistente
+    client.force_login(user)
+    respuesta = Mensaje.objects.create(conversacion=conversacion, contenido='**Hola**', es_usuario=False)
+    assert respuesta.contenido_html == '<p><strong>Hola</strong></p>'
+    for i in range(MENSAJES_POR_PAGINA + 4):
+        Mensaje.objects.create(conversacion=conversacion, contenido=f'Pregunta {i}', es_usuario=True)
+
+    response = client.get(reverse('asistente:asistente_conversacion', args=[conversacion.id]))
+    pagina = response.context['mensajes_procesados']
+    assert len(pagina) == MENSAJES_POR_PAGINA and response.context['hay_anteriores']
+    assert pagina[-1].contenido == f'Pregunta {MENSAJES_POR_PAGINA + 3}'
+
+    url = reverse('asistente:mensajes_anteriores', args=[conversacion.id])
+    with django_assert_max_num_queries(4):
+        datos = client.get(url, {'antes': pagina[0].id}).json()
+    assert datos['hay_anteriores'] is False
+    assert [m['html'] for m in datos['mensajes']][:2] == ['<p><strong>Hola</strong></p>', '<p>Pregunta 0</p>']
+
+@pytest.mark.django_db
+def test_indice_intenciones_clasifica_y_se_recarga_con_las_guias(setup_asistente, django_assert_num_queries, django_capture_on_commit_callbacks):
+    """
+    El índice clasifica cada mensaje en una pasada, responde con las guías leyendo
+    solo su versión y se reconstruye cuando cambia una guía.
+    """
+    from asistente.intenciones import clasificar, indice
+    from asistente.views import preparar_respuesta
+
+    user, _ = setup_asistente
+    with django_capture_on_commit_callbacks(execute=True):
+        guia = GuiaUsuario.objects.create(
+            titulo='Productos', descripcion='Cómo crear productos', pasos='1. Ir a Producción',
+            palabras_clave='agregar producto, nuevo producto',
+        )
+    indice()
+
+    assert clasificar('Hola, ¿qué tal?').nombre == 'fuera_de_tema'
+    assert clasificar('¿Cuáles son mis productos?').nombre == 'productos'
+    assert clasificar('productos de la ultima venta').nombre == 'ultima_venta'
+    assert clasificar('Muéstrame mis impuestos').nombre == 'impuestos'
+    # Solo se lee la versión de las guías, que está en la caché compartida (tabla de la base)
+    with django_assert_num_queries(1):
+        assert preparar_respuesta('Quiero agregar un producto', user) == 'Cómo crear productos\n\nPasos:\n1. Ir a Producción'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        guia.palabras_clave = 'exportar excel'
+        guia.save()
+    assert clasificar('Quiero agregar un producto').guia is None
+    assert clasificar('ayuda para exportar excel') == ('guia', ('Productos', 'Cómo crear productos', '1. Ir a Producción'))
+
+@pytest.mark.django_db
+def test_respuestas_de_recetas_y_pasos_sin_consultas_n_mas_1(setup_asistente, django_assert_num_queries):
+    """Listar recetas y pasos de producción cuesta las mismas consultas con cualquier cantidad de productos."""
+    from asistente.intenciones import indice
+    from asistente.views import preparar_respuesta
+    from produccion.models import Formulacion, Insumo, PasoDeProduccion, Proceso, Producto, UnidadMedida
+
+    user, _ = setup_asistente
+    unidad = UnidadMedida.objects.create(nombre='Kilogramo', abreviatura='kg')
+    insumo = Insumo.objects.create(nombre='Harina', mipyme=user.mipyme, unidad=unidad, costo_unitario=1)
+    proceso = Proceso.objects.create(nombre='Horneado', mipyme=user.mipyme, costo_por_hora=6)
+    for i in range(5):
+        producto = Producto.objects.create(nombre=f'Pan {i}', mipyme=user.mipyme)
+        Formulacion.objects.create(producto=producto, insumo=insumo, cantidad=1)
+        PasoDeProduccion.objects.create(producto=producto, proceso=proceso, tiempo_en_minutos=30)
+    indice()
+
+    # Versión de las guías, productos y un prefetch por relación
+    with django_assert_num_queries(5):
+        assert preparar_respuesta('formulacion', user).count('Harina: 1') == 5
+    with django_assert_num_queries(4):
+        assert preparar_respuesta('pasos produccion', user).count('Horneado: 30 minutos') == 5
+
+@pytest.mark.django_db
+def test_sandbox_sql_solo_lectura_y_acotado_a_la_mipyme(setup_asistente, settings):
+    """
+    Las consultas del chat solo leen las tablas permitidas, filtradas a la Mipyme
+    del usuario, y el resultado se recorta al máximo de filas.
+    """
+    from asistente import sandbox
+    from asistente.views import procesar_mensaje
+    from produccion.models import Producto
+
+    settings.ASISTENTE_SANDBOX = {'en_proceso': True, 'max_filas': 2}
+    user, _ = setup_asistente
+    otra = Mipyme.objects.create(nombre='Otra', sector=user.mipyme.sector)
+    for i in range(3):
+        Producto.objects.create(mipyme=user.mipyme, nombre=f'Propio {i}')
+    Producto.objects.create(mipyme=otra, nombre='Ajeno')
+
+    columnas, filas, truncado = sandbox.ejecutar(
+        'sql', sandbox.ejecutar_sql, "SELECT nombre FROM productos WHERE nombre LIKE '%o%' ORDER BY nombre", user.mipyme_id
+    )
+    assert columnas == ['nombre'] and filas == [('Propio 0',), ('Propio 1',)] and truncado
+
+    for consulta in ['DELETE FROM productos', 'SELECT * FROM produccion_producto', 'SELECT 1; SELECT 2', 'SELECT * FROM sqlite_master']:
+        with pytest.raises(sandbox.ConsultaNoPermitidaError):
+            sandbox.ejecutar('sql', sandbox.ejecutar_sql, consulta, user.mipyme_id)
+    assert procesar_mensaje('SQL select count(*) as total from venta_items', user) == "Columnas: ['total']\nResultados: [(0,)]"
+    assert Producto.objects.count() == 4
+
+
+@pytest.mark.django_db
+def test_sandbox_sql_en_postgresql_solo_con_el_rol_de_consultas(settings, monkeypatch):
+    """
+    En PostgreSQL el SQL del chat no corre con la conexión principal: sin el rol de
+    solo lectura se rechaza, y sus vistas filtran por la Mipyme de la conexión.
+    """
+    from django.db import connection
+    from asistente import sandbox
+
+    settings.ASISTENTE_SANDBOX = {'en_proceso': True}
+    monkeypatch.setattr(connection, 'vendor', 'postgresql')
+    with pytest.raises(sandbox.ConsultaNoPermitidaError, match='ASISTENTE_DATABASE_URL'):
+        sandbox.ejecutar('sql', sandbox.ejecutar_sql, 'SELECT nombre FROM productos', 1)
+
+    sentencias = sandbox.sentencias_vistas_consultables()
+    assert sentencias[0] == 'CREATE SCHEMA asistente_consultas'
+    assert len(sentencias) == len(sandbox.TABLAS_CONSULTABLES) + 1
+    assert all('WITH (security_barrier)' in s and 's.pid = pg_backend_pid()' in s for s in sentencias[1:])
+
+
+def test_sandbox_codigo_en_proceso_aislado_con_limite_de_cpu(settings):
+    """El código del chat corre en otro proceso, sin el entorno del sitio, y se corta al exceder su CPU."""
+    from asistente import sandbox
+
+    settings.ASISTENTE_SANDBOX = {'procesos': 1, 'cpu_segundos': 1, 'reloj_segundos': 5}
+    sandbox.cerrar_pools()
+    try:
+        assert sandbox.ejecutar('codigo', sandbox.ejecutar_codigo, "import os; print(os.getpid() != PADRE, 'SECRET_KEY' in os.environ)".replace('PADRE', str(os.getpid()))) == 'True False\n'
+        with pytest.raises(sandbox.LimiteExcedidoError):
+            sandbox.ejecutar('codigo', sandbox.ejecutar_codigo, 'while True: pass')
+        # El proceso sigue disponible para la siguiente tarea
+        assert sandbox.ejecutar('codigo', sandbox.ejecutar_codigo, 'print(2 + 2)') == '4\n'
+    finally:
+        sandbox.cerrar_pools()
+
+def test_sandbox_tarea_colgada_solo_detiene_su_proceso(settings):
+    """
+    Una tarea que ignora sus límites se corta terminando solo su proceso: la tarea
+    de otro usuario que corre a la vez termina bien y su proceso se reutiliza.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from asistente import sandbox
+
+    settings.ASISTENTE_SANDBOX = {'procesos': 2, 'reloj_segundos': 6}
+    sandbox.cerrar_pools()
+    colgada = (
+        "import signal, time\n"
+        "signal.signal(signal.SIGALRM, signal.SIG_IGN)\n"
+        "time.sleep(30)"
+    )
+    try:
+        with ThreadPoolExecutor(2) as hilos:
+            bloqueada = hilos.submit(sandbox.ejecutar, 'codigo', sandbox.ejecutar_codigo, colgada)
+            normal = hilos.submit(
+                sandbox.ejecutar, 'codigo', sandbox.ejecutar_codigo, "import os, time; time.sleep(1); print(os.getpid())"
+            )
+            pid = int(normal.result())
+            with pytest.raises(sandbox.LimiteExcedidoError):
+                bloqueada.result()
+        assert sandbox.ejecutar('codigo', sandbox.ejecutar_codigo, 'import os; print(os.getpid())') == f'{pid}\n'
+    finally:
+        sandbox.cerrar_pools()
+
+def test_cliente_proveedor_contra_servidor_local(settings):
+    """
+    El cliente reutiliza la conexión, reintenta los 503, registra latencia y tokens,
+    y abre el circuito tras fallos seguidos sin volver a llamar al proveedor.
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from asistente import llm, proveedores
+
+    respuestas = [503, 200, 200, 500, 500, 500, 500]
+    peticiones = []
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            cuerpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            peticiones.append((self.path, self.client_address, cuerpo['model']))
+            estado = respuestas.pop(0)
+            datos = {
+                'choices': [{'message': {'content': 'Hola desde el stub'}}],
+                'usage': {'prompt_tokens': 12, 'completion_tokens': 5},
+            } if estado == 200 else {'error': 'caído'}
+            contenido = json.dumps(datos).encode()
+            self.send_response(estado)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    settings.ASISTENTE_PROVEEDORES = {'deepseek': {
+        'url': f'http://127.0.0.1:{servidor.server_port}', 'reintentos': 1, 'backoff': 0,
+        'umbral_fallos': 2, 'enfriamiento': 60,
+    }}
+    proveedores.reiniciar()
+    try:
+        assert proveedores.completar('hola', 'deepseek') == 'Hola desde el stub'
+        assert proveedores.completar('hola', 'deepseek') == 'Hola desde el stub'
+        assert [p[0] for p in peticiones] == ['/chat/completions'] * 3 and peticiones[0][2] == 'deepseek-chat'
+        # Keep-alive: las peticiones llegan por la misma conexión
+        assert len({p[1] for p in peticiones}) == 1
+
+        for _ in range(2):
+            with pytest.raises(llm.ProveedorError):
+                proveedores.completar('hola', 'deepseek')
+        with pytest.raises(llm.ProveedorNoDisponibleError):
+            proveedores.completar('hola', 'deepseek')
+        # Cada fallo se reintentó una vez; la última llamada se descartó sin llegar al servidor
+        assert len(peticiones) == 7
+
+        metricas = llm.metricas_proveedores()['deepseek']
+        assert metricas['llamadas'] == 4 and metricas['errores'] == 2 and metricas['circuito_abierto'] == 1
+        assert metricas['tokens_prompt'] == 24 and metricas['tokens_respuesta'] == 10
+        assert metricas['circuito_abierto_ahora'] is True
+    finally:
+        servidor.shutdown()
+        proveedores.reiniciar()
+
+def test_stream_reutiliza_sesion_y_reintenta_al_abrir(settings):
+    """
+    El streaming reutiliza la conexión entre turnos y reintenta un 503 antes del
+    primer byte; la sesión se cierra con cerrar_sesiones(). Un stream que el cliente
+    corta se cuenta como cancelado, sin cerrar un circuito semiabierto.
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from asgiref.sync import async_to_sync
+    from asistente import llm
+
+    respuestas = [503, 200, 200, 200]
+    peticiones = []
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            peticiones.append(self.client_address)
+            estado = respuestas.pop(0)
+            if estado == 200:
+                eventos = [{'choices': [{'delta': {'content': parte}}]} for parte in ('Ho', 'la')]
+                contenido = ''.join(f"data: {json.dumps(e)}\n\n" for e in eventos) + 'data: [DONE]\n\n'
+            else:
+                contenido = 'caído'
+            contenido = contenido.encode()
+            self.send_response(estado)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Content-Length', str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    settings.ASISTENTE_PROVEEDORES = {'deepseek': {
+        'url': f'http://127.0.0.1:{servidor.server_port}', 'reintentos': 1, 'backoff': 0,
+    }}
+    llm.reiniciar_estados()
+
+    async def dos_turnos():
+        textos = []
+        for _ in range(2):
+            textos.append(''.join([texto async for texto in llm.stream_respuesta('hola', 'deepseek')]))
+        # Circuito semiabierto: la llamada de prueba se corta tras el primer fragmento
+        circuito = llm.estado_proveedor('deepseek').circuito
+        circuito.fallos, circuito.abierto_hasta = circuito.umbral_fallos, 0
+        stream = llm.stream_respuesta('hola', 'deepseek')
+        assert await stream.__anext__() == 'Ho'
+        await stream.aclose()
+        sesion = llm._sesion('deepseek', llm.configuracion('deepseek'))
+        await llm.cerrar_sesiones()
+        return textos, sesion.closed
+
+    try:
+        textos, cerrada = async_to_sync(dos_turnos)()
+        assert textos == ['Hola', 'Hola'] and cerrada
+        # El 503 se reintentó y las tres primeras peticiones usaron la misma conexión
+        assert len(peticiones) == 4 and len(set(peticiones[:3])) == 1
+        metricas = llm.metricas_proveedores()['deepseek']
+        assert metricas['llamadas'] == 2 and metricas['errores'] == 0 and metricas['cancelados'] == 1
+        assert metricas['circuito_abierto_ahora'] is True
+    finally:
+        servidor.shutdown()
+        llm.reiniciar_estados()
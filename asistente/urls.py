@@ -6,4 +6,9 @@ app_name = 'asistente'
 urlpatterns = [
     path('', views.asistente_view, name='asistente'),
     path('<int:conversacion_id>/', views.asistente_view, name='asistente_conversacion'),
-]
\ No newline at end of file
+    path('stream/', views.asistente_stream, name='asistente_stream'),
+    path('<int:conversacion_id>/stream/', views.asistente_stream, name='asistente_conversacion_stream'),
+    path('<int:conversacion_id>/anteriores/', views.mensajes_anteriores, name='mensajes_anteriores'),
+    path('metricas/cache/', views.metricas_cache, name='metricas_cache'),
+    path('metricas/proveedores/', views.metricas_proveedores_view, name='metricas_proveedores'),
+]
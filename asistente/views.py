@@ -1,161 +1,75 @@
-import os
+import re
 import json
-from io import BytesIO
-import base64
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.db import connection
+from django.http import JsonResponse, HttpResponseNotAllowed
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from asgiref.sync import sync_to_async
 from django.core.files.storage import default_storage
+from django.utils.html import linebreaks
 from cuentas.models import Mipyme
-from produccion.models import Producto, Insumo, Venta, VentaItem, Proceso, PasoDeProduccion, Formulacion
-from .models import Conversacion, Mensaje, GuiaUsuario
-import openai
+from django.db.models import Sum
+from produccion.models import Producto, Insumo, Venta, VentaItem, Proceso, ResumenVentasMensual
+from .models import Conversacion, Mensaje
+from .contexto import construir_contexto
+from . import sandbox
+from .llm import ProveedorNoDisponibleError, ProveedorOcupadoError, SolicitudIA, metricas_proveedores
+from . import proveedores
+from .cache_respuestas import cache_respuestas, clave_datos, clave_ia
+from .intenciones import NO_CACHEABLES, clasificar
+from .streaming import respuesta_sse
 import markdown
 
-# Configurar APIs
-openai.api_key = os.getenv('OPENAI_API_KEY')
+MENSAJES_POR_PAGINA = 30
 
-def get_ai_response(prompt, model='openai'):
+def get_ai_response(prompt, model='openai', mipyme_id=None):
+    """
+    Respuesta del modelo como texto; los errores se devuelven como mensaje y no se cachean.
+    Con `mipyme_id` la respuesta se cachea por prompt, modelo y versión de datos de la Mipyme.
+    """
     try:
-        if model == 'openai':
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content
-        elif model == 'gemini':
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-                model = genai.GenerativeModel('gemini-1.5-flash')
-                response = model.generate_content(prompt)
-                return response.text
-            except ImportError:
-                return "Error: google-generativeai no está disponible."
-        elif model == 'deepseek':
-            # For DeepSeek, use requests
-            import requests
-            url = "https://api.deepseek.com/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {os.getenv('deepseek_API_KEY')}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "model": "deepseek-chat",
-                "messages": [{"role": "user", "content": prompt}]
-            }
-            response = requests.post(url, headers=headers, json=data)
-            return response.json()['choices'][0]['message']['content']
+        # Sesiones persistentes, reintentos, circuito y métricas por proveedor (ver asistente/proveedores.py)
+        if mipyme_id is None:
+            return proveedores.completar(prompt, model)
+        return cache_respuestas.obtener_o_generar(
+            clave_ia(mipyme_id, prompt, model), lambda: proveedores.completar(prompt, model)
+        )
+    except (ProveedorOcupadoError, ProveedorNoDisponibleError) as e:
+        return str(e)
     except Exception as e:
         return f"Error con {model}: {str(e)}"
 
 def get_company_data(user):
-    mipyme = user.mipyme
-    data = {
-        'nombre': mipyme.nombre,
-        'telefono': mipyme.numero_telefono,
-        'correo': mipyme.correo,
-        'tipo': mipyme.tipo.nombre if mipyme.tipo else None,
-        'sector': mipyme.sector.nombre if mipyme.sector else None,
-        'moneda_predeterminada': mipyme.moneda_predeterminada,
-        'productos': [
-            {
-                'nombre': p.nombre,
-                'precio_venta': float(p.precio_venta) if p.precio_venta else None,
-                'stock_actual': p.stock_actual,
-                'formulacion': [
-                    {
-                        'insumo': f.insumo.nombre,
-                        'unidad': f.insumo.unidad.abreviatura,
-                        'cantidad': float(f.cantidad),
-                        'porcentaje_desperdicio': float(f.porcentaje_desperdicio)
-                    } for f in Formulacion.objects.filter(producto=p)
-                ],
-                'pasos_produccion': [
-                    {
-                        'proceso': pdp.proceso.nombre,
-                        'tiempo_minutos': pdp.tiempo_en_minutos
-                    } for pdp in PasoDeProduccion.objects.filter(producto=p)
-                ]
-            } for p in Producto.objects.filter(mipyme=mipyme)
-        ],
-        'insumos': [
-            {
-                'nombre': i.nombre,
-                'costo_unitario': float(i.costo_unitario) if i.costo_unitario else None,
-                'stock_actual': float(i.stock_actual) if i.stock_actual else None
-            } for i in Insumo.objects.filter(mipyme=mipyme)
-        ],
-        'procesos': [
-            {
-                'nombre': pr.nombre,
-                'costo_por_hora': float(pr.costo_por_hora)
-            } for pr in Proceso.objects.filter(mipyme=mipyme)
-        ],
-        'ventas': [
-            {
-                'fecha': str(v.fecha),
-                'total': float(v.total) if v.total else None,
-                'items': [
-                    {
-                        'producto': vi.producto.nombre,
-                        'cantidad': vi.cantidad,
-                        'precio_unitario': float(vi.precio_unitario),
-                        'subtotal': float(vi.subtotal)
-                    } for vi in VentaItem.objects.filter(venta=v)
-                ]
-            } for v in Venta.objects.filter(mipyme=mipyme)
-        ],
-    }
-    return data
+    # Contexto acotado y cacheado por versión de datos de la Mipyme (ver asistente/contexto.py)
+    return construir_contexto(user.mipyme)
 
-def execute_sql_query(query):
-    with connection.cursor() as cursor:
-        cursor.execute(query)
-        columns = [col[0] for col in cursor.description]
-        results = cursor.fetchall()
-    return columns, results
+# Las consultas, el código y los gráficos del chat corren en procesos aislados y
+# con límites de CPU, memoria, tiempo y filas (ver asistente/sandbox.py)
+def execute_sql_query(query, mipyme_id):
+    return sandbox.ejecutar('sql', sandbox.ejecutar_sql, query, mipyme_id)
 
 def execute_code(code):
-    # Ejecutar código de forma segura (limitada)
     try:
-        exec_globals = {}
-        try:
-            import pandas as pd
-            exec_globals['pd'] = pd
-        except ImportError:
-            pass
-        try:
-            import matplotlib.pyplot as plt
-            exec_globals['plt'] = plt
-        except ImportError:
-            pass
-
-        exec(code, exec_globals)
+        salida = sandbox.ejecutar('codigo', sandbox.ejecutar_codigo, code)
+        if salida:
+            return f"Código ejecutado exitosamente.\n\nSalida:\n{salida}"
         return "Código ejecutado exitosamente."
     except Exception as e:
         return f"Error: {str(e)}"
 
 def generate_graph(code):
     try:
-        try:
-            import matplotlib.pyplot as plt
-        except ImportError:
-            return "Error: matplotlib no está instalado."
-
-        exec(code)
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        image_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        plt.close()
-        return image_base64
+        return sandbox.ejecutar('codigo', sandbox.generar_grafico, code)
     except Exception as e:
         return f"Error generando gráfico: {str(e)}"
 
+def _texto_despues(mensaje, palabras):
+    """Lo que sigue a la primera de `palabras` que aparezca en el mensaje, sin distinguir mayúsculas."""
+    partes = re.split('|'.join(palabras), mensaje, maxsplit=1, flags=re.IGNORECASE)
+    return partes[1].strip() if len(partes) > 1 else ''
+
 @login_required
 def asistente_view(request, conversacion_id=None):
     if not hasattr(request.user, 'mipyme') or not request.user.mipyme:
@@ -185,17 +99,12 @@ def asistente_view(request, conversacion_id=None):
             respuesta = procesar_mensaje(mensaje_usuario, request.user, modelo_seleccionado)
 
             # Guardar respuesta del asistente
-            Mensaje.objects.create(conversacion=conversacion, contenido=respuesta, es_usuario=False)
+            mensaje = Mensaje.objects.create(conversacion=conversacion, contenido=respuesta, es_usuario=False)
 
-            return JsonResponse({'respuesta': respuesta})
+            return JsonResponse({'respuesta': respuesta, 'html': mensaje.contenido_html})
 
-    mensajes = conversacion.mensajes.all().order_by('fecha') if conversacion else []
-    # Procesar mensajes para convertir Markdown a HTML en respuestas del asistente
-    mensajes_procesados = []
-    for m in mensajes:
-        if not m.es_usuario:
-            m.contenido = markdown.markdown(m.contenido, extensions=['extra'])
-        mensajes_procesados.append(m)
+    # Solo la página más reciente: las respuestas ya tienen su HTML renderizado (Mensaje.contenido_html)
+    mensajes_procesados, hay_anteriores = _pagina_mensajes(conversacion) if conversacion else ([], False)
     # Solo mostrar conversaciones que tengan al menos un mensaje
     conversaciones = Conversacion.objects.filter(
         usuario=request.user,
@@ -204,40 +113,142 @@ def asistente_view(request, conversacion_id=None):
     avatar_url = default_storage.url('nimypine/material/sinfotouser.png')
     return render(request, 'asistente/asistente.html', {
         'mensajes_procesados': mensajes_procesados,
+        'hay_anteriores': hay_anteriores,
         'conversaciones': conversaciones,
         'conversacion_actual': conversacion,
         'avatar_url': avatar_url,
         'nombrepine': request.user.mipyme.nombre
     })
 
+def _pagina_mensajes(conversacion, antes=None):
+    """
+    Los MENSAJES_POR_PAGINA mensajes más recientes de la conversación (anteriores al id
+    `antes`, si se indica) en orden cronológico, y si quedan mensajes más antiguos.
+    """
+    mensajes = conversacion.mensajes.order_by('-id')
+    if antes:
+        mensajes = mensajes.filter(id__lt=antes)
+    pagina = list(mensajes[:MENSAJES_POR_PAGINA + 1])
+    hay_anteriores = len(pagina) > MENSAJES_POR_PAGINA
+    pagina = pagina[:MENSAJES_POR_PAGINA]
+    pagina.reverse()
+    return pagina, hay_anteriores
+
+@login_required
+def mensajes_anteriores(request, conversacion_id):
+    """Página de mensajes anteriores al id `antes`, como JSON, para el scroll hacia arriba del chat."""
+    conversacion = get_object_or_404(Conversacion, id=conversacion_id, usuario=request.user)
+    try:
+        antes = int(request.GET.get('antes', ''))
+    except ValueError:
+        return JsonResponse({'error': 'El parámetro "antes" es requerido.'}, status=400)
+    mensajes, hay_anteriores = _pagina_mensajes(conversacion, antes)
+    return JsonResponse({
+        'mensajes': [
+            {
+                'id': m.id,
+                'es_usuario': m.es_usuario,
+                'html': linebreaks(m.contenido, autoescape=True) if m.es_usuario else m.contenido_html,
+            }
+            for m in mensajes
+        ],
+        'hay_anteriores': hay_anteriores,
+    })
+
+@login_required
+def metricas_cache(request):
+    """Aciertos de la caché de respuestas del asistente en este proceso (solo superusuarios)."""
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    return JsonResponse(cache_respuestas.metricas())
+
+@login_required
+def metricas_proveedores_view(request):
+    """Llamadas, errores, latencia y tokens por proveedor de IA en este proceso (solo superusuarios)."""
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    return JsonResponse(metricas_proveedores())
+
+def _iniciar_turno(user, conversacion_id, mensaje_usuario):
+    """Guarda el mensaje del usuario y prepara la respuesta; devuelve (conversacion, resultado)."""
+    if conversacion_id:
+        conversacion = get_object_or_404(Conversacion, id=conversacion_id, usuario=user)
+    else:
+        conversacion = Conversacion.objects.create(
+            usuario=user,
+            titulo=mensaje_usuario[:20] + '...' if len(mensaje_usuario) > 50 else mensaje_usuario
+        )
+    Mensaje.objects.create(conversacion=conversacion, contenido=mensaje_usuario, es_usuario=True)
+    return conversacion, preparar_respuesta_cacheada(mensaje_usuario, user)
+
+@login_required
+async def asistente_stream(request, conversacion_id=None):
+    """
+    Versión en streaming de asistente_view: la respuesta llega como Server-Sent Events
+    (ver asistente/streaming.py). Es una vista asíncrona, así que mientras el modelo
+    genera la respuesta no se ocupa ningún hilo del servidor.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user = await request.auser()
+    if not user.mipyme_id:
+        return JsonResponse({'error': 'Tu usuario no tiene una mipyme asociada.'}, status=403)
+    mensaje_usuario = request.POST.get('mensaje')
+    modelo_seleccionado = request.POST.get('modelo', 'openai')
+    if not mensaje_usuario:
+        return JsonResponse({'error': 'El mensaje es requerido.'}, status=400)
+
+    conversacion, resultado = await sync_to_async(_iniciar_turno)(user, conversacion_id, mensaje_usuario)
+    return respuesta_sse(conversacion, resultado, modelo_seleccionado, mipyme_id=user.mipyme_id)
+
 def procesar_mensaje(mensaje, user, model='openai'):
-    mensaje_lower = mensaje.lower()
-
-    # Validación previa: verificar si el mensaje está relacionado con temas de mipymes
-    palabras_clave = [
-        'produccion', 'insumo', 'venta', 'proceso', 'formulacion', 'producto', 'mipyme',
-        'empresa', 'ventas', 'facturacion', 'estandarizar', 'sql', 'codigo', 'grafico',
-        'agregar', 'registrar', 'crear', 'materia prima', 'materias primas', 'pasos produccion',
-        'produccion pasos', 'datos empresa', 'datos', 'informacion', 'moneda', 'predeterminada',
-        'cómo', 'guía', 'ayuda', 'instructivo', 'impuestos', 'negocio', 'PYMES'
-    ]
-    if not any(kw in mensaje_lower for kw in palabras_clave):
+    resultado = preparar_respuesta_cacheada(mensaje, user)
+    if not isinstance(resultado, SolicitudIA):
+        return resultado
+    respuesta = get_ai_response(resultado.prompt, model, mipyme_id=user.mipyme_id)
+    if resultado.markdown:
+        return markdown.markdown(respuesta, extensions=['extra'])
+    return respuesta
+
+def preparar_respuesta_cacheada(mensaje, user):
+    """preparar_respuesta con caché por mensaje normalizado y versión de datos de la Mipyme."""
+    intencion = clasificar(mensaje)
+    if not user.mipyme_id or intencion.nombre in NO_CACHEABLES:
+        return preparar_respuesta(mensaje, user, intencion)
+    return cache_respuestas.obtener_o_generar(
+        clave_datos(user.mipyme_id, mensaje), lambda: preparar_respuesta(mensaje, user, intencion)
+    )
+
+def _texto_guia(guia):
+    return f"{guia.descripcion}\n\nPasos:\n{guia.pasos}"
+
+def preparar_respuesta(mensaje, user, intencion=None):
+    """
+    Resuelve el mensaje con los datos de la Mipyme. Devuelve el texto de la respuesta
+    o, si hace falta un modelo de IA, la SolicitudIA con el prompt a enviarle.
+    """
+    # Una sola pasada por el mensaje con el índice de intenciones (ver asistente/intenciones.py)
+    intencion = intencion or clasificar(mensaje)
+    nombre = intencion.nombre
+
+    # Validación previa: el mensaje debe estar relacionado con temas de mipymes
+    if nombre == 'fuera_de_tema':
         return "Lo siento, solo puedo ayudarte con temas relacionados con la gestión de tu mipyme, como producción, ventas, insumos o procesos. ¿En qué puedo asistirte en esos aspectos?"
 
-    if 'estandarizar' in mensaje_lower:
+    if nombre == 'estandarizar':
         data = get_company_data(user)
         prompt = f"Sugerencias para estandarizar productos basadas en estos datos: {json.dumps(data)}"
-        return get_ai_response(prompt, model)
+        return SolicitudIA(prompt, markdown=False)
 
-    elif 'datos empresa' in mensaje_lower or 'empresa' in mensaje_lower or 'datos' in mensaje_lower:
+    elif nombre == 'datos_empresa':
         data = get_company_data(user)
         return json.dumps(data, indent=2)
 
-    elif 'moneda' in mensaje_lower:
+    elif nombre == 'moneda':
         mipyme = user.mipyme
         return f"La moneda predeterminada de tu mipyme es {mipyme.get_moneda_predeterminada_display()} ({mipyme.moneda_predeterminada})."
 
-    elif 'productos' in mensaje_lower and 'ultima venta' in mensaje_lower:
+    elif nombre == 'ultima_venta':
         # Última venta y sus productos
         ultima_venta = Venta.objects.filter(mipyme=user.mipyme).order_by('-fecha').first()
         if ultima_venta:
@@ -247,89 +258,91 @@ def procesar_mensaje(mensaje, user, model='openai'):
         else:
             return "No hay ventas registradas."
 
-    elif any(kw in mensaje_lower for kw in ['agregar', 'añadir', 'registrar', 'crear']) and 'producto' in mensaje_lower:
+    elif nombre == 'guia_agregar_producto':
         # Buscar guía para agregar producto
-        guia = GuiaUsuario.objects.filter(activo=True, palabras_clave__icontains='agregar producto').first()
-        if guia:
-            return f"{guia.descripcion}\n\nPasos:\n{guia.pasos}"
+        if intencion.guia:
+            return _texto_guia(intencion.guia)
         else:
             return "Para agregar un producto, ve a la sección de 'Producción', luego a 'Productos' y haz clic en 'Crear Producto'. Deberás completar un formulario con la información del nuevo producto."
 
-    elif 'productos' in mensaje_lower:
+    elif nombre == 'productos':
         productos = Producto.objects.filter(mipyme=user.mipyme)
         return '\n'.join([f"{p.nombre}: ${p.precio_venta}" for p in productos])
 
-    elif 'insumos' in mensaje_lower:
+    elif nombre == 'insumos':
         insumos = Insumo.objects.filter(mipyme=user.mipyme)
         return '\n'.join([f"{i.nombre}: ${i.costo_unitario}" for i in insumos])
 
-    elif 'ventas' in mensaje_lower or 'facturacion' in mensaje_lower:
-        ventas = Venta.objects.filter(mipyme=user.mipyme)
-        return '\n'.join([f"Venta #{v.id}: ${v.total} - {v.fecha}" for v in ventas])
+    elif nombre == 'ventas':
+        meses = ResumenVentasMensual.objects.filter(mipyme=user.mipyme).values('mes').annotate(
+            ingresos=Sum('ingresos'), unidades=Sum('unidades')
+        ).order_by('-mes')[:12]
+        if not meses:
+            return "No hay ventas registradas."
+        return 'Ventas por mes:\n' + '\n'.join([f"{m['mes']:%Y-%m}: ${m['ingresos']} ({m['unidades']} unidades)" for m in meses])
 
-    elif 'procesos' in mensaje_lower:
+    elif nombre == 'procesos':
         procesos = Proceso.objects.filter(mipyme=user.mipyme)
         return '\n'.join([f"{p.nombre}: ${p.costo_por_hora}/hora" for p in procesos])
 
-    elif 'impuestos' in mensaje_lower:
-       impuestos = user.mipyme.impuestos.all()
-       if impuestos:
-           return 'Impuestos configurados:\n' + '\n'.join([f"- {i.nombre} ({i.porcentaje}%)" for i in impuestos])
-       else:
-           return "No tienes impuestos configurados en tu mipyme."
-
-    elif 'impuestos' in mensaje_lower:
+    elif nombre == 'impuestos':
        impuestos = user.mipyme.impuestos.all()
        if impuestos:
            return 'Impuestos configurados:\n' + '\n'.join([f"- {i.nombre} ({i.porcentaje}%)" for i in impuestos])
        else:
            return "No tienes impuestos configurados en tu mipyme."
 
-    elif 'formulacion' in mensaje_lower:
-        productos = Producto.objects.filter(mipyme=user.mipyme)
+    elif nombre == 'formulacion':
+        productos = Producto.objects.filter(mipyme=user.mipyme).prefetch_related('formulacion__insumo__unidad')
         response = ""
         for p in productos:
             response += f"\nProducto: {p.nombre}\n"
-            formulaciones = Formulacion.objects.filter(producto=p)
-            for f in formulaciones:
+            for f in p.formulacion.all():
                 response += f"  - {f.insumo.nombre}: {f.cantidad} {f.insumo.unidad.abreviatura} (desperdicio: {f.porcentaje_desperdicio}%)\n"
         return response
 
-    elif 'pasos produccion' in mensaje_lower or 'produccion pasos' in mensaje_lower:
-        productos = Producto.objects.filter(mipyme=user.mipyme)
+    elif nombre == 'pasos_produccion':
+        productos = Producto.objects.filter(mipyme=user.mipyme).prefetch_related('pasodeproduccion_set__proceso')
         response = ""
         for p in productos:
             response += f"\nProducto: {p.nombre}\n"
-            pasos = PasoDeProduccion.objects.filter(producto=p)
-            for paso in pasos:
+            for paso in p.pasodeproduccion_set.all():
                 response += f"  - {paso.proceso.nombre}: {paso.tiempo_en_minutos} minutos\n"
         return response
 
-    elif 'sql' in mensaje_lower:
+    elif nombre == 'sql':
         # Extraer query SQL del mensaje
-        query = mensaje.split('sql')[1].strip()
-        columns, results = execute_sql_query(query)
-        return f"Columnas: {columns}\nResultados: {results}"
-
-    elif 'codigo' in mensaje_lower or 'code' in mensaje_lower:
-        code = mensaje.split('codigo')[1].strip()
+        query = _texto_despues(mensaje, ['sql'])
+        try:
+            columns, results, truncado = execute_sql_query(query, user.mipyme_id)
+        except Exception as e:
+            return f"Error en la consulta: {str(e)}"
+        respuesta = f"Columnas: {columns}\nResultados: {results}"
+        if truncado:
+            respuesta += f"\n(Se muestran solo las primeras {len(results)} filas.)"
+        return respuesta
+
+    elif nombre == 'codigo':
+        code = _texto_despues(mensaje, ['codigo', 'code'])
         return execute_code(code)
 
-    elif 'grafico' in mensaje_lower or 'graph' in mensaje_lower:
-        code = mensaje.split('grafico')[1].strip()
+    elif nombre == 'grafico':
+        code = _texto_despues(mensaje, ['grafico', 'graph'])
         return generate_graph(code)
 
-    elif any(kw in mensaje_lower for kw in ['agregar', 'agrego', 'añadir', 'registrar', 'crear']) and any(kw in mensaje_lower for kw in ['insumo', 'insumos', 'materia prima', 'materias primas']):
+    elif nombre == 'guia_agregar_insumo':
         # Buscar guía para agregar insumo
-        guia = GuiaUsuario.objects.filter(activo=True, palabras_clave__icontains='agregar insumo').first()
-        if guia:
-            return f"{guia.descripcion}\n\nPasos:\n{guia.pasos}"
+        if intencion.guia:
+            return _texto_guia(intencion.guia)
         else:
             return "Lo siento, no tengo una guía específica para agregar insumos en este momento."
 
+    elif nombre == 'guia':
+        # Guía cuyas palabras clave aparecen en el mensaje
+        return _texto_guia(intencion.guia)
+
     else:
         # Respuesta general con AI
         data = get_company_data(user)
         prompt = f"Eres un asistente virtual especializado en ayudar con la gestión de mipymes. Solo responde preguntas relacionadas con producción, ventas, insumos, procesos y datos de la empresa. Si la pregunta no está relacionada con estos temas, responde cortésmente que no puedes ayudar con eso y sugiere volver al tema principal. Datos de la empresa: {json.dumps(data)}. Mensaje del usuario: {mensaje}"
-        respuesta = get_ai_response(prompt, model)
-        return markdown.markdown(respuesta, extensions=['extra'])
+        return SolicitudIA(prompt)
@@ -1,9 +1,24 @@
 # cuentas/admin.py
 from django.contrib import admin
-from .models import Usuario, Mipyme, TipoEmpresa, SectorEconomico
+from .cola_emails import reencolar
+from .models import Usuario, Mipyme, TipoEmpresa, SectorEconomico, EmailPendiente
 
 # Registra tus modelos aquí
 admin.site.register(Usuario)
 admin.site.register(Mipyme)
 admin.site.register(TipoEmpresa) # 👈 REGISTRA EL NUEVO MODELO
-admin.site.register(SectorEconomico) # 👈 REGISTRA EL NUEVO MODELO
\ No newline at end of file
+admin.site.register(SectorEconomico) # 👈 REGISTRA EL NUEVO MODELO
+
+
+@admin.register(EmailPendiente)
+class EmailPendienteAdmin(admin.ModelAdmin):
+    list_display = ('tipo', 'destinatario', 'estado', 'intentos', 'proximo_intento', 'enviado_en')
+    list_filter = ('estado', 'tipo')
+    search_fields = ('destinatario',)
+    readonly_fields = ('tipo', 'usuario', 'destinatario', 'contexto', 'intentos', 'ultimo_error', 'creado', 'enviado_en')
+    actions = ['reencolar_fallidos']
+
+    @admin.action(description="Reencolar los emails fallidos seleccionados")
+    def reencolar_fallidos(self, request, queryset):
+        reencolados = reencolar(queryset)
+        self.message_user(request, f"{reencolados} emails reencolados.")
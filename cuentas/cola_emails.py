@@ -0,0 +1,180 @@
+# cuentas/cola_emails.py
+"""
+Cola de emails salientes respaldada por la base de datos.
+
+Las vistas solo crean un EmailPendiente (encolar_email), en la misma transacción
+que el resto de la petición. El comando procesar_cola_emails (o procesar_tareas,
+el worker del Procfile) toma lotes de emails vencidos con SELECT ... FOR UPDATE
+SKIP LOCKED (varios workers no toman el mismo email), los renderiza y los envía
+con el transporte configurado en EMAIL_COLA:
+
+- un lote se envía en una sola llamada; si falla, se reintenta email por email
+  para que una dirección inválida no arrastre al resto;
+- un email que falla se reprograma con backoff exponencial y, tras
+  `max_intentos`, queda en estado 'fallido' (se puede reencolar desde el admin);
+- un email tomado por un worker que murió vuelve a la cola pasados `plazo_envio` segundos.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import EmailPendiente
+
+logger = logging.getLogger(__name__)
+
+CONFIG_POR_DEFECTO = {
+    'transporte': 'resend',
+    'lote': 50,
+    'max_intentos': 5,
+    'backoff': 60,
+    'backoff_max': 3600,
+    'plazo_envio': 300,
+    'intervalo': 5,
+}
+# Máximo de emails por llamada a la API de lotes de Resend
+MAX_LOTE_RESEND = 100
+
+
+def configuracion():
+    return {**CONFIG_POR_DEFECTO, **getattr(settings, 'EMAIL_COLA', {})}
+
+
+# --- TRANSPORTES ---
+
+class TransporteResend:
+    def __init__(self):
+        import resend
+        api_key = os.environ.get('RESEND')
+        if not api_key:
+            raise ImproperlyConfigured("RESEND (API Key) no encontrada en las variables de entorno.")
+        resend.api_key = api_key
+        self.resend = resend
+
+    def enviar(self, mensajes):
+        if len(mensajes) == 1:
+            self.resend.Emails.send(mensajes[0])
+        else:
+            self.resend.Batch.send(mensajes)
+
+
+class TransporteMemoria:
+    """Guarda los emails en `buzon` en lugar de enviarlos (pruebas y desarrollo)."""
+    buzon = []
+
+    def enviar(self, mensajes):
+        self.buzon.extend(mensajes)
+
+
+TRANSPORTES = {'resend': TransporteResend, 'memoria': TransporteMemoria}
+
+
+def transporte(nombre=None):
+    nombre = nombre or configuracion()['transporte']
+    clase = TRANSPORTES.get(nombre) or import_string(nombre)
+    return clase()
+
+
+# --- COLA ---
+
+def encolar_email(tipo, usuario, contexto=None):
+    return EmailPendiente.objects.create(
+        tipo=tipo, usuario=usuario, destinatario=usuario.email, contexto=contexto or {}
+    )
+
+
+def _tomar_lote(limite, config):
+    """Marca como 'enviando' hasta `limite` emails vencidos y los devuelve."""
+    ahora = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            EmailPendiente.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('usuario')
+            .filter(
+                estado__in=[EmailPendiente.Estados.PENDIENTE, EmailPendiente.Estados.ENVIANDO],
+                proximo_intento__lte=ahora,
+            )
+            .order_by('proximo_intento')[:limite]
+        )
+        for email in emails:
+            email.estado = EmailPendiente.Estados.ENVIANDO
+            email.intentos += 1
+            email.proximo_intento = ahora + timedelta(seconds=config['plazo_envio'])
+        EmailPendiente.objects.bulk_update(emails, ['estado', 'intentos', 'proximo_intento'])
+    return emails
+
+
+def _registrar_fallo(email, error, config, ahora):
+    email.ultimo_error = f"{type(error).__name__}: {error}"[:2000]
+    if email.intentos >= config['max_intentos']:
+        email.estado = EmailPendiente.Estados.FALLIDO
+        logger.error(f"Email {email.pk} ({email.tipo}) a {email.destinatario} descartado tras {email.intentos} intentos: {email.ultimo_error}")
+        return
+    espera = min(config['backoff'] * 2 ** (email.intentos - 1), config['backoff_max'])
+    email.estado = EmailPendiente.Estados.PENDIENTE
+    email.proximo_intento = ahora + timedelta(seconds=espera)
+    logger.warning(f"Email {email.pk} a {email.destinatario} falló (intento {email.intentos}), se reintenta en {espera}s: {email.ultimo_error}")
+
+
+def procesar_pendientes(limite=None, transporte_envio=None):
+    """
+    Envía un lote de emails vencidos. Devuelve un diccionario con cuántos se
+    enviaron, cuántos se reprogramaron y cuántos quedaron fallidos.
+    """
+    from .utils import construir_email, url_logo
+
+    config = configuracion()
+    # El transporte se crea antes de tomar el lote: sin configuración no se marca ningún email
+    transporte_envio = transporte_envio or transporte()
+    limite = min(limite or config['lote'], MAX_LOTE_RESEND)
+    emails = _tomar_lote(limite, config)
+    resultado = {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+    if not emails:
+        return resultado
+
+    logo_url = url_logo()
+    ahora = timezone.now()
+    enviables, errores = [], {}
+    for email in emails:
+        try:
+            enviables.append((email, construir_email(email, logo_url)))
+        except Exception as e:
+            errores[email.pk] = e
+
+    try:
+        if enviables:
+            transporte_envio.enviar([mensaje for _, mensaje in enviables])
+    except Exception as e:
+        if len(enviables) == 1:
+            errores[enviables[0][0].pk] = e
+        else:
+            logger.warning(f"Falló el envío del lote de {len(enviables)} emails, se envían uno por uno: {e}")
+            for email, mensaje in enviables:
+                try:
+                    transporte_envio.enviar([mensaje])
+                except Exception as e_email:
+                    errores[email.pk] = e_email
+
+    for email in emails:
+        if email.pk in errores:
+            _registrar_fallo(email, errores[email.pk], config, ahora)
+            resultado['fallidos' if email.estado == EmailPendiente.Estados.FALLIDO else 'reintentos'] += 1
+        else:
+            email.estado = EmailPendiente.Estados.ENVIADO
+            email.enviado_en = ahora
+            email.ultimo_error = ''
+            resultado['enviados'] += 1
+    EmailPendiente.objects.bulk_update(emails, ['estado', 'proximo_intento', 'ultimo_error', 'enviado_en'])
+    return resultado
+
+
+def reencolar(emails):
+    """Devuelve a la cola emails fallidos (acción del admin)."""
+    return emails.filter(estado=EmailPendiente.Estados.FALLIDO).update(
+        estado=EmailPendiente.Estados.PENDIENTE, intentos=0, proximo_intento=timezone.now(), ultimo_error=''
+    )
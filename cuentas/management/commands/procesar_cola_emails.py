@@ -0,0 +1,41 @@
+# cuentas/management/commands/procesar_cola_emails.py
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cuentas.cola_emails import MAX_LOTE_RESEND, configuracion, procesar_pendientes, transporte
+
+
+class Command(BaseCommand):
+    help = 'Envía los emails encolados por las vistas (worker de la cola de emails)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa un lote y termina.')
+        parser.add_argument('--lote', type=int, help='Emails por lote (por defecto, EMAIL_COLA["lote"]).')
+        parser.add_argument('--transporte', help='Transporte a usar: resend, memoria o una ruta a una clase.')
+
+    def handle(self, *args, **options):
+        config = configuracion()
+        envio = transporte(options['transporte'])
+        self.detener = False
+        # Railway y gunicorn detienen los procesos con SIGTERM: se termina el lote en curso
+        signal.signal(signal.SIGTERM, self._detener)
+
+        while not self.detener:
+            close_old_connections()
+            resultado = procesar_pendientes(options['lote'], envio)
+            procesados = sum(resultado.values())
+            if procesados:
+                self.stdout.write(
+                    f"Enviados: {resultado['enviados']}, reintentos: {resultado['reintentos']}, fallidos: {resultado['fallidos']}"
+                )
+            if options['una_vez']:
+                break
+            # Con un lote lleno es probable que haya más pendientes: se sigue sin esperar
+            if procesados < min(options['lote'] or config['lote'], MAX_LOTE_RESEND):
+                time.sleep(config['intervalo'])
+
+    def _detener(self, signum, frame):
+        self.detener = True
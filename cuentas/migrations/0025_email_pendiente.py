@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cuentas", "0024_mipyme_mostrar_productos_en_marketplace"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EmailPendiente",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("tipo", models.CharField(choices=[("confirmacion", "Confirmación de email"), ("bienvenida", "Bienvenida"), ("reset_password", "Restablecer contraseña")], max_length=20)),
+                ("destinatario", models.EmailField(max_length=254)),
+                ("contexto", models.JSONField(blank=True, default=dict, help_text="Datos para renderizar la plantilla al enviar")),
+                ("estado", models.CharField(choices=[("pendiente", "Pendiente"), ("enviando", "Enviando"), ("enviado", "Enviado"), ("fallido", "Fallido")], default="pendiente", max_length=10)),
+                ("intentos", models.PositiveSmallIntegerField(default=0)),
+                ("proximo_intento", models.DateTimeField(default=django.utils.timezone.now)),
+                ("ultimo_error", models.TextField(blank=True)),
+                ("creado", models.DateTimeField(auto_now_add=True)),
+                ("enviado_en", models.DateTimeField(blank=True, null=True)),
+                ("usuario", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="emails_pendientes", to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "verbose_name": "Email pendiente",
+                "verbose_name_plural": "Emails pendientes",
+                "ordering": ["proximo_intento"],
+                "indexes": [models.Index(fields=["estado", "proximo_intento"], name="email_estado_proximo_idx")],
+            },
+        ),
+    ]
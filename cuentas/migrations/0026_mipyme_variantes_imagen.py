@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cuentas", "0025_email_pendiente"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mipyme",
+            name="variantes_imagen",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
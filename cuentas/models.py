@@ -1,6 +1,8 @@
 # cuentas/models.py
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 
 class SectorEconomico(models.Model):
@@ -65,6 +67,8 @@ class Mipyme(models.Model):
     coordenadas = models.CharField(max_length=500, null=True, blank=True, verbose_name="Coordenadas (Google Maps)")
     logo = models.ImageField(upload_to='logos/', null=True, blank=True, verbose_name="Logo de la Empresa")
     portada = models.ImageField(upload_to='portadas/', null=True, blank=True, verbose_name="Portada de la Empresa")
+    # Variantes redimensionadas del logo y la portada (ver produccion/imagenes.py)
+    variantes_imagen = models.JSONField(default=dict, blank=True, editable=False)
 
     # Configuración de producción
     unidad_medida_predeterminada = models.JSONField(
@@ -102,6 +106,12 @@ class Mipyme(models.Model):
     def __str__(self):
         return f"{self.nombre} (ID: {self.id})"
 
+    @cached_property
+    def urls_imagenes(self):
+        """URLs de las variantes del logo y la portada, para las plantillas: urls_imagenes.logo.thumb"""
+        from produccion.imagenes import urls_imagenes
+        return urls_imagenes(self)
+
 
 
 
@@ -133,3 +143,40 @@ class Usuario(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+# Cola de emails salientes. Las vistas solo encolan; el comando procesar_cola_emails
+# los renderiza y los envía por lotes (ver cuentas/cola_emails.py).
+class EmailPendiente(models.Model):
+    class Tipos(models.TextChoices):
+        CONFIRMACION = 'confirmacion', 'Confirmación de email'
+        BIENVENIDA = 'bienvenida', 'Bienvenida'
+        RESET_PASSWORD = 'reset_password', 'Restablecer contraseña'
+
+    class Estados(models.TextChoices):
+        PENDIENTE = 'pendiente', 'Pendiente'
+        ENVIANDO = 'enviando', 'Enviando'
+        ENVIADO = 'enviado', 'Enviado'
+        FALLIDO = 'fallido', 'Fallido'
+
+    tipo = models.CharField(max_length=20, choices=Tipos.choices)
+    usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='emails_pendientes')
+    destinatario = models.EmailField()
+    contexto = models.JSONField(default=dict, blank=True, help_text="Datos para renderizar la plantilla al enviar")
+    estado = models.CharField(max_length=10, choices=Estados.choices, default=Estados.PENDIENTE)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    enviado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Email pendiente"
+        verbose_name_plural = "Emails pendientes"
+        ordering = ['proximo_intento']
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='email_estado_proximo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} a {self.destinatario} ({self.get_estado_display()})"
@@ -88,4 +88,66 @@ def test_crear_mipyme_para_creador_asigna_propietario(client, sector_economico,
 
     # La prueba clave: el propietario es el usuario que estaba logueado
     assert mipyme.propietario == creador
-    assert creador.mipyme == mipyme
\ No newline at end of file
+    assert creador.mipyme == mipyme
+@pytest.mark.django_db
+def test_registro_encola_email_y_worker_lo_envia_con_reintentos(client, sector_economico, settings):
+    """
+    El registro solo encola el email de confirmación; el worker lo envía por lotes,
+    reprograma con backoff los fallos y descarta el email tras el máximo de intentos.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from cuentas.cola_emails import TransporteMemoria, procesar_pendientes
+    from cuentas.models import EmailPendiente
+
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}}
+    settings.EMAIL_COLA = {'transporte': 'memoria', 'max_intentos': 2, 'backoff': 60}
+    TransporteMemoria.buzon.clear()
+
+    client.post(reverse('cuentas:registro_mipyme'), {
+        'nombre_empresa': 'Empresa Cola',
+        'identificador_fiscal': '987654321',
+        'sector_economico': sector_economico.id,
+        'first_name': 'Ana',
+        'last_name': 'Cola',
+        'email': 'ana@empresa.com',
+        'password': 'password123',
+        'password_confirmacion': 'password123',
+    })
+    usuario = User.objects.get(email='ana@empresa.com')
+    email = EmailPendiente.objects.get()
+    assert email.tipo == EmailPendiente.Tipos.CONFIRMACION
+    assert email.estado == EmailPendiente.Estados.PENDIENTE
+    assert TransporteMemoria.buzon == []
+
+    # Un fallo del transporte reprograma el email con backoff
+    class TransporteCaido:
+        def enviar(self, mensajes):
+            raise ConnectionError("Resend no responde")
+
+    assert procesar_pendientes(transporte_envio=TransporteCaido()) == {'enviados': 0, 'reintentos': 1, 'fallidos': 0}
+    email.refresh_from_db()
+    assert email.estado == EmailPendiente.Estados.PENDIENTE
+    assert email.proximo_intento > timezone.now() + timedelta(seconds=50)
+    assert 'Resend no responde' in email.ultimo_error
+    # Aún no vence: el worker no lo toma
+    assert procesar_pendientes() == {'enviados': 0, 'reintentos': 0, 'fallidos': 0}
+
+    EmailPendiente.objects.update(proximo_intento=timezone.now())
+    assert procesar_pendientes() == {'enviados': 1, 'reintentos': 0, 'fallidos': 0}
+    email.refresh_from_db()
+    assert email.estado == EmailPendiente.Estados.ENVIADO
+    mensaje, = TransporteMemoria.buzon
+    assert mensaje['to'] == ['ana@empresa.com']
+    assert usuario.codigo_confirmacion in mensaje['html']
+
+    # Tras el máximo de intentos, el email queda fallido
+    bienvenida = EmailPendiente.objects.create(
+        tipo=EmailPendiente.Tipos.BIENVENIDA, usuario=usuario, destinatario=usuario.email
+    )
+    procesar_pendientes(transporte_envio=TransporteCaido())
+    EmailPendiente.objects.filter(pk=bienvenida.pk).update(proximo_intento=timezone.now())
+    assert procesar_pendientes(transporte_envio=TransporteCaido()) == {'enviados': 0, 'reintentos': 0, 'fallidos': 1}
+    bienvenida.refresh_from_db()
+    assert bienvenida.estado == EmailPendiente.Estados.FALLIDO
+    assert bienvenida.intentos == 2
@@ -2,8 +2,6 @@
 import random
 import string
 import logging
-import os
-import resend
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.core.files.storage import default_storage
@@ -12,176 +10,108 @@ from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 
+from .cola_emails import encolar_email
+from .models import EmailPendiente
+
 logger = logging.getLogger(__name__)
 
+REMITENTE = "NimyPine <noreply@codeader.com>"
+
+
+def _protocolo_y_dominio(request):
+    # Fallback si el email se pide fuera de una petición (por ejemplo, desde la API)
+    if request is None:
+        return {'protocol': 'https', 'domain': 'nimypine.com'}
+    return {'protocol': 'https' if request.is_secure() else 'http', 'domain': request.get_host()}
+
+
 def enviar_email_reset_password(user, request):
     """
-    Envía el email de restablecimiento de contraseña usando Resend.
+    Encola el email de restablecimiento de contraseña.
+    El token se genera al enviarlo, así que la cola no guarda nada con lo que cambiar la contraseña.
     """
-    logger.info(f"=== INICIO enviar_email_reset_password para {user.email} (usando Resend) ===")
-    
-    api_key = os.environ.get('RESEND')
-    if not api_key:
-        logger.error("RESEND (API Key) no encontrada.")
-        return False
-    resend.api_key = api_key
-
-    token = default_token_generator.make_token(user)
-    uid = urlsafe_base64_encode(force_bytes(user.pk))
-    
-    protocol = 'https' if request.is_secure() else 'http'
-    domain = request.get_host()
-    
-    # Generar URL firmada del logo desde el bucket
-    try:
-        logo_url = default_storage.url('icono.png')
-    except Exception as e:
-        logger.error(f"Error generando URL del logo: {e}")
-        # Fallback a URL estática si falla la generación (aunque probablemente falle también si es privado)
-        logo_url = f"https://{settings.MINIO_STORAGE_ENDPOINT}/{settings.MINIO_STORAGE_MEDIA_BUCKET_NAME}/icono.png"
+    encolar_email(EmailPendiente.Tipos.RESET_PASSWORD, user, _protocolo_y_dominio(request))
+    logger.info(f"Email de reset encolado para {user.email}")
+    return True
 
-    context = {
-        'email': user.email,
-        'domain': domain,
-        'site_name': 'NimyPine',
-        'uid': uid,
-        'token': token,
-        'protocol': protocol,
-        'user': user,
-        'logo_url': logo_url,
-    }
-    
-    subject = 'Restablecer tu contraseña en NimyPine'
-    html_body = render_to_string('cuentas/email/password_reset_email.html', context)
-    
-    try:
-        params = {
-            "from": "NimyPine <noreply@codeader.com>",
-            "to": [user.email],
-            "subject": subject,
-            "html": html_body,
-        }
-        resend.Emails.send(params)
-        logger.info(f"Email de reset enviado a {user.email}")
-        return True
-    except Exception as e:
-        logger.error(f"Error enviando email reset: {e}")
-        return False
 
 def enviar_email_confirmacion(user, request=None):
     """
-    Envía el email de confirmación usando Resend y retorna el código generado.
-    El código se guarda en la BD antes de intentar enviar el email.
+    Genera el código de confirmación, lo guarda en la BD y encola el email que lo envía.
+    Retorna el código generado.
     """
-    logger.info(f"=== INICIO enviar_email_confirmacion para {user.email} (usando Resend) ===")
-    
-    # Configurar API Key de Resend desde variables de entorno
-    api_key = os.environ.get('RESEND')
-    if not api_key:
-        logger.error("RESEND (API Key) no encontrada en las variables de entorno.")
-        return None
-    resend.api_key = api_key
-    
     codigo = ''.join(random.choices(string.digits, k=6))
     user.codigo_confirmacion = codigo
-    user.save()
-    logger.info(f"Código de confirmación generado y guardado: {codigo}")
-    
-    # Obtener dominio y protocolo para URL absoluta de imágenes (fallback si falla bucket)
-    protocol = 'https'
-    domain = 'nimypine.com' # Fallback default
-    if request:
-        protocol = 'https' if request.is_secure() else 'http'
-        domain = request.get_host()
-
-    # Generar URL firmada del logo desde el bucket
-    try:
-        logo_url = default_storage.url('icono.png')
-    except Exception as e:
-        logger.error(f"Error generando URL del logo: {e}")
-        logo_url = f"https://{settings.MINIO_STORAGE_ENDPOINT}/{settings.MINIO_STORAGE_MEDIA_BUCKET_NAME}/icono.png"
-
-    context = {
-        'codigo': codigo,
-        'protocol': protocol,
-        'domain': domain,
-        'logo_url': logo_url,
-    }
-
-    subject = 'Confirma tu correo electrónico en NimyPine'
-    html_body = render_to_string('cuentas/email/email_confirmacion.html', context)
-    logger.info("Template de email renderizado correctamente.")
-    
-    try:
-        logger.info(f"Intentando enviar email a {user.email} vía Resend...")
-        params = {
-            "from": "NimyPine <noreply@codeader.com>",
-            "to": [user.email],
-            "subject": subject,
-            "html": html_body,
-        }
-        email = resend.Emails.send(params)
-        logger.info(f"Email enviado exitosamente a {user.email}. Response: {email}")
-        
-    except Exception as e:
-        logger.error(f"ERROR al enviar email de confirmación a {user.email} con Resend: {type(e).__name__}: {e}")
-        import traceback
-        logger.error(f"Traceback completo:\n{traceback.format_exc()}")
-    
-    logger.info(f"=== FIN enviar_email_confirmacion ===")
+    user.save(update_fields=['codigo_confirmacion'])
+    encolar_email(EmailPendiente.Tipos.CONFIRMACION, user, {**_protocolo_y_dominio(request), 'codigo': codigo})
+    logger.info(f"Email de confirmación encolado para {user.email}")
     return codigo
 
+
 def enviar_email_bienvenida(user, request=None):
     """
-    Envía el email de bienvenida al usuario usando Resend.
+    Encola el email de bienvenida al usuario.
     """
-    logger.info(f"=== INICIO enviar_email_bienvenida para {user.email} (usando Resend) ===")
-
-    api_key = os.environ.get('RESEND')
-    if not api_key:
-        logger.error("RESEND (API Key) no encontrada en las variables de entorno para email de bienvenida.")
-        return
-    resend.api_key = api_key
-
-    # Obtener dominio y protocolo para URL absoluta de imágenes (fallback)
-    protocol = 'https'
-    domain = 'nimypine.com' # Fallback default
-    if request:
-        protocol = 'https' if request.is_secure() else 'http'
-        domain = request.get_host()
-
-    # Generar URL firmada del logo desde el bucket
+    encolar_email(EmailPendiente.Tipos.BIENVENIDA, user, _protocolo_y_dominio(request))
+    logger.info(f"Email de bienvenida encolado para {user.email}")
+
+
+# --- CONSTRUCCIÓN DE LOS EMAILS (la usa el comando procesar_cola_emails) ---
+
+def url_logo():
+    """URL firmada del logo desde el bucket; el worker la genera una vez por lote."""
     try:
-        logo_url = default_storage.url('icono.png')
+        return default_storage.url('icono.png')
     except Exception as e:
         logger.error(f"Error generando URL del logo: {e}")
-        logo_url = f"https://{settings.MINIO_STORAGE_ENDPOINT}/{settings.MINIO_STORAGE_MEDIA_BUCKET_NAME}/icono.png"
+        # Fallback a URL estática si falla la generación (aunque probablemente falle también si es privado)
+        return f"https://{settings.MINIO_STORAGE_ENDPOINT}/{settings.MINIO_STORAGE_MEDIA_BUCKET_NAME}/icono.png"
+
 
-    context = {
+def _contexto_reset_password(email, logo_url):
+    user = email.usuario
+    return 'Restablecer tu contraseña en NimyPine', 'cuentas/email/password_reset_email.html', {
+        'email': user.email,
+        'site_name': 'NimyPine',
+        'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+        'token': default_token_generator.make_token(user),
         'user': user,
-        'protocol': protocol,
-        'domain': domain,
-        'logo_url': logo_url,
     }
 
-    subject = '¡Bienvenido a NimyPine!'
-    html_body = render_to_string('cuentas/email/email_bienvenida.html', context)
-    logger.info("Template de email de bienvenida renderizado correctamente.")
 
-    try:
-        logger.info(f"Intentando enviar email de bienvenida a {user.email} vía Resend...")
-        params = {
-            "from": "NimyPine <noreply@codeader.com>",
-            "to": [user.email],
-            "subject": subject,
-            "html": html_body,
-        }
-        email = resend.Emails.send(params)
-        logger.info(f"Email de bienvenida enviado exitosamente a {user.email}. Response: {email}")
+def _contexto_confirmacion(email, logo_url):
+    return 'Confirma tu correo electrónico en NimyPine', 'cuentas/email/email_confirmacion.html', {
+        'codigo': email.contexto['codigo'],
+    }
 
-    except Exception as e:
-        logger.error(f"ERROR al enviar email de bienvenida a {user.email} con Resend: {type(e).__name__}: {e}")
-        import traceback
-        logger.error(f"Traceback completo:\n{traceback.format_exc()}")
 
-    logger.info(f"=== FIN enviar_email_bienvenida ===")
\ No newline at end of file
+def _contexto_bienvenida(email, logo_url):
+    return '¡Bienvenido a NimyPine!', 'cuentas/email/email_bienvenida.html', {
+        'user': email.usuario,
+    }
+
+
+_CONSTRUCTORES = {
+    EmailPendiente.Tipos.RESET_PASSWORD: _contexto_reset_password,
+    EmailPendiente.Tipos.CONFIRMACION: _contexto_confirmacion,
+    EmailPendiente.Tipos.BIENVENIDA: _contexto_bienvenida,
+}
+
+
+def construir_email(email, logo_url):
+    """
+    Renderiza un EmailPendiente y devuelve los parámetros de envío de Resend
+    (from, to, subject, html).
+    """
+    asunto, plantilla, contexto = _CONSTRUCTORES[email.tipo](email, logo_url)
+    contexto.update({
+        'protocol': email.contexto.get('protocol', 'https'),
+        'domain': email.contexto.get('domain', 'nimypine.com'),
+        'logo_url': logo_url,
+    })
+    return {
+        "from": REMITENTE,
+        "to": [email.destinatario],
+        "subject": asunto,
+        "html": render_to_string(plantilla, contexto),
+    }
@@ -276,6 +276,16 @@ def health_check(request):
         # Si falla, devuelve un error
         return JsonResponse({"status": "error", "message": f"No se pudo conectar a la base de datos: {e}"}, status=500)
 
+
+@login_required
+def metricas_almacenamiento(request):
+    """Aciertos de la caché de URLs firmadas de media en este proceso (solo superusuarios)."""
+    from django.core.exceptions import PermissionDenied
+    from mipymes_project.storage import metricas_urls
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    return JsonResponse(metricas_urls())
+
 from .utils import enviar_email_confirmacion, enviar_email_bienvenida, enviar_email_reset_password
 from django.contrib.auth.tokens import default_token_generator
 
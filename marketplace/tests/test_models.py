@@ -1,3 +1,4 @@
+import time
 import pytest
 from django.contrib.auth import get_user_model
 from marketplace.models import PlantillaExcel
@@ -33,4 +34,75 @@ def test_crear_plantilla_excel(usuario_mipyme):
     assert plantilla.nombre == 'Mi Plantilla de Prueba'
     assert plantilla.creador == usuario_mipyme
     assert str(plantilla) == 'Mi Plantilla de Prueba'
-    assert plantilla.downloads == 0
\ No newline at end of file
+    assert plantilla.downloads == 0
+
+def test_urls_firmadas_de_media_se_cachean(settings):
+    """
+    Las imágenes de la tienda se firman una sola vez: las siguientes llamadas a url()
+    salen de la LRU del proceso o de la caché compartida, hasta poco antes de vencer.
+    """
+    from minio import Minio
+    from mipymes_project.storage import MinioMediaCacheada, cache_urls
+
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'media-urls'}}
+    settings.MEDIA_URLS_FIRMADAS = {'duracion': 7200, 'margen': 600, 'cache': 'default'}
+    cliente = Minio('localhost:9000', access_key='clave', secret_key='secreto', secure=False, region='us-east-1')
+    storage = MinioMediaCacheada(
+        minio_client=cliente, bucket_name='media', presign_urls=True,
+        auto_create_bucket=False, auto_create_policy=False, assume_bucket_exists=True,
+    )
+    cache_urls().limpiar()
+
+    url = storage.url('productos/cafe 1.png')
+    assert 'X-Amz-Expires=7200' in url
+    assert all(storage.url('productos/cafe 1.png') == url for _ in range(50))
+    assert cache_urls().metricas()['fallos'] == 1
+    assert cache_urls().metricas()['aciertos'] == 50
+
+    # Otro proceso (caché local vacía) reutiliza la URL de la caché compartida
+    cache_urls().limpiar()
+    assert storage.url('productos/cafe 1.png') == url
+    assert cache_urls().metricas()['aciertos_compartida'] == 1
+
+    # Cerca del vencimiento se firma una URL nueva
+    cache_urls().limpiar()
+    settings.MEDIA_URLS_FIRMADAS = {'duracion': 7200, 'margen': 600}
+    clave = ('media', 'productos/cafe 1.png', 7200)
+    cache_urls().guardar(clave, url, time.time() + 300)
+    storage.url('productos/cafe 1.png')
+    assert cache_urls().metricas()['fallos'] == 1
+
+
+@pytest.mark.django_db
+def test_descarga_de_plantilla_no_carga_el_archivo_en_memoria(usuario_mipyme, client, settings, monkeypatch):
+    """
+    Con MinIO la descarga redirige a una URL firmada de corta vigencia que fija el
+    nombre del archivo; con otros almacenamientos se envía por partes con Content-Length.
+    """
+    from django.core.files.base import ContentFile
+    from django.urls import reverse
+    from minio import Minio
+    from mipymes_project.storage import MinioMediaCacheada
+
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}}
+    plantilla = PlantillaExcel.objects.create(nombre='Costos Año', creador=usuario_mipyme, precio=0)
+    plantilla.archivo_plantilla.save('costos.xlsx', ContentFile(b'x' * 5000))
+    client.force_login(usuario_mipyme)
+    url = reverse('marketplace_descargar', args=[plantilla.pk])
+
+    response = client.get(url)
+    assert response.streaming
+    assert response['Content-Length'] == '5000'
+    assert "filename*=utf-8''Costos%20A%C3%B1o.xlsx" in response['Content-Disposition']
+    assert b''.join(response.streaming_content) == b'x' * 5000
+
+    storage = MinioMediaCacheada(
+        minio_client=Minio('localhost:9000', access_key='clave', secret_key='secreto', secure=False, region='us-east-1'),
+        bucket_name='media', presign_urls=True, auto_create_bucket=False, auto_create_policy=False, assume_bucket_exists=True,
+    )
+    monkeypatch.setattr(PlantillaExcel._meta.get_field('archivo_plantilla'), 'storage', storage)
+    response = client.get(url)
+    assert response.status_code == 302
+    assert response.url.startswith(f'http://localhost:9000/media/{plantilla.archivo_plantilla.name}?')
+    assert 'X-Amz-Expires=300' in response.url and 'response-content-disposition=attachment' in response.url
+    assert PlantillaExcel.objects.get(pk=plantilla.pk).downloads == 2
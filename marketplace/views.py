@@ -3,13 +3,16 @@ from django.shortcuts import render
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import FileResponse, Http404
+from django.utils.http import content_disposition_header
+from datetime import timedelta
 from django.conf import settings
 from django.urls import reverse
 from decimal import Decimal
 import paypalrestsdk
 from .models import PlantillaExcel, Purchase  # Importamos el modelo de esta misma app
 from .forms import PlantillaExcelForm
+from mipymes_project.streaming import por_partes
 
 # Configurar PayPal
 paypalrestsdk.configure({
@@ -18,6 +21,38 @@ paypalrestsdk.configure({
     "client_secret": settings.PAYPAL_CLIENT_SECRET
 })
 
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Vigencia de la URL firmada de descarga: solo alcanza para iniciar la descarga
+VIGENCIA_DESCARGA = timedelta(minutes=5)
+
+
+def respuesta_descarga(request, plantilla):
+    """
+    Descarga del archivo de una plantilla ya autorizada.
+
+    Con MinIO redirige a una URL firmada de corta vigencia que fuerza la descarga
+    con el nombre de la plantilla: el archivo va directo del bucket al navegador
+    (con Content-Length y Range) y no ocupa un worker durante la transferencia.
+    Con otros almacenamientos se envía por partes con FileResponse.
+    """
+    archivo = plantilla.archivo_plantilla
+    if not archivo:
+        raise Http404("La plantilla no tiene un archivo para descargar.")
+    nombre = f"{plantilla.nombre}.xlsx"
+    storage = archivo.storage
+    cliente = getattr(storage, 'client', None)
+    if cliente is not None and getattr(storage, 'base_url', None) is None:
+        url = cliente.presigned_get_object(
+            storage.bucket_name, archivo.name, expires=VIGENCIA_DESCARGA,
+            response_headers={
+                'response-content-disposition': content_disposition_header(True, nombre),
+                'response-content-type': CONTENT_TYPE_XLSX,
+            },
+        )
+        return redirect(url)
+    return por_partes(request, FileResponse(archivo.open('rb'), as_attachment=True, filename=nombre, content_type=CONTENT_TYPE_XLSX))
+
+
 def listado_plantillas(request):
     """
     Esta vista muestra todas las plantillas de Excel disponibles en el marketplace.
@@ -84,17 +119,13 @@ def descargar_plantilla(request, plantilla_id):
     # Verificar si el usuario ya ha comprado esta plantilla
     if Purchase.objects.filter(usuario=request.user, plantilla=plantilla).exists():
         # Ya pagado, descargar directamente
-        response = HttpResponse(plantilla.archivo_plantilla, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{plantilla.nombre}.xlsx"'
-        return response
+        return respuesta_descarga(request, plantilla)
 
     if plantilla.precio is None or plantilla.precio == 0:
         # Descarga gratuita
         plantilla.downloads += 1
         plantilla.save()
-        response = HttpResponse(plantilla.archivo_plantilla, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="{plantilla.nombre}.xlsx"'
-        return response
+        return respuesta_descarga(request, plantilla)
     else:
         # Pago requerido
         payment = paypalrestsdk.Payment({
@@ -167,9 +198,7 @@ def pago_exitoso(request, plantilla_id):
             del request.session[f'paypal_payment_id_{plantilla_id}']
 
             # Descargar archivo
-            response = HttpResponse(plantilla.archivo_plantilla, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = f'attachment; filename="{plantilla.nombre}.xlsx"'
-            return response
+            return respuesta_descarga(request, plantilla)
         else:
             return render(request, 'marketplace/detalle_plantilla.html', {
                 'plantilla': plantilla,
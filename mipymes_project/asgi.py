@@ -13,4 +13,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mipymes_project.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from asistente.llm import cerrar_sesiones  # noqa: E402  (necesita las apps cargadas)
+
+
+async def application(scope, receive, send):
+    # Django no atiende el protocolo lifespan: al apagar se cierran aquí las
+    # sesiones HTTP persistentes con los proveedores de IA
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensaje['type'] == 'lifespan.shutdown':
+            await cerrar_sesiones()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -86,6 +86,20 @@ WSGI_APPLICATION = "mipymes_project.wsgi.application"
 DATABASES = {
     'default': env.db(),
 }
+# Rol de PostgreSQL de solo lectura con el que corre el SQL del chat: solo necesita poder
+# conectarse; migrate le da lectura sobre las vistas por Mipyme (ver asistente/sandbox.py)
+if env.str('ASISTENTE_DATABASE_URL', default=''):
+    DATABASES['asistente'] = env.db('ASISTENTE_DATABASE_URL')
+
+# --- Cachés ---
+# 'default' es la memoria de cada proceso (páginas, contextos, gráficos). 'compartida'
+# guarda las versiones que invalidan esas entradas y la ven todos los procesos (web,
+# worker y comandos): por defecto una tabla de la base de datos (createcachetable);
+# CACHE_URL admite, por ejemplo, redis://
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'compartida': env.cache('CACHE_URL', default='dbcache://cache_compartida'),
+}
 
 # --- Validación de Contraseñas ---
 AUTH_PASSWORD_VALIDATORS = [
@@ -115,7 +129,7 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Storage configuration for Django 5.2+
 STORAGES = {
     "default": {
-        "BACKEND": "minio_storage.storage.MinioMediaStorage",
+        "BACKEND": "mipymes_project.storage.MinioMediaCacheada",
     },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
@@ -133,6 +147,29 @@ MINIO_STORAGE_AUTO_CREATE_BUCKET = True
 MINIO_STORAGE_AUTO_CREATE_POLICY = True
 MINIO_STORAGE_MEDIA_USE_PRESIGNED = True
 
+# Caché de URLs firmadas de media (ver mipymes_project/storage.py): vigencia de cada URL,
+# margen antes de vencer en que deja de servirse, tamaño de la LRU del proceso y alias
+# de CACHES compartido entre procesos (vacío para usar solo la del proceso)
+MEDIA_URLS_FIRMADAS = {
+    'duracion': env.int('MEDIA_URLS_DURACION', default=7 * 24 * 3600),
+    'margen': env.int('MEDIA_URLS_MARGEN', default=3600),
+    'max_entradas': env.int('MEDIA_URLS_MAX_ENTRADAS', default=10000),
+    'cache': env.str('MEDIA_URLS_CACHE', default='') or None,
+}
+
+# Carga en bloque de imágenes de productos (ver produccion/carga_imagenes.py): hilos del
+# pool de subidas por proceso, tamaño máximo y vigencia de las subidas directas a MinIO
+PRODUCCION_CARGA_IMAGENES = {
+    'hilos': env.int('CARGA_IMAGENES_HILOS', default=6),
+    'max_mb': env.int('CARGA_IMAGENES_MAX_MB', default=10),
+    'vigencia_segundos': env.int('CARGA_IMAGENES_VIGENCIA', default=600),
+}
+
+# Exportaciones a Excel que genera el worker (produccion.excel)
+PRODUCCION_EXPORTACIONES = {
+    'vigencia_horas': env.int('EXPORTACIONES_VIGENCIA_HORAS', default=24),
+}
+
 # PayPal settings
 PAYPAL_CLIENT_ID = env('PAYPAL_ID_CLIENT')
 PAYPAL_CLIENT_SECRET = env('PAYPAL_KEY')
@@ -140,7 +177,8 @@ PAYPAL_MODE = 'sandbox'  # Cambiar a 'live' para producción
 
 # Email settings
 # La configuración de email SMTP se ha movido a una llamada directa a la API de Resend
-# en cuentas/utils.py para solucionar problemas de conectividad en Railway.
+# en cuentas/cola_emails.py (envía los emails que encola cuentas/utils.py) para solucionar
+# problemas de conectividad en Railway.
 # Para el desarrollo local y formularios de Django por defecto (como reset password), usamos la consola.
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -157,6 +195,17 @@ else:
     EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PWS')
     DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Cola de emails de cuentas (ver cuentas/cola_emails.py): las vistas encolan y el worker
+# `manage.py procesar_cola_emails` envía por lotes con el transporte indicado ('resend' o
+# 'memoria'), reintentando con backoff exponencial hasta `max_intentos`
+EMAIL_COLA = {
+    'transporte': env.str('EMAIL_COLA_TRANSPORTE', default='resend'),
+    'lote': env.int('EMAIL_COLA_LOTE', default=50),
+    'max_intentos': env.int('EMAIL_COLA_MAX_INTENTOS', default=5),
+    'backoff': env.int('EMAIL_COLA_BACKOFF', default=60),
+    'intervalo': env.int('EMAIL_COLA_INTERVALO', default=5),
+}
+
 # --- Resto de la Configuración ---
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = 'cuentas.Usuario'
@@ -198,6 +247,40 @@ LOGGING = {
     },
 }
 
+# Tokens máximos del contexto de la empresa que el asistente envía al modelo
+ASISTENTE_CONTEXTO_MAX_TOKENS = env.int('ASISTENTE_CONTEXTO_MAX_TOKENS', default=3000)
+
+# Configuración por proveedor de IA (ver asistente/llm.py): URL base opcional (por ejemplo,
+# un proxy o un servidor de pruebas), segundos sin recibir datos, duración máxima de la
+# respuesta, llamadas simultáneas por proceso, segundos de espera por un turno libre,
+# reintentos y fallos seguidos que abren el circuito durante `enfriamiento` segundos
+ASISTENTE_PROVEEDORES = {
+    proveedor: {
+        **({'url': env.str(f'{proveedor.upper()}_URL')} if env.str(f'{proveedor.upper()}_URL', default='') else {}),
+        'timeout': env.int(f'{proveedor.upper()}_TIMEOUT', default=30),
+        'timeout_total': env.int(f'{proveedor.upper()}_TIMEOUT_TOTAL', default=180),
+        'concurrencia': env.int(f'{proveedor.upper()}_CONCURRENCIA', default=4),
+        'espera': env.int(f'{proveedor.upper()}_ESPERA', default=5),
+        'reintentos': env.int(f'{proveedor.upper()}_REINTENTOS', default=2),
+        'umbral_fallos': env.int(f'{proveedor.upper()}_UMBRAL_FALLOS', default=5),
+        'enfriamiento': env.int(f'{proveedor.upper()}_ENFRIAMIENTO', default=30),
+    }
+    for proveedor in ('openai', 'gemini', 'deepseek')
+}
+
+# Caché en memoria de respuestas del asistente (ver asistente/cache_respuestas.py)
+ASISTENTE_CACHE_MAX_ENTRADAS = env.int('ASISTENTE_CACHE_MAX_ENTRADAS', default=500)
+ASISTENTE_CACHE_TTL = env.int('ASISTENTE_CACHE_TTL', default=600)
+
+# Procesos aislados para el SQL, el código y los gráficos del chat (ver asistente/sandbox.py)
+ASISTENTE_SANDBOX = {
+    'procesos': env.int('ASISTENTE_SANDBOX_PROCESOS', default=2),
+    'cpu_segundos': env.int('ASISTENTE_SANDBOX_CPU_SEGUNDOS', default=5),
+    'reloj_segundos': env.int('ASISTENTE_SANDBOX_RELOJ_SEGUNDOS', default=10),
+    'memoria_mb': env.int('ASISTENTE_SANDBOX_MEMORIA_MB', default=1536),
+    'max_filas': env.int('ASISTENTE_SANDBOX_MAX_FILAS', default=200),
+}
+
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -0,0 +1,171 @@
+# mipymes_project/storage.py
+"""
+Almacenamiento de media en MinIO con caché de URLs firmadas.
+
+Con MINIO_STORAGE_MEDIA_USE_PRESIGNED cada storage.url() firma una URL nueva
+(HMAC sobre la petición, y la consulta de la región del bucket la primera vez).
+Las páginas con muchas imágenes firman cientos de URLs por petición. Aquí cada
+URL firmada se reutiliza, por nombre de objeto, hasta `margen` segundos antes
+de que venza:
+
+- primero una caché LRU acotada en el proceso (`max_entradas`);
+- opcionalmente una caché de Django compartida entre procesos (`cache`, el alias
+  de CACHES), para que todos los workers sirvan la misma URL y el navegador
+  también la encuentre en su caché HTTP.
+
+La configuración está en MEDIA_URLS_FIRMADAS. metricas_urls() devuelve los
+aciertos y fallos de este proceso.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from minio_storage.storage import MinioMediaStorage
+
+CONFIG_POR_DEFECTO = {
+    # Vigencia de las URLs firmadas (la de minio por defecto, el máximo que admite S3)
+    'duracion': 7 * 24 * 3600,
+    # Segundos de vigencia que le quedan como mínimo a una URL al servirla
+    'margen': 3600,
+    'max_entradas': 10000,
+    # Alias de CACHES compartido entre procesos; None para usar solo la caché del proceso
+    'cache': None,
+}
+
+
+def configuracion():
+    return {**CONFIG_POR_DEFECTO, **getattr(settings, 'MEDIA_URLS_FIRMADAS', {})}
+
+
+class CacheURLs:
+    """LRU de URLs firmadas con su vencimiento (time.time()), segura entre hilos."""
+
+    def __init__(self, max_entradas):
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.aciertos_compartida = 0
+        self.fallos = 0
+
+    def obtener(self, clave, ahora):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            if entrada[1] <= ahora:
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def contar(self, contador):
+        with self._lock:
+            setattr(self, contador, getattr(self, contador) + 1)
+
+    def guardar(self, clave, url, vence):
+        with self._lock:
+            self._entradas[clave] = (url, vence)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def descartar(self, clave):
+        with self._lock:
+            self._entradas.pop(clave, None)
+
+    def metricas(self):
+        with self._lock:
+            consultas = self.aciertos + self.aciertos_compartida + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'max_entradas': self.max_entradas,
+                'aciertos': self.aciertos,
+                'aciertos_compartida': self.aciertos_compartida,
+                'fallos': self.fallos,
+                'tasa_aciertos': round((self.aciertos + self.aciertos_compartida) / consultas, 3) if consultas else None,
+            }
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.aciertos = self.aciertos_compartida = self.fallos = 0
+
+
+_cache_urls = None
+_cache_urls_lock = threading.Lock()
+
+
+def cache_urls():
+    global _cache_urls
+    if _cache_urls is None:
+        with _cache_urls_lock:
+            if _cache_urls is None:
+                _cache_urls = CacheURLs(configuracion()['max_entradas'])
+    return _cache_urls
+
+
+def metricas_urls():
+    return cache_urls().metricas()
+
+
+class URLFirmadaCacheadaMixin:
+    """Cachea el resultado de url() de un storage que firma sus URLs (presign_urls)."""
+
+    def url(self, name, *, max_age=None):
+        if not getattr(self, 'presign_urls', False) or name is None:
+            return super().url(name, max_age=max_age)
+        config = configuracion()
+        duracion = int((max_age or timedelta(seconds=config['duracion'])).total_seconds())
+        # Una URL que vence antes del margen no se cachea
+        if duracion <= config['margen']:
+            return super().url(name, max_age=max_age)
+
+        clave = (self.bucket_name, name, duracion)
+        cache_local = cache_urls()
+        ahora = time.time()
+        url = cache_local.obtener(clave, ahora + config['margen'])
+        if url is not None:
+            return url
+
+        compartida = caches[config['cache']] if config['cache'] else None
+        clave_compartida = self._clave_compartida(clave)
+        if compartida is not None:
+            guardada = compartida.get(clave_compartida)
+            if guardada and guardada[1] > ahora + config['margen']:
+                cache_local.guardar(clave, *guardada)
+                cache_local.contar('aciertos_compartida')
+                return guardada[0]
+
+        cache_local.contar('fallos')
+        url = super().url(name, max_age=timedelta(seconds=duracion))
+        vence = ahora + duracion
+        cache_local.guardar(clave, url, vence)
+        if compartida is not None:
+            compartida.set(clave_compartida, (url, vence), duracion - config['margen'])
+        return url
+
+    @staticmethod
+    def _clave_compartida(clave):
+        bucket, name, duracion = clave
+        # Los nombres de objeto pueden tener espacios o superar el largo de clave de memcached
+        resumen = hashlib.sha1(f'{bucket}/{name}'.encode()).hexdigest()
+        return f'media_url:{duracion}:{resumen}'
+
+    def delete(self, name):
+        super().delete(name)
+        # Solo la URL con la duración por defecto; las de otro max_age vencen solas
+        config = configuracion()
+        clave = (self.bucket_name, name, config['duracion'])
+        cache_urls().descartar(clave)
+        if config['cache']:
+            caches[config['cache']].delete(self._clave_compartida(clave))
+
+
+class MinioMediaCacheada(URLFirmadaCacheadaMixin, MinioMediaStorage):
+    """Storage de media del sitio: MinioMediaStorage con URLs firmadas cacheadas."""
@@ -0,0 +1,44 @@
+# mipymes_project/streaming.py
+"""
+Respuestas por partes (StreamingHttpResponse, FileResponse) que también se envían
+por partes con ASGI.
+
+Con ASGI, Django consume completo el iterador síncrono de una respuesta por partes
+(sync_to_async(list)) antes de enviar el primer byte, así que una exportación
+grande se arma entera en memoria. por_partes() deja la respuesta igual con WSGI y,
+con ASGI, la cambia por un iterador asíncrono que lee el original por bloques en el
+hilo de las vistas síncronas, el mismo que abrió la conexión y los cursores de la
+base de datos.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+# Bytes que se leen del iterador original en cada salto al hilo de las vistas
+TAMANO_BLOQUE = 64 * 1024
+
+
+def _leer_bloque(partes):
+    bloque, tamano = [], 0
+    for parte in partes:
+        bloque.append(parte)
+        tamano += len(parte)
+        if tamano >= TAMANO_BLOQUE:
+            break
+    return b''.join(bloque)
+
+
+async def _bloques(partes):
+    leer = sync_to_async(_leer_bloque, thread_sensitive=True)
+    while True:
+        bloque = await leer(partes)
+        if not bloque:
+            return
+        yield bloque
+
+
+def por_partes(request, response):
+    """Devuelve `response` lista para enviarse por partes con el servidor que atiende `request`."""
+    if isinstance(request, ASGIRequest) and response.streaming and not response.is_async:
+        # Los archivos y generadores originales se siguen cerrando con response.close()
+        response.streaming_content = _bloques(iter(response.streaming_content))
+    return response
@@ -4,10 +4,11 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path, include
-from cuentas.views import health_check, pagina_inicio
+from cuentas.views import health_check, metricas_almacenamiento, pagina_inicio
 
 urlpatterns = [
     path('health-check/', health_check, name='health_check'),
+    path('metricas/almacenamiento/', metricas_almacenamiento, name='metricas_almacenamiento'),
     path('', pagina_inicio, name='home'),
     path('admin/', admin.site.urls),
 
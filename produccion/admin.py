@@ -2,7 +2,7 @@
 from django.contrib import admin
 from .models import (
     Producto, Insumo, UnidadMedida, EstándaresProducto,
-    Venta, VentaItem, Impuesto
+    Venta, VentaItem, Impuesto, ResumenVentasMensual, ExportacionExcel
 )
 
 class VentaItemInline(admin.TabularInline):
@@ -26,6 +26,20 @@ class VentaItemAdmin(admin.ModelAdmin):
     search_fields = ('venta__id', 'producto__nombre')
     readonly_fields = ('subtotal',)
 
+@admin.register(ResumenVentasMensual)
+class ResumenVentasMensualAdmin(admin.ModelAdmin):
+    list_display = ('mipyme', 'mes', 'producto', 'ingresos', 'unidades', 'costo')
+    list_filter = ('mipyme', 'mes')
+    search_fields = ('mipyme__nombre', 'producto__nombre')
+    readonly_fields = ('mipyme', 'mes', 'producto', 'ingresos', 'unidades', 'costo')
+
+@admin.register(ExportacionExcel)
+class ExportacionExcelAdmin(admin.ModelAdmin):
+    list_display = ('mipyme', 'estado', 'creado', 'vence')
+    list_filter = ('estado',)
+    search_fields = ('mipyme__nombre',)
+    readonly_fields = ('mipyme', 'estado', 'ruta', 'ultimo_error', 'creado', 'iniciado', 'vence')
+
 admin.site.register(Producto)
 admin.site.register(Insumo)
 admin.site.register(UnidadMedida)
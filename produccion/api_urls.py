@@ -1,11 +1,17 @@
 from django.urls import path
-from .api_views import ProductListAPIView, CrearVentaAPIView, StoreProductListAPIView, ToggleTiendaVisibleView
+from .api_views import (
+    ProductListAPIView, CrearVentaAPIView, VentasEnLoteAPIView, StoreProductListAPIView, ToggleTiendaVisibleView,
+    SubidaImagenesAPIView, ConfirmarImagenesAPIView,
+)
 
 app_name = 'produccion_api'
 
 urlpatterns = [
     path('productos/', ProductListAPIView.as_view(), name='lista_productos'),
     path('registrar-venta/', CrearVentaAPIView.as_view(), name='registrar_venta'),
+    path('ventas/lote/', VentasEnLoteAPIView.as_view(), name='ventas_lote'),
     path('store/products/', StoreProductListAPIView.as_view(), name='store_products'),
     path('store/toggle-visibility/', ToggleTiendaVisibleView.as_view(), name='toggle_store_visibility'),
+    path('productos/<int:producto_id>/imagenes/subida/', SubidaImagenesAPIView.as_view(), name='subida_imagenes'),
+    path('productos/<int:producto_id>/imagenes/confirmar/', ConfirmarImagenesAPIView.as_view(), name='confirmar_imagenes'),
 ]
\ No newline at end of file
@@ -5,8 +5,18 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics
+from rest_framework.parsers import JSONParser
+from rest_framework.pagination import CursorPagination
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.shortcuts import get_object_or_404
 from .models import Producto
-from .serializers import ProductoSerializer
+from .parsers import NDJSONParser
+from .carga_imagenes import LimiteImagenesError, SubidaDirectaNoDisponibleError, confirmar_subidas, politicas_subida
+from .cache_tienda import version_tienda, clave_pagina, etag_pagina, TTL_PAGINAS
+from .servicios import registrar_ventas_en_lote
+from .serializers import ProductoImagenSerializer, ProductoSerializer, StoreProductoSerializer
 
 
 class ProductListAPIView(generics.ListAPIView):
@@ -26,7 +36,7 @@ class ProductListAPIView(generics.ListAPIView):
         """
         user = self.request.user
         if hasattr(user, 'mipyme') and user.mipyme:
-            return Producto.objects.filter(mipyme=user.mipyme).select_related('mipyme')
+            return ProductoSerializer.optimizar_queryset(Producto.objects.filter(mipyme=user.mipyme))
         return Producto.objects.none()
 from .serializers import VentaSerializer
 
@@ -45,19 +55,91 @@ class CrearVentaAPIView(generics.CreateAPIView):
         # El serializer necesita acceso al 'request' para obtener el usuario.
         serializer.save()
 
+class VentasEnLoteAPIView(APIView):
+    """
+    Carga masiva de ventas para puntos de venta que acumulan ventas sin conexión.
+
+    Acepta JSON (una lista de ventas o {"ventas": [...]}) o NDJSON (una venta por línea).
+    Cada venta: {"clave_idempotencia": "...", "items": [{"producto": id, "cantidad": n, "precio_unitario": "..."}]}.
+    Responde con un resultado por venta: creada, duplicada (la clave ya se había
+    registrado, reintentar es seguro) o rechazada con el motivo.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+    max_ventas_por_lote = 5000
+
+    def post(self, request, *args, **kwargs):
+        mipyme = getattr(request.user, 'mipyme', None)
+        if not mipyme:
+            return Response({'error': 'El usuario no tiene una Mipyme asociada.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ventas = request.data.get('ventas') if isinstance(request.data, dict) else request.data
+        if not isinstance(ventas, list):
+            return Response({'error': 'Se esperaba una lista de ventas.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ventas) > self.max_ventas_por_lote:
+            return Response(
+                {'error': f'Un lote admite como máximo {self.max_ventas_por_lote} ventas.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        resultados = registrar_ventas_en_lote(mipyme, ventas)
+        resumen = {'creadas': 0, 'duplicadas': 0, 'rechazadas': 0}
+        for resultado in resultados:
+            resumen[resultado['estado'] + 's'] += 1
+        return Response({**resumen, 'resultados': resultados}, status=status.HTTP_200_OK)
+
+
+class StoreCursorPagination(CursorPagination):
+    """
+    Paginación por cursor del catálogo: el costo de cada página no depende
+    de cuántos productos haya antes de ella.
+    """
+    ordering = 'nombre'
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 class StoreProductListAPIView(generics.ListAPIView):
     """
     API endpoint that lists all products from Mipymes that have enabled
     their store visibility (tienda_visible=True).
+    Pages are cached until the catalog changes and support ETag/Last-Modified revalidation.
     """
-    serializer_class = ProductoSerializer
+    serializer_class = StoreProductoSerializer
+    pagination_class = StoreCursorPagination
     permission_classes = [] # Public API for the store (or use specific key later)
     authentication_classes = []
+    filter_backends = []
 
     def get_queryset(self):
         # Filter products where the related Mipyme has tienda_visible=True AND the product is marked as available
         # AND the product has an image
-        return Producto.objects.filter(mipyme__tienda_visible=True, disponible_en_api=True).exclude(imagen='').exclude(imagen__isnull=True).order_by('nombre')
+        queryset = Producto.objects.filter(mipyme__tienda_visible=True, disponible_en_api=True).exclude(imagen='').exclude(imagen__isnull=True)
+        return StoreProductoSerializer.optimizar_queryset(queryset)
+
+    def list(self, request, *args, **kwargs):
+        version, modificado = version_tienda()
+        url = request.build_absolute_uri()
+        etag = etag_pagina(version, url)
+
+        # Revalidación: si el cliente ya tiene esta versión no se toca la base de datos
+        no_modificado = get_conditional_response(request, etag=etag, last_modified=modificado)
+        if no_modificado is not None:
+            return no_modificado
+
+        clave = clave_pagina(version, url)
+        datos = cache.get(clave)
+        if datos is None:
+            datos = super().list(request, *args, **kwargs).data
+            cache.set(clave, datos, TTL_PAGINAS)
+
+        response = Response(datos)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modificado)
+        response['Cache-Control'] = 'public, max-age=60'
+        return response
 
 class ToggleTiendaVisibleView(APIView):
     """
@@ -84,3 +166,57 @@ class ToggleTiendaVisibleView(APIView):
             
         except AttributeError:
             return Response({"error": "User does not have a Mipyme associated"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ImagenesProductoAPIViewMixin:
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [SessionAuthentication, TokenAuthentication]
+    parser_classes = [JSONParser]
+
+    def get_producto(self, producto_id):
+        mipyme = getattr(self.request.user, 'mipyme', None)
+        return get_object_or_404(Producto, pk=producto_id, mipyme=mipyme)
+
+
+class SubidaImagenesAPIView(ImagenesProductoAPIViewMixin, APIView):
+    """
+    Formularios de subida directa a MinIO (presigned POST) para imágenes adicionales.
+
+    Recibe {"tipos": ["image/jpeg", ...]} y devuelve uno por imagen, hasta completar
+    el máximo del producto. El navegador sube cada archivo a `url` con `campos` y
+    después confirma los `nombre` en ConfirmarImagenesAPIView.
+    """
+    def post(self, request, producto_id):
+        producto = self.get_producto(producto_id)
+        tipos = request.data.get('tipos')
+        if not isinstance(tipos, list) or not tipos:
+            return Response({'error': 'Envía la lista "tipos" con el tipo de cada imagen.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            politicas = politicas_subida(producto, tipos)
+        except LimiteImagenesError as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except SubidaDirectaNoDisponibleError as e:
+            return Response({'error': str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        return Response({'subidas': politicas, 'rechazadas': len(tipos) - len(politicas)})
+
+
+class ConfirmarImagenesAPIView(ImagenesProductoAPIViewMixin, APIView):
+    """
+    Registra las imágenes ya subidas a MinIO. Recibe {"nombres": [...]}; las que
+    superan el máximo del producto se rechazan y se borran del almacenamiento.
+    """
+    def post(self, request, producto_id):
+        producto = self.get_producto(producto_id)
+        nombres = request.data.get('nombres')
+        if not isinstance(nombres, list) or not all(isinstance(nombre, str) for nombre in nombres):
+            return Response({'error': 'Envía la lista "nombres" de las imágenes subidas.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            imagenes, rechazadas = confirmar_subidas(producto, nombres)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {'imagenes': ProductoImagenSerializer(imagenes, many=True).data, 'rechazadas': rechazadas},
+            status=status.HTTP_201_CREATED,
+        )
@@ -0,0 +1,58 @@
+# produccion/cache_tienda.py
+"""
+Caché del catálogo público de la tienda.
+
+Las páginas del catálogo se guardan en la caché de Django bajo una versión global.
+Cualquier cambio que afecte lo que muestra la tienda (productos, imágenes,
+visibilidad de una Mipyme, precios o stock) llama a invalidar_tienda(), que cambia
+la versión: las páginas anteriores dejan de usarse sin tener que borrarlas una a una.
+La misma versión sirve para generar el ETag y el Last-Modified de las respuestas.
+
+La versión vive en la caché 'compartida' (ver CACHES en settings): los cambios que
+hace el worker, un comando u otro proceso web llegan a todos los procesos, que si
+no seguirían respondiendo 304 con datos viejos. Las páginas, que dependen de la
+versión, se guardan en la caché del proceso.
+"""
+import hashlib
+import time
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+
+CLAVE_VERSION = 'tienda:version'
+TTL_PAGINAS = 300  # segundos
+
+
+def _versiones():
+    return caches['compartida']
+
+
+def version_tienda():
+    """Devuelve (version, timestamp_de_modificacion) del catálogo de la tienda."""
+    versiones = _versiones()
+    actual = versiones.get(CLAVE_VERSION)
+    if actual is None:
+        actual = (uuid.uuid4().hex, int(time.time()))
+        # add() no pisa la versión si otro proceso la creó entretanto
+        if not versiones.add(CLAVE_VERSION, actual, None):
+            actual = versiones.get(CLAVE_VERSION) or actual
+    return actual
+
+
+def _invalidar():
+    _versiones().set(CLAVE_VERSION, (uuid.uuid4().hex, int(time.time())), None)
+
+
+def invalidar_tienda():
+    """Invalida todas las páginas del catálogo cuando se confirma la transacción actual."""
+    transaction.on_commit(_invalidar)
+
+
+def clave_pagina(version, url):
+    resumen = hashlib.md5(url.encode('utf-8')).hexdigest()
+    return f'tienda:pagina:{version}:{resumen}'
+
+
+def etag_pagina(version, url):
+    return '"%s"' % hashlib.md5(f'{version}:{url}'.encode('utf-8')).hexdigest()
@@ -0,0 +1,229 @@
+# produccion/carga_imagenes.py
+"""
+Carga en bloque de las imágenes adicionales de un producto.
+
+Los archivos se suben al storage en paralelo con un pool de hilos acotado y
+compartido por el proceso (las subidas a MinIO esperan red, no CPU); los hilos
+solo usan el storage, las consultas se hacen en el hilo de la petición. Después,
+en una transacción que bloquea la fila del producto, se vuelve a contar cuántas
+imágenes tiene y se insertan con un único bulk_create solo las que caben en el
+límite de MAX_IMAGENES; los archivos que no entraron se borran. Las variantes
+redimensionadas (produccion/imagenes.py) no se generan en la petición: las imágenes
+quedan con variantes_pendientes y el worker (comando procesar_tareas) las genera con
+generar_variantes_pendientes(). Mientras tanto la tienda sirve los originales.
+
+Para que los bytes no pasen por Django, politicas_subida() entrega formularios
+de subida directa a MinIO (presigned POST) y confirmar_subidas() registra los
+objetos ya subidos con las mismas reglas.
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Max
+from minio.datatypes import PostPolicy
+
+from .cache_tienda import invalidar_tienda
+from .imagenes import variantes_o_solo_origen
+from .models import Producto, ProductoImagen
+
+logger = logging.getLogger(__name__)
+
+MAX_IMAGENES = 20
+CONFIG_POR_DEFECTO = {
+    'hilos': 6,
+    # Tamaño máximo de cada imagen subida directamente a MinIO
+    'max_mb': 10,
+    # Vigencia de los formularios de subida directa
+    'vigencia_segundos': 600,
+}
+EXTENSIONES = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp', 'image/gif': 'gif'}
+
+
+class LimiteImagenesError(Exception):
+    """El producto ya tiene el máximo de imágenes adicionales."""
+
+
+class SubidaDirectaNoDisponibleError(Exception):
+    """El storage configurado no admite subidas directas (presigned POST)."""
+
+
+def configuracion():
+    return {**CONFIG_POR_DEFECTO, **getattr(settings, 'PRODUCCION_CARGA_IMAGENES', {})}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=configuracion()['hilos'], thread_name_prefix='carga-imagenes')
+        return _pool
+
+
+def _estado_imagenes(producto_id):
+    """(cantidad, último orden) de las imágenes adicionales del producto."""
+    estado = ProductoImagen.objects.filter(producto_id=producto_id).aggregate(cantidad=Count('id'), orden=Max('orden'))
+    return estado['cantidad'], estado['orden'] if estado['orden'] is not None else -1
+
+
+def cupo_disponible(producto):
+    return max(MAX_IMAGENES - _estado_imagenes(producto.pk)[0], 0)
+
+
+def _borrar(nombres):
+    for nombre in nombres:
+        try:
+            default_storage.delete(nombre)
+        except Exception as e:
+            logger.warning(f"No se pudo borrar la imagen {nombre}: {e}")
+
+
+def generar_variantes_pendientes(limite=MAX_IMAGENES):
+    """Genera las variantes de hasta `limite` imágenes cargadas en bloque. Devuelve cuántas procesó."""
+    procesadas = 0
+    while procesadas < limite:
+        with transaction.atomic():
+            # Como las exportaciones: otro worker salta las imágenes que ya se están procesando
+            imagen = (
+                ProductoImagen.objects.select_for_update(skip_locked=True)
+                .filter(variantes_pendientes=True)
+                .order_by('id')
+                .first()
+            )
+            if imagen is None:
+                break
+            # update() no envía post_save: la señal de variantes no vuelve a generarlas
+            ProductoImagen.objects.filter(pk=imagen.pk).update(
+                variantes_imagen={'imagen': variantes_o_solo_origen(imagen.imagen)}, variantes_pendientes=False,
+            )
+        procesadas += 1
+    if procesadas:
+        # La tienda cacheada tenía las URLs de los originales
+        invalidar_tienda()
+    return procesadas
+
+
+def registrar_imagenes(producto, nombres):
+    """
+    Inserta ProductoImagen para archivos ya guardados en el storage, respetando el
+    límite de forma atómica. Devuelve (imágenes creadas, nombres rechazados); los
+    archivos rechazados se borran del storage.
+    """
+    with transaction.atomic():
+        # El bloqueo serializa las cargas simultáneas al mismo producto
+        Producto.objects.select_for_update().only('pk').get(pk=producto.pk)
+        cantidad, ultimo_orden = _estado_imagenes(producto.pk)
+        cupo = max(MAX_IMAGENES - cantidad, 0)
+        aceptados, rechazados = nombres[:cupo], nombres[cupo:]
+        # bulk_create no envía post_save: las variantes quedan para el worker
+        imagenes = ProductoImagen.objects.bulk_create([
+            ProductoImagen(producto=producto, imagen=nombre, orden=ultimo_orden + 1 + i, variantes_pendientes=True)
+            for i, nombre in enumerate(aceptados)
+        ])
+        if imagenes:
+            invalidar_tienda()
+    if rechazados:
+        _borrar(rechazados)
+    return imagenes, rechazados
+
+
+def agregar_imagenes(producto, archivos):
+    """
+    Sube `archivos` (UploadedFile) en paralelo y los registra como imágenes
+    adicionales de `producto`. Devuelve (imágenes creadas, cantidad rechazada).
+    """
+    archivos = list(archivos)
+    cupo = cupo_disponible(producto)
+    if archivos and not cupo:
+        raise LimiteImagenesError(f"El producto ya tiene {MAX_IMAGENES} imágenes.")
+    # No se suben archivos que ya se sabe que no caben
+    excedentes = len(archivos[cupo:])
+    archivos = archivos[:cupo]
+
+    campo = ProductoImagen._meta.get_field('imagen')
+
+    def subir(archivo):
+        return default_storage.save(campo.generate_filename(None, archivo.name), archivo)
+
+    futuros = [pool().submit(subir, archivo) for archivo in archivos]
+    nombres, error = [], None
+    for futuro in futuros:
+        try:
+            nombres.append(futuro.result())
+        except Exception as e:
+            error = error or e
+    if error:
+        _borrar(nombres)
+        raise error
+
+    try:
+        imagenes, rechazados = registrar_imagenes(producto, nombres)
+    except Exception:
+        _borrar(nombres)
+        raise
+    return imagenes, excedentes + len(rechazados)
+
+
+# --- SUBIDA DIRECTA A MINIO ---
+
+def _prefijo(producto):
+    return f'productos/adicionales/{producto.pk}/'
+
+
+def politicas_subida(producto, tipos):
+    """
+    Un formulario de presigned POST por cada tipo de contenido de `tipos`, hasta el
+    cupo del producto. Cada uno es {'url', 'campos', 'nombre'}: el navegador envía
+    `campos` más el archivo (campo 'file') a `url`, y luego confirma los `nombre`.
+    """
+    cliente = getattr(default_storage, 'client', None)
+    if cliente is None:
+        raise SubidaDirectaNoDisponibleError("El almacenamiento configurado no admite subidas directas.")
+    cupo = cupo_disponible(producto)
+    if tipos and not cupo:
+        raise LimiteImagenesError(f"El producto ya tiene {MAX_IMAGENES} imágenes.")
+    config = configuracion()
+    vence = datetime.now(timezone.utc) + timedelta(seconds=config['vigencia_segundos'])
+    politicas = []
+    for tipo in tipos[:cupo]:
+        if tipo not in EXTENSIONES:
+            raise ValueError(f"Tipo de imagen no permitido: {tipo}")
+        nombre = f'{_prefijo(producto)}{uuid.uuid4().hex}.{EXTENSIONES[tipo]}'
+        politica = PostPolicy(default_storage.bucket_name, vence)
+        politica.add_equals_condition('key', nombre)
+        politica.add_equals_condition('Content-Type', tipo)
+        politica.add_content_length_range_condition(1, config['max_mb'] * 1024 * 1024)
+        campos = cliente.presigned_post_policy(politica)
+        politicas.append({
+            'url': f"{default_storage.endpoint_url}/{default_storage.bucket_name}/",
+            'campos': {**campos, 'key': nombre, 'Content-Type': tipo},
+            'nombre': nombre,
+        })
+    return politicas
+
+
+def confirmar_subidas(producto, nombres):
+    """
+    Registra como imágenes del producto los objetos subidos con politicas_subida().
+    Solo se aceptan nombres del prefijo del producto que existan en el storage.
+    """
+    prefijo = _prefijo(producto)
+    nombres = list(dict.fromkeys(nombres))
+    if any(not nombre.startswith(prefijo) or '..' in nombre for nombre in nombres):
+        raise ValueError("Las imágenes no corresponden a este producto.")
+    ya_registradas = set(ProductoImagen.objects.filter(producto=producto, imagen__in=nombres).values_list('imagen', flat=True))
+    nombres = [nombre for nombre in nombres if nombre not in ya_registradas]
+    existentes = list(pool().map(default_storage.exists, nombres))
+    faltantes = [nombre for nombre, existe in zip(nombres, existentes) if not existe]
+    if faltantes:
+        raise ValueError(f"No se encontraron las imágenes subidas: {', '.join(faltantes)}")
+    return registrar_imagenes(producto, nombres)
@@ -0,0 +1,152 @@
+# produccion/costos.py
+"""
+Motor de recálculo de costos y precios de productos.
+
+En lugar de guardar los productos uno por uno (lo que recorre la receta de cada
+producto con varias consultas), los costos de un conjunto de productos se obtienen
+con dos consultas agregadas y se escriben de vuelta con un único bulk_update.
+
+Las señales no recalculan en el momento: marcan los productos afectados con
+programar_recalculo() y el recálculo se ejecuta una sola vez al confirmar la
+transacción, sin importar cuántas filas de la receta se hayan tocado.
+"""
+import decimal
+import threading
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum
+
+from .models import Producto, Formulacion, PasoDeProduccion
+from .cache_tienda import invalidar_tienda
+from .version_datos import invalidar_mipymes
+
+CAMPOS_COSTO = ['costo_insumos_cache', 'costo_procesos_cache', 'costo_produccion_cache', 'precio_venta']
+
+_CENTAVOS = decimal.Decimal('0.01')
+_DECIMAL_AGREGADO = DecimalField(max_digits=20, decimal_places=6)
+
+
+def _producto(expresion):
+    return ExpressionWrapper(expresion, output_field=_DECIMAL_AGREGADO)
+
+
+# Las divisiones entre 100 y 60 se hacen en Python: en SQL solo se multiplica y se suma,
+# así el resultado no depende de cómo cada motor divide enteros.
+def _costos_insumos(ids):
+    """cantidad * costo_unitario * (1 + desperdicio / 100), igual que Producto.costo_insumos."""
+    filas = (
+        Formulacion.objects.filter(producto__in=ids).order_by().values('producto_id')
+        .annotate(
+            base=Sum(_producto(F('cantidad') * F('insumo__costo_unitario'))),
+            desperdicio=Sum(_producto(F('cantidad') * F('insumo__costo_unitario') * F('porcentaje_desperdicio'))),
+        )
+    )
+    return {
+        fila['producto_id']: decimal.Decimal(fila['base'] or 0) + decimal.Decimal(fila['desperdicio'] or 0) / 100
+        for fila in filas
+    }
+
+
+def _costos_procesos(ids):
+    """(minutos / 60) * costo_por_hora, igual que Producto.costo_procesos."""
+    filas = (
+        PasoDeProduccion.objects.filter(producto__in=ids).order_by().values('producto_id')
+        .annotate(total=Sum(_producto(F('tiempo_en_minutos') * F('proceso__costo_por_hora'))))
+    )
+    return {fila['producto_id']: decimal.Decimal(fila['total'] or 0) / 60 for fila in filas}
+
+
+def _redondear(valor):
+    # Mismo redondeo que aplica Django al guardar un DecimalField desde Producto.save()
+    return decimal.Decimal(valor or 0).quantize(_CENTAVOS)
+
+
+def recalcular_costos(productos):
+    """
+    Recalcula los costos materializados y el precio de venta de un QuerySet de productos.
+    Solo escribe las filas cuyo valor cambió. Devuelve la cantidad de productos actualizados.
+    """
+    ids = productos.values('pk')
+    costos_insumos = _costos_insumos(ids)
+    costos_procesos = _costos_procesos(ids)
+
+    actualizados = []
+    for producto in productos.order_by().only('id', 'mipyme_id', 'porcentaje_ganancia', *CAMPOS_COSTO).iterator(chunk_size=1000):
+        costo_insumos = costos_insumos.get(producto.id, decimal.Decimal(0))
+        costo_procesos = costos_procesos.get(producto.id, decimal.Decimal(0))
+        costo_produccion = costo_insumos + costo_procesos
+        nuevos = {
+            'costo_insumos_cache': _redondear(costo_insumos),
+            'costo_procesos_cache': _redondear(costo_procesos),
+            'costo_produccion_cache': _redondear(costo_produccion),
+            'precio_venta': _redondear(Producto.calcular_precio_venta(costo_produccion, producto.porcentaje_ganancia)),
+        }
+        if any(getattr(producto, campo) != valor for campo, valor in nuevos.items()):
+            for campo, valor in nuevos.items():
+                setattr(producto, campo, valor)
+            actualizados.append(producto)
+
+    if actualizados:
+        Producto.objects.bulk_update(actualizados, CAMPOS_COSTO, batch_size=500)
+        # bulk_update no emite señales: los precios nuevos deben verse en la tienda
+        # y en los cachés de cada Mipyme
+        invalidar_tienda()
+        invalidar_mipymes({producto.mipyme_id for producto in actualizados})
+    return len(actualizados)
+
+
+# --- RECÁLCULO DIFERIDO ---
+# Los productos pendientes se acumulan por hilo (cada hilo tiene su propia conexión
+# y su propia transacción) y se recalculan juntos al hacer commit.
+_pendientes = threading.local()
+
+
+def _estado_pendiente():
+    if not hasattr(_pendientes, 'productos'):
+        _pendientes.productos = set()
+        _pendientes.mipymes = set()
+        _pendientes.insumos = set()
+        _pendientes.procesos = set()
+    return _pendientes
+
+
+def _hay_pendientes(estado):
+    return bool(estado.productos or estado.mipymes or estado.insumos or estado.procesos)
+
+
+def programar_recalculo(productos=(), mipymes=(), insumos=(), procesos=()):
+    """
+    Marca productos para recalcular, por id de producto, de Mipyme (todos sus productos),
+    de insumo o de proceso (los productos que los usan en su receta).
+    Dentro de una transacción el recálculo se hace al confirmarla; fuera de ella
+    on_commit lo ejecuta de inmediato.
+    """
+    estado = _estado_pendiente()
+    estado.productos.update(productos)
+    estado.mipymes.update(mipymes)
+    estado.insumos.update(insumos)
+    estado.procesos.update(procesos)
+    if not _hay_pendientes(estado):
+        return
+    # Cada marca agenda su callback en el savepoint en que ocurrió: si ese savepoint se
+    # revierte, Django descarta solo los suyos. El primer callback que se ejecuta vacía
+    # los pendientes y los demás no encuentran nada que recalcular.
+    transaction.on_commit(ejecutar_recalculos_pendientes)
+
+
+def ejecutar_recalculos_pendientes():
+    """Recalcula de una sola vez todos los productos marcados en este hilo."""
+    estado = _estado_pendiente()
+    if not _hay_pendientes(estado):
+        return 0
+    productos, mipymes, insumos, procesos = estado.productos, estado.mipymes, estado.insumos, estado.procesos
+    estado.productos, estado.mipymes, estado.insumos, estado.procesos = set(), set(), set(), set()
+
+    filtro = Q(pk__in=productos) | Q(mipyme_id__in=mipymes)
+    # Los productos que dependen de un insumo o proceso se resuelven con los índices
+    # inversos de Formulacion y PasoDeProduccion, sin recorrer el catálogo
+    if insumos:
+        filtro |= Q(pk__in=Formulacion.objects.filter(insumo_id__in=insumos).values('producto_id'))
+    if procesos:
+        filtro |= Q(pk__in=PasoDeProduccion.objects.filter(proceso_id__in=procesos).values('producto_id'))
+    return recalcular_costos(Producto.objects.filter(filtro))
@@ -0,0 +1,258 @@
+# produccion/excel.py
+"""
+Exportación de productos a Excel en memoria constante.
+
+Se usa el modo write_only de openpyxl: cada fila se escribe directo al archivo
+temporal de su hoja en lugar de mantener el libro completo en memoria. Los
+productos se recorren una sola vez, en bloques, llenando las cuatro hojas a la vez.
+
+Las exportaciones en segundo plano las genera el worker, no la web, y sus
+archivos se borran del storage al vencer (limpiar_exportaciones_vencidas).
+"""
+import logging
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from openpyxl import Workbook
+
+from cuentas.models import Mipyme
+from .models import ExportacionExcel, Producto
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+TAMANO_BLOQUE = 500
+CONFIG_POR_DEFECTO = {
+    # Horas que se conserva en el storage una exportación generada
+    'vigencia_horas': 24,
+    # Segundos tras los que una exportación en curso se da por abandonada y se reintenta
+    'plazo_proceso': 1800,
+}
+
+HEADERS_PRODUCTOS = [
+    'Nombre', 'Descripción', 'Precio Venta', 'Porcentaje Ganancia', 'Stock Actual',
+    'Costo Producción', 'Costo Insumos', 'Costo Procesos', 'Margen Ganancia',
+    'Peso (kg)', 'Largo (cm)', 'Ancho (cm)', 'Alto (cm)', 'Presentación'
+]
+HEADERS_FORMULACION = ['Producto', 'Insumo', 'Cantidad', 'Unidad', 'Costo Unitario', 'Porcentaje Desperdicio']
+HEADERS_PROCESOS = ['Producto', 'Proceso', 'Tiempo (minutos)', 'Costo por Hora']
+HEADERS_ESTANDARES = [
+    'Producto', 'Peso Mín', 'Peso Máx', 'Largo Mín', 'Largo Máx',
+    'Ancho Mín', 'Ancho Máx', 'Alto Mín', 'Alto Máx', 'Presentación Estándar'
+]
+
+
+def _numero(valor):
+    return float(valor) if valor else ''
+
+
+def nombre_archivo(mipyme):
+    return f'productos_{mipyme.nombre.replace(" ", "_")}.xlsx'
+
+
+def escribir_excel_productos(mipyme, destino):
+    """Escribe el libro de productos de la Mipyme en `destino` (ruta o archivo binario)."""
+    # Los costos vienen de las columnas materializadas y el margen se calcula en SQL
+    productos = (
+        Producto.objects.filter(mipyme=mipyme)
+        .select_related('estándares')
+        .prefetch_related('formulacion__insumo__unidad', 'pasodeproduccion_set__proceso')
+        .annotate(margen=F('precio_venta') - F('costo_produccion_cache'))
+        .order_by('nombre')
+    )
+
+    wb = Workbook(write_only=True)
+    ws_productos = wb.create_sheet("Productos")
+    ws_formulacion = wb.create_sheet("Formulación")
+    ws_procesos = wb.create_sheet("Procesos")
+    ws_estandares = wb.create_sheet("Estándares")
+    ws_productos.append(HEADERS_PRODUCTOS)
+    ws_formulacion.append(HEADERS_FORMULACION)
+    ws_procesos.append(HEADERS_PROCESOS)
+    ws_estandares.append(HEADERS_ESTANDARES)
+
+    for producto in productos.iterator(chunk_size=TAMANO_BLOQUE):
+        ws_productos.append([
+            producto.nombre,
+            producto.descripcion or '',
+            float(producto.precio_venta) if producto.precio_venta else 0,
+            float(producto.porcentaje_ganancia) if producto.porcentaje_ganancia else 0,
+            producto.stock_actual,
+            float(producto.costo_produccion_cache),
+            float(producto.costo_insumos_cache),
+            float(producto.costo_procesos_cache),
+            float(producto.margen or 0),
+            _numero(producto.peso),
+            _numero(producto.tamano_largo),
+            _numero(producto.tamano_ancho),
+            _numero(producto.tamano_alto),
+            producto.presentacion or ''
+        ])
+
+        for item in producto.formulacion.all():
+            ws_formulacion.append([
+                producto.nombre,
+                item.insumo.nombre,
+                float(item.cantidad),
+                item.insumo.unidad.abreviatura,
+                float(item.insumo.costo_unitario),
+                float(item.porcentaje_desperdicio)
+            ])
+
+        for paso in producto.pasodeproduccion_set.all():
+            ws_procesos.append([
+                producto.nombre,
+                paso.proceso.nombre,
+                paso.tiempo_en_minutos,
+                float(paso.proceso.costo_por_hora)
+            ])
+
+        est = getattr(producto, 'estándares', None)
+        if est:
+            ws_estandares.append([
+                producto.nombre,
+                _numero(est.peso_min),
+                _numero(est.peso_max),
+                _numero(est.tamano_largo_min),
+                _numero(est.tamano_largo_max),
+                _numero(est.tamano_ancho_min),
+                _numero(est.tamano_ancho_max),
+                _numero(est.tamano_alto_min),
+                _numero(est.tamano_alto_max),
+                est.presentacion_estandar or ''
+            ])
+
+    wb.save(destino)
+
+
+def generar_excel_temporal(mipyme):
+    """Genera el libro en un archivo temporal (se borra al cerrarlo) listo para leer desde el inicio."""
+    archivo = tempfile.TemporaryFile(suffix='.xlsx')
+    escribir_excel_productos(mipyme, archivo)
+    archivo.seek(0)
+    return archivo
+
+
+def guardar_excel_en_storage(mipyme):
+    """Genera el libro, lo sube al storage de medios y devuelve (ruta, url de descarga)."""
+    marca = timezone.now().strftime('%Y%m%d%H%M%S')
+    ruta = f'exportaciones/{mipyme.pk}/productos_{marca}.xlsx'
+    with generar_excel_temporal(mipyme) as archivo:
+        ruta = default_storage.save(ruta, File(archivo, name=nombre_archivo(mipyme)))
+    return ruta, default_storage.url(ruta)
+
+
+# --- EXPORTACIÓN EN SEGUNDO PLANO ---
+# La web solo crea una ExportacionExcel pendiente; el worker (comando procesar_tareas)
+# la toma con SELECT ... FOR UPDATE SKIP LOCKED, genera el archivo y lo deja en el
+# storage hasta que vence. Cada Mipyme conserva solo su última exportación lista.
+
+def configuracion():
+    return {**CONFIG_POR_DEFECTO, **getattr(settings, 'PRODUCCION_EXPORTACIONES', {})}
+
+
+def _estado_publico(exportacion):
+    if exportacion.estado == ExportacionExcel.Estados.LISTA:
+        if exportacion.vence and exportacion.vence <= timezone.now():
+            return None
+        return {'estado': 'lista', 'url': default_storage.url(exportacion.ruta)}
+    if exportacion.estado == ExportacionExcel.Estados.ERROR:
+        return {'estado': 'error'}
+    return {'estado': 'en_proceso'}
+
+
+def estado_exportacion(mipyme_id):
+    """Estado de la última exportación de la Mipyme, o None si no tiene una vigente."""
+    exportacion = ExportacionExcel.objects.filter(mipyme_id=mipyme_id).order_by('-creado', '-id').first()
+    return _estado_publico(exportacion) if exportacion else None
+
+
+def iniciar_exportacion(mipyme):
+    """Encola la exportación si no hay otra pendiente o en curso para la Mipyme. Devuelve el estado."""
+    with transaction.atomic():
+        # El bloqueo evita que dos peticiones simultáneas encolen dos exportaciones
+        Mipyme.objects.select_for_update().only('id').get(pk=mipyme.pk)
+        en_curso = ExportacionExcel.objects.filter(
+            mipyme=mipyme, estado__in=[ExportacionExcel.Estados.PENDIENTE, ExportacionExcel.Estados.EN_PROCESO]
+        ).exists()
+        if not en_curso:
+            ExportacionExcel.objects.create(mipyme=mipyme)
+    return {'estado': 'en_proceso'}
+
+
+def _tomar_exportacion(config):
+    """Marca como 'en_proceso' la exportación pendiente más antigua y la devuelve."""
+    ahora = timezone.now()
+    abandonada = ahora - timedelta(seconds=config['plazo_proceso'])
+    with transaction.atomic():
+        exportacion = (
+            ExportacionExcel.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('mipyme')
+            .filter(
+                Q(estado=ExportacionExcel.Estados.PENDIENTE)
+                # La de un worker que murió a mitad de camino vuelve a la cola
+                | Q(estado=ExportacionExcel.Estados.EN_PROCESO, iniciado__lt=abandonada)
+            )
+            .order_by('creado', 'id')
+            .first()
+        )
+        if exportacion is not None:
+            exportacion.estado = ExportacionExcel.Estados.EN_PROCESO
+            exportacion.iniciado = ahora
+            exportacion.save(update_fields=['estado', 'iniciado'])
+    return exportacion
+
+
+def procesar_exportaciones(limite=1):
+    """Genera hasta `limite` exportaciones pendientes. Devuelve cuántas procesó."""
+    config = configuracion()
+    procesadas = 0
+    while procesadas < limite:
+        exportacion = _tomar_exportacion(config)
+        if exportacion is None:
+            break
+        procesadas += 1
+        try:
+            exportacion.ruta, _ = guardar_excel_en_storage(exportacion.mipyme)
+        except Exception as e:
+            logger.exception("Error al exportar productos a Excel para la Mipyme %s", exportacion.mipyme_id)
+            exportacion.estado = ExportacionExcel.Estados.ERROR
+            exportacion.ultimo_error = f"{type(e).__name__}: {e}"[:2000]
+            exportacion.vence = timezone.now() + timedelta(hours=config['vigencia_horas'])
+            exportacion.save(update_fields=['estado', 'ultimo_error', 'vence'])
+            continue
+        exportacion.estado = ExportacionExcel.Estados.LISTA
+        exportacion.vence = timezone.now() + timedelta(hours=config['vigencia_horas'])
+        exportacion.save(update_fields=['ruta', 'estado', 'vence'])
+        # La nueva reemplaza a las anteriores de la Mipyme
+        _eliminar(ExportacionExcel.objects.filter(
+            mipyme_id=exportacion.mipyme_id, creado__lte=exportacion.creado,
+            estado__in=[ExportacionExcel.Estados.LISTA, ExportacionExcel.Estados.ERROR],
+        ).exclude(pk=exportacion.pk))
+    return procesadas
+
+
+def _eliminar(exportaciones):
+    borradas = 0
+    for exportacion in exportaciones:
+        if exportacion.ruta:
+            try:
+                default_storage.delete(exportacion.ruta)
+            except Exception as e:
+                # Se conserva la fila para reintentar en la próxima limpieza
+                logger.warning(f"No se pudo borrar la exportación {exportacion.ruta}: {e}")
+                continue
+        exportacion.delete()
+        borradas += 1
+    return borradas
+
+
+def limpiar_exportaciones_vencidas():
+    """Borra del storage y de la base las exportaciones vencidas. Devuelve cuántas borró."""
+    return _eliminar(ExportacionExcel.objects.filter(vence__lte=timezone.now()))
@@ -0,0 +1,145 @@
+# produccion/exportaciones.py
+"""
+Exportaciones de datos en CSV y NDJSON para contabilidad y BI.
+
+Las filas se leen con cursores del lado del servidor (.iterator(chunk_size=...))
+como tuplas de values_list y se convierten en texto a medida que se envían, así la
+memoria no crece con el tamaño de la tabla.
+"""
+import csv
+import datetime
+import decimal
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Insumo, Producto, ResumenVentasMensual, VentaItem
+
+TAMANO_BLOQUE = 2000
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla."""
+    def write(self, valor):
+        return valor
+
+
+class FechaInvalidaError(ValueError):
+    """Un filtro de fecha no tiene el formato YYYY-MM-DD o no es una fecha que exista."""
+
+
+def leer_fecha(valor):
+    """Convierte 'YYYY-MM-DD' en date; None si viene vacío. Lanza FechaInvalidaError si no es válida."""
+    if not valor:
+        return None
+    try:
+        # parse_date devuelve None con otro formato y lanza ValueError con fechas como 2024-02-30
+        fecha = parse_date(valor)
+    except ValueError:
+        fecha = None
+    if fecha is None:
+        raise FechaInvalidaError(f"Fecha inválida: '{valor}'. Use el formato YYYY-MM-DD.")
+    return fecha
+
+
+def _rango_fechas(desde, hasta):
+    """Convierte 'YYYY-MM-DD' en un rango [inicio, fin) con la zona horaria del proyecto."""
+    filtros = {}
+    fecha_desde = leer_fecha(desde)
+    fecha_hasta = leer_fecha(hasta)
+    if fecha_desde:
+        filtros['venta__fecha__gte'] = timezone.make_aware(datetime.datetime.combine(fecha_desde, datetime.time.min))
+    if fecha_hasta:
+        fin = datetime.datetime.combine(fecha_hasta + datetime.timedelta(days=1), datetime.time.min)
+        filtros['venta__fecha__lt'] = timezone.make_aware(fin)
+    return filtros
+
+
+def filas_ventas(mipyme, desde=None, hasta=None):
+    """Una fila por item vendido, con los datos de su venta."""
+    columnas = ['venta_id', 'fecha', 'total_venta', 'producto_id', 'producto', 'cantidad', 'precio_unitario', 'subtotal']
+    filas = (
+        VentaItem.objects.filter(venta__mipyme=mipyme, **_rango_fechas(desde, hasta))
+        .order_by('venta__fecha', 'venta_id', 'id')
+        .values_list('venta_id', 'venta__fecha', 'venta__total', 'producto_id', 'producto__nombre',
+                     'cantidad', 'precio_unitario', 'subtotal')
+    )
+    return columnas, filas.iterator(chunk_size=TAMANO_BLOQUE)
+
+
+def filas_insumos(mipyme, desde=None, hasta=None):
+    """Inventario de insumos con su valorización (los insumos no tienen fecha: el rango se ignora)."""
+    columnas = ['insumo_id', 'nombre', 'unidad', 'costo_unitario', 'stock_actual']
+    filas = (
+        Insumo.objects.filter(mipyme=mipyme).order_by('id')
+        .values_list('id', 'nombre', 'unidad__abreviatura', 'costo_unitario', 'stock_actual')
+    )
+    return columnas, filas.iterator(chunk_size=TAMANO_BLOQUE)
+
+
+def filas_productos(mipyme, desde=None, hasta=None):
+    """Costeo de productos desde las columnas materializadas (sin fecha: el rango se ignora)."""
+    columnas = ['producto_id', 'nombre', 'costo_insumos', 'costo_procesos', 'costo_produccion',
+                'porcentaje_ganancia', 'precio_venta', 'stock_actual']
+    filas = (
+        Producto.objects.filter(mipyme=mipyme).order_by('id')
+        .values_list('id', 'nombre', 'costo_insumos_cache', 'costo_procesos_cache', 'costo_produccion_cache',
+                     'porcentaje_ganancia', 'precio_venta', 'stock_actual')
+    )
+    return columnas, filas.iterator(chunk_size=TAMANO_BLOQUE)
+
+
+def filas_resumen(mipyme, desde=None, hasta=None):
+    """Ventas mensuales por producto desde el resumen precalculado."""
+    columnas = ['mes', 'producto_id', 'producto', 'ingresos', 'unidades', 'costo']
+    filtros = {}
+    fecha_desde = leer_fecha(desde)
+    fecha_hasta = leer_fecha(hasta)
+    if fecha_desde:
+        filtros['mes__gte'] = fecha_desde.replace(day=1)
+    if fecha_hasta:
+        filtros['mes__lte'] = fecha_hasta
+    filas = (
+        ResumenVentasMensual.objects.filter(mipyme=mipyme, **filtros).order_by('mes', 'producto_id')
+        .values_list('mes', 'producto_id', 'producto__nombre', 'ingresos', 'unidades', 'costo')
+    )
+    return columnas, filas.iterator(chunk_size=TAMANO_BLOQUE)
+
+
+RECURSOS = {
+    'ventas': filas_ventas,
+    'resumen': filas_resumen,
+    'insumos': filas_insumos,
+    'productos': filas_productos,
+}
+
+
+def _valor_json(valor):
+    if isinstance(valor, decimal.Decimal):
+        return str(valor)
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return valor.isoformat()
+    return valor
+
+
+def generar_csv(columnas, filas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(columnas)
+    for fila in filas:
+        yield escritor.writerow([_valor_json(valor) for valor in fila])
+
+
+def generar_ndjson(columnas, filas):
+    for fila in filas:
+        yield json.dumps(dict(zip(columnas, map(_valor_json, fila))), ensure_ascii=False) + '\n'
+
+
+GENERADORES = {
+    'csv': generar_csv,
+    'ndjson': generar_ndjson,
+}
@@ -0,0 +1,95 @@
+# produccion/historial.py
+"""
+Paginación por cursor (keyset) del historial de ventas.
+
+En lugar de OFFSET, cada página continúa desde la última venta mostrada
+ordenando por (-fecha, id), así la página 1 y la página 500 cuestan lo mismo
+y usan el índice (mipyme, fecha) de Venta.
+"""
+import base64
+import binascii
+import datetime
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .exportaciones import leer_fecha
+from .models import Venta, VentaItem
+
+TAMANO_PAGINA = 50
+
+
+def codificar_cursor(venta):
+    valor = f"{venta.fecha.isoformat()}|{venta.id}"
+    return base64.urlsafe_b64encode(valor.encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, id) o None si el cursor no es válido."""
+    try:
+        fecha_texto, venta_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        fecha = parse_datetime(fecha_texto)
+        return (fecha, int(venta_id)) if fecha else None
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+
+
+def filtrar_ventas(mipyme, desde=None, hasta=None, producto=None):
+    """
+    Ventas de la Mipyme filtradas por rango de fechas (YYYY-MM-DD) y por producto vendido.
+    Lanza FechaInvalidaError si una de las fechas no es válida.
+    """
+    ventas = Venta.objects.filter(mipyme=mipyme)
+    fecha_desde = leer_fecha(desde)
+    fecha_hasta = leer_fecha(hasta)
+    # Límites como datetime (no fecha__date) para que la consulta use el índice (mipyme, fecha)
+    if fecha_desde:
+        ventas = ventas.filter(fecha__gte=timezone.make_aware(datetime.datetime.combine(fecha_desde, datetime.time.min)))
+    if fecha_hasta:
+        fin = datetime.datetime.combine(fecha_hasta + datetime.timedelta(days=1), datetime.time.min)
+        ventas = ventas.filter(fecha__lt=timezone.make_aware(fin))
+    if producto:
+        try:
+            producto_id = int(producto)
+        except (TypeError, ValueError):
+            return ventas.none()
+        ventas = ventas.filter(Exists(VentaItem.objects.filter(venta=OuterRef('pk'), producto_id=producto_id)))
+    return ventas
+
+
+def pagina_ventas(ventas, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Devuelve (ventas_de_la_pagina, cursor_siguiente). Los items y productos se cargan
+    solo para las ventas de la página. cursor_siguiente es None en la última página.
+    """
+    posicion = decodificar_cursor(cursor) if cursor else None
+    if posicion:
+        fecha, venta_id = posicion
+        ventas = ventas.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, id__gt=venta_id))
+
+    pagina = list(
+        ventas.order_by('-fecha', 'id').prefetch_related('items__producto')[:tamano + 1]
+    )
+    siguiente = None
+    if len(pagina) > tamano:
+        pagina = pagina[:tamano]
+        siguiente = codificar_cursor(pagina[-1])
+    return pagina, siguiente
+
+
+def venta_a_dict(venta):
+    return {
+        'id': venta.id,
+        'fecha': venta.fecha.isoformat(),
+        'total': str(venta.total),
+        'items': [
+            {
+                'producto': item.producto.nombre,
+                'cantidad': item.cantidad,
+                'precio_unitario': str(item.precio_unitario),
+                'subtotal': str(item.subtotal),
+            }
+            for item in venta.items.all()
+        ],
+    }
@@ -0,0 +1,153 @@
+# produccion/imagenes.py
+"""
+Variantes redimensionadas de las imágenes de productos y de empresas.
+
+Por cada imagen subida se generan copias WebP más livianas (thumb, card y
+detalle) junto al original en el mismo storage. El original se conserva tal
+cual. Los nombres de las variantes se guardan en el JSONField `variantes_imagen`
+del modelo, junto con el nombre del original del que salieron:
+
+    {'imagen': {'origen': 'productos/cafe.jpg', 'thumb': 'productos/cafe__thumb.webp', ...}}
+
+Las variantes se generan al confirmar la transacción en la que cambió la imagen
+(ver signals.py). El comando generar_variantes_imagenes genera las que faltan.
+Las plantillas y la API usan urls_variantes(), que devuelve la URL del original
+para las variantes que aún no existen.
+"""
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# Variante -> lado mayor en píxeles, de mayor a menor (cada una se reduce desde la anterior)
+VARIANTES = {
+    'detalle': 1200,
+    'card': 480,
+    'thumb': 160,
+}
+# Campos de imagen con variantes por modelo (app_label.Modelo)
+CAMPOS_CON_VARIANTES = {
+    'produccion.Producto': ['imagen'],
+    'produccion.ProductoImagen': ['imagen'],
+    'cuentas.Mipyme': ['logo', 'portada'],
+}
+CALIDAD = 80
+# Si Pillow se compiló sin WebP se guardan JPEG
+FORMATO, EXTENSION = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+OPCIONES_GUARDADO = {'quality': CALIDAD, 'method': 4} if FORMATO == 'WEBP' else {'quality': CALIDAD, 'optimize': True}
+
+
+def campos_de(instancia):
+    return CAMPOS_CON_VARIANTES.get(instancia._meta.label, [])
+
+
+def ruta_variante(nombre, variante):
+    base, _ = os.path.splitext(nombre)
+    return f'{base}__{variante}.{EXTENSION}'
+
+
+def _abrir(archivo):
+    archivo.open('rb')
+    try:
+        imagen = Image.open(archivo)
+        # Los JPEG se decodifican directamente a una escala cercana a la variante más grande
+        imagen.draft('RGB', (VARIANTES['detalle'], VARIANTES['detalle']))
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.load()
+    finally:
+        archivo.close()
+    con_alfa = imagen.mode in ('RGBA', 'LA') or (imagen.mode == 'P' and 'transparency' in imagen.info)
+    return imagen.convert('RGBA' if con_alfa and FORMATO == 'WEBP' else 'RGB')
+
+
+def generar_variantes(archivo):
+    """
+    Genera y guarda las variantes de un FieldFile. Devuelve el diccionario que se
+    guarda en `variantes_imagen` para ese campo.
+    """
+    imagen = _abrir(archivo)
+    variantes = {'origen': archivo.name}
+    for variante, lado in VARIANTES.items():
+        # thumbnail() solo reduce: una imagen pequeña se re-codifica sin agrandarse
+        imagen.thumbnail((lado, lado), Image.LANCZOS)
+        buf = io.BytesIO()
+        imagen.save(buf, FORMATO, **OPCIONES_GUARDADO)
+        # Si el nombre ya existe el storage elige otro; se guarda el que devuelve
+        variantes[variante] = archivo.storage.save(ruta_variante(archivo.name, variante), ContentFile(buf.getvalue()))
+    return variantes
+
+
+def variantes_o_solo_origen(archivo):
+    """Como generar_variantes(), pero si la imagen no se puede procesar devuelve solo el origen."""
+    try:
+        return generar_variantes(archivo)
+    except Exception as e:
+        # Se anota el origen para no reintentar en cada guardado; se sirve el original
+        logger.error(f"No se pudieron generar las variantes de {archivo.name}: {type(e).__name__}: {e}")
+        return {'origen': archivo.name}
+
+
+def eliminar_variantes(storage, variantes):
+    for variante in VARIANTES:
+        if variantes.get(variante):
+            try:
+                storage.delete(variantes[variante])
+            except Exception as e:
+                logger.warning(f"No se pudo eliminar la variante {variantes[variante]}: {e}")
+
+
+def campos_desactualizados(instancia):
+    """Campos de imagen cuyo archivo actual no coincide con el origen de sus variantes."""
+    variantes = instancia.variantes_imagen or {}
+    return [
+        campo for campo in campos_de(instancia)
+        if (getattr(instancia, campo).name or None) != variantes.get(campo, {}).get('origen')
+    ]
+
+
+def actualizar_variantes(instancia, campos=None):
+    """
+    Regenera las variantes de `campos` (por defecto, los desactualizados) y las
+    guarda con un update, sin volver a disparar las señales del modelo.
+    """
+    campos = campos if campos is not None else campos_desactualizados(instancia)
+    if not campos:
+        return instancia.variantes_imagen
+    variantes = dict(instancia.variantes_imagen or {})
+    for campo in campos:
+        archivo = getattr(instancia, campo)
+        anteriores = variantes.pop(campo, None)
+        if anteriores:
+            eliminar_variantes(archivo.storage, anteriores)
+        if archivo.name:
+            variantes[campo] = variantes_o_solo_origen(archivo)
+    type(instancia).objects.filter(pk=instancia.pk).update(variantes_imagen=variantes)
+    instancia.variantes_imagen = variantes
+    return variantes
+
+
+def urls_variantes(instancia, campo):
+    """{'thumb': url, 'card': url, 'detalle': url} de un campo; None si no tiene imagen."""
+    archivo = getattr(instancia, campo)
+    if not archivo.name:
+        return None
+    variantes = (instancia.variantes_imagen or {}).get(campo, {})
+    vigentes = variantes.get('origen') == archivo.name
+    original = None
+    urls = {}
+    for variante in VARIANTES:
+        if vigentes and variantes.get(variante):
+            urls[variante] = archivo.storage.url(variantes[variante])
+        else:
+            original = original or archivo.url
+            urls[variante] = original
+    return urls
+
+
+def urls_imagenes(instancia):
+    """URLs de las variantes de cada campo con imagen: {'imagen': {'thumb': url, ...}}."""
+    return {campo: urls_variantes(instancia, campo) for campo in campos_de(instancia)}
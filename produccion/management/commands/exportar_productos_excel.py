@@ -0,0 +1,30 @@
+# produccion/management/commands/exportar_productos_excel.py
+from django.core.management.base import BaseCommand, CommandError
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from cuentas.models import Mipyme
+from produccion.excel import configuracion, guardar_excel_en_storage
+from produccion.models import ExportacionExcel
+
+
+class Command(BaseCommand):
+    help = 'Genera el Excel de productos de una Mipyme, lo sube al storage y muestra el enlace de descarga'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mipyme_id', type=int, help='ID de la Mipyme a exportar')
+
+    def handle(self, *args, **options):
+        try:
+            mipyme = Mipyme.objects.get(pk=options['mipyme_id'])
+        except Mipyme.DoesNotExist:
+            raise CommandError(f"No existe la Mipyme {options['mipyme_id']}")
+
+        ruta, url = guardar_excel_en_storage(mipyme)
+        # Se registra para que el worker borre el archivo cuando venza
+        vence = timezone.now() + timedelta(hours=configuracion()['vigencia_horas'])
+        ExportacionExcel.objects.create(mipyme=mipyme, estado=ExportacionExcel.Estados.LISTA, ruta=ruta, vence=vence)
+        self.stdout.write(self.style.SUCCESS(f'Exportación guardada en {ruta}'))
+        self.stdout.write(url)
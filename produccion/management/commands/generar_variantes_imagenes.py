@@ -0,0 +1,36 @@
+# produccion/management/commands/generar_variantes_imagenes.py
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from produccion.cache_tienda import invalidar_tienda
+from produccion.imagenes import CAMPOS_CON_VARIANTES, actualizar_variantes, campos_desactualizados
+
+
+class Command(BaseCommand):
+    help = 'Genera las variantes redimensionadas de las imágenes de productos y empresas que aún no las tienen'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--modelo',
+            action='append',
+            choices=sorted(CAMPOS_CON_VARIANTES),
+            help='Modelo a procesar (se puede repetir). Por defecto, todos.'
+        )
+        parser.add_argument('--forzar', action='store_true', help='Regenera también las variantes existentes.')
+
+    def handle(self, *args, **options):
+        total = 0
+        for etiqueta in options['modelo'] or CAMPOS_CON_VARIANTES:
+            modelo = apps.get_model(etiqueta)
+            generadas = 0
+            for instancia in modelo.objects.order_by('pk').iterator(chunk_size=200):
+                campos = CAMPOS_CON_VARIANTES[etiqueta] if options['forzar'] else campos_desactualizados(instancia)
+                campos = [campo for campo in campos if getattr(instancia, campo).name or campo in (instancia.variantes_imagen or {})]
+                if campos:
+                    actualizar_variantes(instancia, campos)
+                    generadas += 1
+            self.stdout.write(f'{etiqueta}: {generadas} registros actualizados.')
+            total += generadas
+        if total:
+            invalidar_tienda()
+        self.stdout.write(self.style.SUCCESS(f'Variantes generadas para {total} registros.'))
@@ -0,0 +1,59 @@
+# produccion/management/commands/procesar_tareas.py
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cuentas.cola_emails import MAX_LOTE_RESEND, configuracion, procesar_pendientes, transporte
+from produccion.carga_imagenes import generar_variantes_pendientes
+from produccion.excel import limpiar_exportaciones_vencidas, procesar_exportaciones
+
+# Cada cuánto se borran las exportaciones vencidas
+INTERVALO_LIMPIEZA = 600
+
+
+class Command(BaseCommand):
+    help = 'Worker de tareas en segundo plano: envía los emails encolados, genera las exportaciones a Excel y las variantes de las imágenes cargadas en bloque'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help='Procesa una ronda de cada cola y termina.')
+        parser.add_argument('--lote', type=int, help='Emails por lote (por defecto, EMAIL_COLA["lote"]).')
+        parser.add_argument('--transporte', help='Transporte de emails: resend, memoria o una ruta a una clase.')
+
+    def handle(self, *args, **options):
+        config = configuracion()
+        envio = transporte(options['transporte'])
+        self.detener = False
+        # Railway y gunicorn detienen los procesos con SIGTERM: se termina la tarea en curso
+        signal.signal(signal.SIGTERM, self._detener)
+        proxima_limpieza = 0
+
+        while not self.detener:
+            close_old_connections()
+            resultado = procesar_pendientes(options['lote'], envio)
+            emails = sum(resultado.values())
+            if emails:
+                self.stdout.write(
+                    f"Enviados: {resultado['enviados']}, reintentos: {resultado['reintentos']}, fallidos: {resultado['fallidos']}"
+                )
+            # Una exportación por ronda, para no retrasar los emails detrás de un libro grande
+            exportaciones = procesar_exportaciones(limite=1)
+            if exportaciones:
+                self.stdout.write(f"Exportaciones a Excel generadas: {exportaciones}")
+            variantes = generar_variantes_pendientes()
+            if variantes:
+                self.stdout.write(f"Imágenes con variantes generadas: {variantes}")
+            if time.monotonic() >= proxima_limpieza:
+                borradas = limpiar_exportaciones_vencidas()
+                if borradas:
+                    self.stdout.write(f"Exportaciones vencidas borradas: {borradas}")
+                proxima_limpieza = time.monotonic() + INTERVALO_LIMPIEZA
+            if options['una_vez']:
+                break
+            # Con un lote lleno o una exportación hecha es probable que haya más: se sigue sin esperar
+            if not exportaciones and not variantes and emails < min(options['lote'] or config['lote'], MAX_LOTE_RESEND):
+                time.sleep(config['intervalo'])
+
+    def _detener(self, signum, frame):
+        self.detener = True
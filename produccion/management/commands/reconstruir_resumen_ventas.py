@@ -0,0 +1,20 @@
+# produccion/management/commands/reconstruir_resumen_ventas.py
+from django.core.management.base import BaseCommand
+
+from produccion.resumen_ventas import reconstruir_resumen
+
+
+class Command(BaseCommand):
+    help = 'Recalcula el resumen mensual de ventas a partir de los items de venta'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mipyme',
+            type=int,
+            action='append',
+            help='ID de la Mipyme a reconstruir (se puede repetir). Por defecto, todas.'
+        )
+
+    def handle(self, *args, **options):
+        creadas = reconstruir_resumen(mipymes=options['mipyme'])
+        self.stdout.write(self.style.SUCCESS(f'Resumen de ventas reconstruido: {creadas} filas.'))
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:41
+
+import decimal
+
+from django.db import migrations, models
+
+
+def calcular_costos_existentes(apps, schema_editor):
+    Producto = apps.get_model('produccion', 'Producto')
+    productos = Producto.objects.prefetch_related('formulacion__insumo', 'pasodeproduccion_set__proceso')
+    actualizados = []
+    for producto in productos:
+        costo_insumos = sum(
+            (item.cantidad * item.insumo.costo_unitario * (1 + item.porcentaje_desperdicio / 100)
+             for item in producto.formulacion.all()),
+            decimal.Decimal(0)
+        )
+        costo_procesos = sum(
+            ((decimal.Decimal(paso.tiempo_en_minutos) / 60) * paso.proceso.costo_por_hora
+             for paso in producto.pasodeproduccion_set.all()),
+            decimal.Decimal(0)
+        )
+        producto.costo_insumos_cache = costo_insumos
+        producto.costo_procesos_cache = costo_procesos
+        producto.costo_produccion_cache = costo_insumos + costo_procesos
+        actualizados.append(producto)
+    Producto.objects.bulk_update(
+        actualizados,
+        ['costo_insumos_cache', 'costo_procesos_cache', 'costo_produccion_cache'],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("produccion", "0016_producto_disponible_en_api"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="producto",
+            name="costo_insumos_cache",
+            field=models.DecimalField(decimal_places=2, default=0.0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name="producto",
+            name="costo_procesos_cache",
+            field=models.DecimalField(decimal_places=2, default=0.0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name="producto",
+            name="costo_produccion_cache",
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0.0, editable=False, max_digits=10),
+        ),
+        migrations.RunPython(calcular_costos_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("produccion", "0017_producto_costos_materializados"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="formulacion",
+            index=models.Index(fields=["insumo", "producto"], name="formulacion_insumo_prod_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="pasodeproduccion",
+            index=models.Index(fields=["proceso", "producto"], name="paso_proceso_producto_idx"),
+        ),
+    ]
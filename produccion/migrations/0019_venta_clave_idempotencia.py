@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cuentas", "0024_mipyme_mostrar_productos_en_marketplace"),
+        ("produccion", "0018_indices_inversos_costos"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="venta",
+            name="clave_idempotencia",
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="venta",
+            constraint=models.UniqueConstraint(condition=models.Q(("clave_idempotencia__isnull", False)), fields=("mipyme", "clave_idempotencia"), name="venta_clave_idempotencia_unica"),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:56
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncMonth
+
+
+def calcular_resumen_existente(apps, schema_editor):
+    # Las ventas anteriores no tienen costo_unitario: se usa el costo actual del producto
+    VentaItem = apps.get_model('produccion', 'VentaItem')
+    ResumenVentasMensual = apps.get_model('produccion', 'ResumenVentasMensual')
+    costo_item = ExpressionWrapper(
+        F('cantidad') * F('producto__costo_produccion_cache'),
+        output_field=DecimalField(max_digits=20, decimal_places=4),
+    )
+    filas = (
+        VentaItem.objects.annotate(mes=TruncMonth('venta__fecha'))
+        .order_by()
+        .values('venta__mipyme_id', 'mes', 'producto_id')
+        .annotate(ingresos=Sum('subtotal'), unidades=Sum('cantidad'), costo=Sum(costo_item))
+    )
+    lote = []
+    for fila in filas.iterator(chunk_size=2000):
+        mes = fila['mes']
+        lote.append(ResumenVentasMensual(
+            mipyme_id=fila['venta__mipyme_id'],
+            mes=mes.date() if hasattr(mes, 'date') else mes,
+            producto_id=fila['producto_id'],
+            ingresos=fila['ingresos'] or 0,
+            unidades=fila['unidades'] or 0,
+            costo=Decimal(fila['costo'] or 0).quantize(Decimal('0.01')),
+        ))
+        if len(lote) >= 1000:
+            ResumenVentasMensual.objects.bulk_create(lote)
+            lote = []
+    if lote:
+        ResumenVentasMensual.objects.bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cuentas", "0024_mipyme_mostrar_productos_en_marketplace"),
+        ("produccion", "0019_venta_clave_idempotencia"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ventaitem",
+            name="costo_unitario",
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.CreateModel(
+            name="ResumenVentasMensual",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("mes", models.DateField(help_text="Primer día del mes")),
+                ("ingresos", models.DecimalField(decimal_places=2, default=Decimal("0.00"), max_digits=14)),
+                ("unidades", models.IntegerField(default=0)),
+                ("costo", models.DecimalField(decimal_places=2, default=Decimal("0.00"), help_text="Costo de producción de lo vendido", max_digits=14)),
+                ("mipyme", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="resumen_ventas", to="cuentas.mipyme")),
+                ("producto", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="resumen_ventas", to="produccion.producto")),
+            ],
+            options={
+                "verbose_name": "Resumen de Ventas Mensual",
+                "verbose_name_plural": "Resúmenes de Ventas Mensuales",
+                "ordering": ["-mes"],
+                "unique_together": {("mipyme", "mes", "producto")},
+            },
+        ),
+        migrations.RunPython(calcular_resumen_existente, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-17 18:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cuentas", "0024_mipyme_mostrar_productos_en_marketplace"),
+        ("produccion", "0020_resumen_ventas_mensual"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="venta",
+            index=models.Index(fields=["mipyme", "-fecha"], name="venta_mipyme_fecha_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="ventaitem",
+            index=models.Index(fields=["venta", "producto"], name="ventaitem_venta_producto_idx"),
+        ),
+    ]
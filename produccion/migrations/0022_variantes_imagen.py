@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("produccion", "0021_indices_historial_ventas"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="producto",
+            name="variantes_imagen",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="productoimagen",
+            name="variantes_imagen",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-17 19:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cuentas", "0026_mipyme_variantes_imagen"),
+        ("produccion", "0022_variantes_imagen"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExportacionExcel",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("estado", models.CharField(choices=[("pendiente", "Pendiente"), ("en_proceso", "En proceso"), ("lista", "Lista"), ("error", "Error")], default="pendiente", max_length=10)),
+                ("ruta", models.CharField(blank=True, help_text="Archivo generado en el storage de medios", max_length=255)),
+                ("ultimo_error", models.TextField(blank=True)),
+                ("creado", models.DateTimeField(auto_now_add=True)),
+                ("iniciado", models.DateTimeField(blank=True, null=True)),
+                ("vence", models.DateTimeField(blank=True, help_text="Cuándo se borra el archivo generado", null=True)),
+                ("mipyme", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="exportaciones_excel", to="cuentas.mipyme")),
+            ],
+            options={
+                "verbose_name": "Exportación a Excel",
+                "verbose_name_plural": "Exportaciones a Excel",
+                "ordering": ["-creado"],
+                "indexes": [models.Index(fields=["estado", "creado"], name="exportacion_estado_creado_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("produccion", "0023_exportacion_excel"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productoimagen",
+            name="variantes_pendientes",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="productoimagen",
+            index=models.Index(condition=models.Q(("variantes_pendientes", True)), fields=["id"], name="imagen_variantes_pend_idx"),
+        ),
+    ]
@@ -1,5 +1,6 @@
 # produccion/models.py
 from django.db import models
+from django.utils.functional import cached_property
 from cuentas.models import Mipyme  # Importamos el modelo Mipyme
 import decimal  # Importamos para usar Decimal
 
@@ -25,6 +26,19 @@ class Insumo(models.Model):
     def __str__(self):
         return f"{self.nombre} ({self.unidad.abreviatura})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Guardamos el costo leído para saber si cambia al guardar y solo así
+        # recalcular los productos que usan este insumo
+        instance._costo_unitario_original = instance.__dict__.get('costo_unitario')
+        return instance
+
+    @property
+    def costo_cambio(self):
+        """Indica si el costo unitario difiere del último valor leído o guardado."""
+        return getattr(self, '_costo_unitario_original', None) != self.costo_unitario
+
 # --- NUEVO MODELO ---
 # Modelo para representar un proceso de producción (ej: cortar, ensamblar, pintar)
 class Proceso(models.Model):
@@ -35,6 +49,18 @@ class Proceso(models.Model):
     def __str__(self):
         return self.nombre
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Igual que en Insumo: detectamos cambios del costo por hora
+        instance._costo_por_hora_original = instance.__dict__.get('costo_por_hora')
+        return instance
+
+    @property
+    def costo_cambio(self):
+        """Indica si el costo por hora difiere del último valor leído o guardado."""
+        return getattr(self, '_costo_por_hora_original', None) != self.costo_por_hora
+
 
 # Modelo para el producto final que crea la Mipyme
 class Producto(models.Model):
@@ -51,6 +77,8 @@ class Producto(models.Model):
     tamano_alto = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, verbose_name="Alto (cm)")
     presentacion = models.CharField(max_length=200, blank=True, null=True, verbose_name="Presentación")
     imagen = models.ImageField(upload_to='productos/', blank=True, null=True, verbose_name="Imagen del Producto")
+    # Variantes redimensionadas de la imagen (ver produccion/imagenes.py)
+    variantes_imagen = models.JSONField(default=dict, blank=True, editable=False)
     # --- CAMPO MODIFICADO ---
     # Relacionamos los productos con los procesos a través de una tabla intermedia
     procesos = models.ManyToManyField(Proceso, through='PasoDeProduccion', related_name='productos')
@@ -64,9 +92,26 @@ class Producto(models.Model):
         help_text="Si está desactivado, este producto no aparecerá en la tienda pública ni en la API."
     )
 
+    # --- COSTOS MATERIALIZADOS ---
+    # Copias desnormalizadas de las propiedades de costo. Se actualizan al guardar el
+    # producto y cuando cambian su formulación, sus pasos o los costos de sus insumos
+    # y procesos, para que los listados no tengan que recorrer la receta.
+    costo_insumos_cache = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, editable=False)
+    costo_procesos_cache = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, editable=False)
+    costo_produccion_cache = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, editable=False, db_index=True)
+
+    # Campos que dependen del cálculo de costos en save()
+    CAMPOS_CALCULADOS = ('precio_venta', 'costo_insumos_cache', 'costo_procesos_cache', 'costo_produccion_cache')
+
     def __str__(self):
         return self.nombre
 
+    @cached_property
+    def urls_imagenes(self):
+        """URLs de las variantes de la imagen, para las plantillas: urls_imagenes.imagen.card"""
+        from .imagenes import urls_imagenes
+        return urls_imagenes(self)
+
 
 
     # --- MÉTODO MODIFICADO: Para calcular el costo de producción total ---
@@ -103,8 +148,8 @@ class Producto(models.Model):
     def margen_de_ganancia(self):
         """Calcula el margen de ganancia por unidad."""
         if self.precio_venta is not None:
-            # El costo_de_produccion ya es una propiedad que calcula el total
-            return self.precio_venta - self.costo_de_produccion
+            # Usamos el costo materializado para no recorrer la receta en cada lectura
+            return self.precio_venta - self.costo_produccion_cache
         return decimal.Decimal(0)
 
     @property
@@ -119,34 +164,56 @@ class Producto(models.Model):
         return precio_base + total_impuestos
 
     def save(self, *args, **kwargs):
-        # Calcular el costo de producción
-        costo_produccion = self.costo_de_produccion
+        # Si solo se actualizan campos ajenos al costo (ej: stock), no recalculamos
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not set(update_fields) & set(self.CAMPOS_CALCULADOS):
+            return super().save(*args, **kwargs)
+
+        # Calcular el costo de producción y guardarlo en las columnas materializadas
+        self.costo_insumos_cache = self.costo_insumos
+        self.costo_procesos_cache = self.costo_procesos
+        costo_produccion = self.costo_insumos_cache + self.costo_procesos_cache
+        self.costo_produccion_cache = costo_produccion
+        self.precio_venta = self.calcular_precio_venta(costo_produccion, self.porcentaje_ganancia)
 
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def calcular_precio_venta(costo_produccion, porcentaje_ganancia):
+        """Precio de venta a partir del costo y el porcentaje de ganancia."""
         # Si el costo de producción es cero, el precio de venta debe ser cero
         if costo_produccion <= 0:
-            self.precio_venta = decimal.Decimal('0.00')
-        else:
-            # Calcular el precio de venta basado en el costo y el porcentaje de ganancia
-            ganancia = costo_produccion * (decimal.Decimal(self.porcentaje_ganancia) / decimal.Decimal(100))
-            self.precio_venta = costo_produccion + ganancia
-
-        super().save(*args, **kwargs)
+            return decimal.Decimal('0.00')
+        # Calcular el precio de venta basado en el costo y el porcentaje de ganancia
+        ganancia = costo_produccion * (decimal.Decimal(porcentaje_ganancia) / decimal.Decimal(100))
+        return costo_produccion + ganancia
 
 
 # --- NUEVO MODELO PARA IMÁGENES ADICIONALES ---
 class ProductoImagen(models.Model):
     producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='imagenes_adicionales')
     imagen = models.ImageField(upload_to='productos/adicionales/', verbose_name="Imagen Adicional")
+    variantes_imagen = models.JSONField(default=dict, blank=True, editable=False)
+    # Cargada en bloque: el worker genera sus variantes (produccion.carga_imagenes)
+    variantes_pendientes = models.BooleanField(default=False, editable=False)
     orden = models.PositiveIntegerField(default=0, help_text="Orden de visualización")
 
     class Meta:
         ordering = ['orden']
         verbose_name = "Imagen Adicional de Producto"
         verbose_name_plural = "Imágenes Adicionales de Productos"
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(variantes_pendientes=True), name='imagen_variantes_pend_idx'),
+        ]
 
     def __str__(self):
         return f"Imagen de {self.producto.nombre}"
 
+    @cached_property
+    def urls_imagenes(self):
+        from .imagenes import urls_imagenes
+        return urls_imagenes(self)
+
 
 # --- NUEVO MODELO ---
 # Tabla intermedia para definir qué procesos y por cuánto tiempo se aplican a un producto
@@ -157,6 +224,10 @@ class PasoDeProduccion(models.Model):
 
     class Meta:
         unique_together = ('producto', 'proceso')
+        indexes = [
+            # Índice inverso proceso -> productos para repreciar solo los afectados
+            models.Index(fields=['proceso', 'producto'], name='paso_proceso_producto_idx'),
+        ]
 
     def __str__(self):
         return f"Proceso '{self.proceso.nombre}' para '{self.producto.nombre}' ({self.tiempo_en_minutos} min)"
@@ -181,6 +252,10 @@ class Formulacion(models.Model):
     class Meta:
         # Aseguramos que un insumo solo pueda aparecer una vez por producto
         unique_together = ('producto', 'insumo')
+        indexes = [
+            # Índice inverso insumo -> productos para repreciar solo los afectados
+            models.Index(fields=['insumo', 'producto'], name='formulacion_insumo_prod_idx'),
+        ]
 
     def __str__(self):
         return f"{self.cantidad} {self.insumo.unidad.abreviatura} de {self.insumo.nombre} para {self.producto.nombre}"
@@ -215,11 +290,23 @@ class Venta(models.Model):
     mipyme = models.ForeignKey(Mipyme, on_delete=models.CASCADE, related_name='ventas')
     fecha = models.DateTimeField(auto_now_add=True)
     total = models.DecimalField(max_digits=10, decimal_places=2, default=decimal.Decimal('0.00'), editable=False)
+    # Clave enviada por el punto de venta para que reintentar una carga no duplique ventas
+    clave_idempotencia = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = "Venta"
         verbose_name_plural = "Ventas"
         ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['mipyme', '-fecha'], name='venta_mipyme_fecha_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['mipyme', 'clave_idempotencia'],
+                condition=models.Q(clave_idempotencia__isnull=False),
+                name='venta_clave_idempotencia_unica',
+            ),
+        ]
 
     def __str__(self):
         return f"Venta #{self.id} - {self.mipyme} - {self.fecha.strftime('%Y-%m-%d %H:%M')}"
@@ -238,10 +325,15 @@ class VentaItem(models.Model):
     cantidad = models.IntegerField(verbose_name="Cantidad")
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Precio unitario")
     subtotal = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+    # Costo de producción unitario al momento de la venta, para el costo de lo vendido
+    costo_unitario = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = "Item de Venta"
         verbose_name_plural = "Items de Venta"
+        indexes = [
+            models.Index(fields=['venta', 'producto'], name='ventaitem_venta_producto_idx'),
+        ]
 
     def __str__(self):
         return f"{self.producto.nombre} x {self.cantidad}"
@@ -252,6 +344,55 @@ class VentaItem(models.Model):
         super().save(*args, **kwargs)
 
 
+# Resumen de ventas por Mipyme, mes y producto. Se mantiene al registrar cada venta
+# (produccion.resumen_ventas) para que los paneles no recorran todo el historial.
+class ResumenVentasMensual(models.Model):
+    mipyme = models.ForeignKey(Mipyme, on_delete=models.CASCADE, related_name='resumen_ventas')
+    mes = models.DateField(help_text="Primer día del mes")
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='resumen_ventas')
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=decimal.Decimal('0.00'))
+    unidades = models.IntegerField(default=0)
+    costo = models.DecimalField(max_digits=14, decimal_places=2, default=decimal.Decimal('0.00'), help_text="Costo de producción de lo vendido")
+
+    class Meta:
+        verbose_name = "Resumen de Ventas Mensual"
+        verbose_name_plural = "Resúmenes de Ventas Mensuales"
+        unique_together = ('mipyme', 'mes', 'producto')
+        ordering = ['-mes']
+
+    def __str__(self):
+        return f"{self.mipyme} - {self.mes:%Y-%m} - {self.producto}"
+
+
+# Exportaciones a Excel pedidas desde la web. Las genera el worker
+# (produccion.excel.procesar_exportaciones) y se borran al vencer.
+class ExportacionExcel(models.Model):
+    class Estados(models.TextChoices):
+        PENDIENTE = 'pendiente', 'Pendiente'
+        EN_PROCESO = 'en_proceso', 'En proceso'
+        LISTA = 'lista', 'Lista'
+        ERROR = 'error', 'Error'
+
+    mipyme = models.ForeignKey(Mipyme, on_delete=models.CASCADE, related_name='exportaciones_excel')
+    estado = models.CharField(max_length=10, choices=Estados.choices, default=Estados.PENDIENTE)
+    ruta = models.CharField(max_length=255, blank=True, help_text="Archivo generado en el storage de medios")
+    ultimo_error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    vence = models.DateTimeField(null=True, blank=True, help_text="Cuándo se borra el archivo generado")
+
+    class Meta:
+        verbose_name = "Exportación a Excel"
+        verbose_name_plural = "Exportaciones a Excel"
+        ordering = ['-creado']
+        indexes = [
+            models.Index(fields=['estado', 'creado'], name='exportacion_estado_creado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.mipyme} - {self.creado:%Y-%m-%d %H:%M} ({self.get_estado_display()})"
+
+
 # Modelo para Impuestos
 class Impuesto(models.Model):
     mipyme = models.ForeignKey(Mipyme, on_delete=models.CASCADE, related_name='impuestos')
@@ -0,0 +1,27 @@
+# produccion/parsers.py
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parser para application/x-ndjson: un objeto JSON por línea.
+    Las líneas vacías se ignoran. Devuelve la lista de objetos.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        objetos = []
+        for numero, linea in enumerate(stream, start=1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                objetos.append(json.loads(linea.decode(encoding)))
+            except (ValueError, UnicodeDecodeError) as exc:
+                raise ParseError(f'NDJSON inválido en la línea {numero}: {exc}')
+        return objetos
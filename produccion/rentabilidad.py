@@ -0,0 +1,107 @@
+# produccion/rentabilidad.py
+"""
+Serie mensual de rentabilidad del panel de producción.
+
+La página del panel solo entrega la estructura; los datos se piden en JSON y la
+gráfica se dibuja en el navegador con Chart.js. Si se necesita una imagen (correos,
+PDF), grafica_rentabilidad_png() la dibuja una vez por Mipyme y mes y la guarda en caché.
+"""
+import decimal
+import hashlib
+import io
+import json
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from cuentas.models import Usuario
+from .models import ResumenVentasMensual
+
+
+def costos_mensuales(mipyme):
+    """Costo fijo mensual estimado: salario del administrador más el de cada empleado."""
+    num_usuarios = Usuario.objects.filter(mipyme=mipyme).count()
+    costo_admin = decimal.Decimal(365)  # Salario admin
+    costo_empleados = decimal.Decimal(350) * (num_usuarios - 1) if num_usuarios > 1 else decimal.Decimal(0)
+    return costo_admin + costo_empleados
+
+
+def serie_rentabilidad(mipyme):
+    """
+    Rentabilidad (ventas - costos fijos) de los últimos 12 meses con ventas,
+    con los umbrales de pérdidas y ganancias y el estado de cada mes.
+    """
+    costos = costos_mensuales(mipyme)
+    umbral_perdidas = -float(costos)  # Línea roja para pérdidas
+    umbral_ganancias = float(costos)  # Línea verde para ganancias
+
+    # El resumen mensual ya tiene las ventas agrupadas: el costo no crece con el historial
+    ventas_por_mes = ResumenVentasMensual.objects.filter(mipyme=mipyme).values('mes').annotate(
+        total_ventas=Sum('ingresos')
+    ).order_by('-mes')[:12]
+
+    meses = []
+    rentabilidades = []
+    for venta_mes in reversed(list(ventas_por_mes)):
+        ventas_mes = venta_mes['total_ventas'] or decimal.Decimal(0)
+        meses.append(venta_mes['mes'].strftime('%b %Y'))
+        rentabilidades.append(float(ventas_mes - costos))
+
+    tabla = [
+        {
+            'mes': mes,
+            'rentabilidad': rentabilidad,
+            'estado': 'ganancia' if rentabilidad > umbral_ganancias else ('perdida' if rentabilidad < umbral_perdidas else 'neutral'),
+        }
+        for mes, rentabilidad in zip(meses, rentabilidades)
+    ]
+    return {
+        'meses': meses,
+        'rentabilidades': rentabilidades,
+        'tabla': tabla,
+        'umbral_perdidas': umbral_perdidas,
+        'umbral_ganancias': umbral_ganancias,
+        'tiene_datos': bool(meses),
+    }
+
+
+def grafica_rentabilidad_png(mipyme):
+    """
+    PNG de la serie de rentabilidad para usos fuera del navegador. Se dibuja una sola
+    vez por Mipyme, mes y contenido de la serie; las siguientes llamadas usan la caché.
+    """
+    serie = serie_rentabilidad(mipyme)
+    huella = hashlib.md5(json.dumps(serie, sort_keys=True).encode('utf-8')).hexdigest()
+    clave = f"rentabilidad_png:{mipyme.pk}:{timezone.now():%Y-%m}:{huella}"
+    png = cache.get(clave)
+    if png is not None:
+        return png
+
+    # matplotlib se importa solo aquí: cargarlo cuesta cientos de milisegundos
+    import matplotlib
+    matplotlib.use('Agg')  # Usar backend no interactivo
+    import matplotlib.pyplot as plt
+
+    meses = serie['meses'] or ['Sin datos']
+    rentabilidades = serie['rentabilidades'] or [0]
+    fig, ax = plt.subplots(figsize=(10, 5))
+    try:
+        ax.plot(meses, rentabilidades, marker='o', color='blue', linewidth=2, label='Rentabilidad')
+        ax.axhline(y=serie['umbral_perdidas'], color='red', linestyle='--', linewidth=2, label=f"Umbral Pérdidas (${serie['umbral_perdidas']:.0f})")
+        ax.axhline(y=serie['umbral_ganancias'], color='green', linestyle='--', linewidth=2, label=f"Umbral Ganancias (${serie['umbral_ganancias']:.0f})")
+        ax.set_title('Rentabilidad del Negocio - Últimos 12 Meses')
+        ax.set_xlabel('Mes')
+        ax.set_ylabel('Rentabilidad ($)')
+        ax.tick_params(axis='x', rotation=45)
+        ax.grid(True)
+        ax.legend()
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png')
+        png = buf.getvalue()
+    finally:
+        plt.close(fig)
+
+    cache.set(clave, png, 60 * 60 * 24)
+    return png
@@ -0,0 +1,174 @@
+# produccion/resumen_ventas.py
+"""
+Resumen mensual de ventas por Mipyme y producto (ResumenVentasMensual).
+
+Los servicios de venta llaman a acumular_items() dentro de la misma transacción
+en la que guardan la venta, así el resumen queda confirmado junto con ella. Los
+paneles, el asistente y las exportaciones leen el resumen en lugar de recorrer
+todo el historial de ventas. reconstruir_resumen() lo recalcula desde cero.
+
+acumular_items() solo suma. Cuando una venta o uno de sus items se edita o se
+elimina por otra vía (por ejemplo, desde el admin), las señales llaman a
+programar_reconstruccion() con el mes afectado y, al confirmar la transacción, se
+reconstruyen solo esos meses de esa Mipyme: el costo depende de las ventas del mes,
+no de todo el historial.
+"""
+import datetime
+import decimal
+import operator
+import threading
+from collections import defaultdict
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import ResumenVentasMensual, VentaItem
+
+CAMPOS_ACUMULADOS = ['ingresos', 'unidades', 'costo']
+
+
+def mes_de(fecha):
+    """Primer día del mes de una fecha, en la zona horaria del proyecto."""
+    return timezone.localtime(fecha).date().replace(day=1)
+
+
+def acumular_items(mipyme, venta_items):
+    """
+    Suma los items de ventas recién guardadas al resumen de su mes.
+    Debe llamarse dentro de la transacción de la venta y con los productos ya bloqueados,
+    de modo que dos ventas del mismo producto no creen la misma fila a la vez.
+    """
+    deltas = defaultdict(lambda: [decimal.Decimal('0.00'), 0, decimal.Decimal('0.00')])
+    for item in venta_items:
+        acumulado = deltas[(mes_de(item.venta.fecha), item.producto_id)]
+        acumulado[0] += item.subtotal
+        acumulado[1] += item.cantidad
+        acumulado[2] += (item.costo_unitario or 0) * item.cantidad
+    if not deltas:
+        return
+
+    existentes = {
+        (resumen.mes, resumen.producto_id): resumen for resumen in
+        ResumenVentasMensual.objects.select_for_update().filter(
+            mipyme=mipyme,
+            mes__in={mes for mes, _ in deltas},
+            producto_id__in={producto_id for _, producto_id in deltas},
+        )
+    }
+    nuevos, actualizados = [], []
+    for (mes, producto_id), (ingresos, unidades, costo) in deltas.items():
+        resumen = existentes.get((mes, producto_id))
+        if resumen is None:
+            nuevos.append(ResumenVentasMensual(
+                mipyme=mipyme, mes=mes, producto_id=producto_id,
+                ingresos=ingresos, unidades=unidades, costo=costo,
+            ))
+        else:
+            resumen.ingresos += ingresos
+            resumen.unidades += unidades
+            resumen.costo += costo
+            actualizados.append(resumen)
+    if actualizados:
+        ResumenVentasMensual.objects.bulk_update(actualizados, CAMPOS_ACUMULADOS, batch_size=500)
+    if nuevos:
+        ResumenVentasMensual.objects.bulk_create(nuevos, batch_size=500)
+
+
+def reconstruir_resumen(mipymes=None):
+    """
+    Recalcula el resumen desde los items de venta, para todas las Mipymes o solo
+    las indicadas. Las ventas sin costo guardado usan el costo actual del producto.
+    Devuelve la cantidad de filas creadas.
+    """
+    items = VentaItem.objects.all()
+    resumenes = ResumenVentasMensual.objects.all()
+    if mipymes is not None:
+        items = items.filter(venta__mipyme__in=mipymes)
+        resumenes = resumenes.filter(mipyme__in=mipymes)
+    return _reconstruir(items, resumenes)
+
+
+def reconstruir_meses(meses):
+    """Recalcula solo los meses indicados como pares (mipyme_id, primer día del mes). Devuelve las filas creadas."""
+    condiciones_items, condiciones_resumen = [], []
+    for mipyme_id, mes in meses:
+        inicio = timezone.make_aware(datetime.datetime.combine(mes, datetime.time.min))
+        siguiente = (mes.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        fin = timezone.make_aware(datetime.datetime.combine(siguiente, datetime.time.min))
+        condiciones_items.append(Q(venta__mipyme_id=mipyme_id, venta__fecha__gte=inicio, venta__fecha__lt=fin))
+        condiciones_resumen.append(Q(mipyme_id=mipyme_id, mes=mes))
+    if not condiciones_items:
+        return 0
+    return _reconstruir(
+        VentaItem.objects.filter(reduce(operator.or_, condiciones_items)),
+        ResumenVentasMensual.objects.filter(reduce(operator.or_, condiciones_resumen)),
+    )
+
+
+def _reconstruir(items, resumenes):
+    costo_item = ExpressionWrapper(
+        F('cantidad') * Coalesce('costo_unitario', 'producto__costo_produccion_cache'),
+        output_field=DecimalField(max_digits=20, decimal_places=4),
+    )
+    filas = (
+        items.annotate(mes=TruncMonth('venta__fecha'))
+        .order_by()
+        .values('venta__mipyme_id', 'mes', 'producto_id')
+        .annotate(ingresos=Sum('subtotal'), unidades=Sum('cantidad'), costo=Sum(costo_item))
+    )
+
+    creadas = 0
+    with transaction.atomic():
+        resumenes.delete()
+        lote = []
+        for fila in filas.iterator(chunk_size=2000):
+            mes = fila['mes']
+            lote.append(ResumenVentasMensual(
+                mipyme_id=fila['venta__mipyme_id'],
+                mes=mes.date() if hasattr(mes, 'date') else mes,
+                producto_id=fila['producto_id'],
+                ingresos=fila['ingresos'] or 0,
+                unidades=fila['unidades'] or 0,
+                costo=decimal.Decimal(fila['costo'] or 0).quantize(decimal.Decimal('0.01')),
+            ))
+            if len(lote) >= 1000:
+                ResumenVentasMensual.objects.bulk_create(lote)
+                creadas += len(lote)
+                lote = []
+        if lote:
+            ResumenVentasMensual.objects.bulk_create(lote)
+            creadas += len(lote)
+    return creadas
+
+
+# --- RECONSTRUCCIÓN DIFERIDA ---
+# Igual que el recálculo de costos: los meses marcados se acumulan por hilo y el
+# primer callback que se ejecuta al hacer commit los reconstruye todos.
+_pendientes = threading.local()
+
+
+def _meses_pendientes():
+    if not hasattr(_pendientes, 'meses'):
+        _pendientes.meses = set()
+    return _pendientes.meses
+
+
+def programar_reconstruccion(meses):
+    """Marca pares (mipyme_id, mes) cuyo resumen debe reconstruirse al confirmar la transacción."""
+    pendientes = _meses_pendientes()
+    pendientes.update((mipyme_id, mes) for mipyme_id, mes in meses if mipyme_id)
+    if pendientes:
+        transaction.on_commit(reconstruir_pendientes)
+
+
+def reconstruir_pendientes():
+    """Reconstruye los meses marcados en este hilo."""
+    pendientes = _meses_pendientes()
+    if not pendientes:
+        return 0
+    meses = set(pendientes)
+    pendientes.clear()
+    return reconstruir_meses(meses)
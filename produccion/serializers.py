@@ -1,7 +1,23 @@
 from rest_framework import serializers
+from .imagenes import urls_variantes
 from .models import Producto, Formulacion, PasoDeProduccion, Impuesto, ProductoImagen
 
 
+class VariantesImagenField(serializers.Field):
+    """
+    URLs de las variantes redimensionadas (thumb, card, detalle) de un campo de imagen.
+    Mientras una variante no existe se devuelve la URL del original.
+    """
+    def __init__(self, campo, **kwargs):
+        self.campo = campo
+        kwargs.setdefault('source', '*')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instancia):
+        return urls_variantes(instancia, self.campo) if instancia is not None else None
+
+
 class FormulacionSerializer(serializers.ModelSerializer):
     """
     Serializer for Formulacion model, providing details of insumos used in the product.
@@ -56,9 +72,11 @@ class ProductoImagenSerializer(serializers.ModelSerializer):
     """
     Serializer for ProductoImagen model.
     """
+    imagen_variantes = VariantesImagenField('imagen')
+
     class Meta:
         model = ProductoImagen
-        fields = ['id', 'imagen', 'orden']
+        fields = ['id', 'imagen', 'imagen_variantes', 'orden']
 
 
 class ProductoSerializer(serializers.ModelSerializer):
@@ -66,10 +84,13 @@ class ProductoSerializer(serializers.ModelSerializer):
     Serializer for Producto model, including product details, pricing, stock, and related mipyme information.
     """
     mipyme_name = serializers.CharField(source='mipyme.nombre', read_only=True)
-    costo_de_produccion = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    costo_de_produccion = serializers.DecimalField(source='costo_produccion_cache', max_digits=10, decimal_places=2, read_only=True)
     imagenes_adicionales = ProductoImagenSerializer(many=True, read_only=True)
+    imagen_variantes = VariantesImagenField('imagen')
     mipyme_portada = serializers.ImageField(source='mipyme.portada', read_only=True)
+    mipyme_portada_variantes = VariantesImagenField('portada', source='mipyme')
     mipyme_logo = serializers.ImageField(source='mipyme.logo', read_only=True)
+    mipyme_logo_variantes = VariantesImagenField('logo', source='mipyme')
     mipyme_sector = serializers.CharField(source='mipyme.sector.nombre', read_only=True)
     mipyme_descripcion = serializers.CharField(source='mipyme.descripcion', read_only=True)
     mipyme_direccion = serializers.CharField(source='mipyme.direccion', read_only=True)
@@ -86,11 +107,14 @@ class ProductoSerializer(serializers.ModelSerializer):
             'nombre',
             'descripcion',
             'imagen',
+            'imagen_variantes',
             'imagenes_adicionales',
             'mipyme',
             'mipyme_name',
             'mipyme_portada',
+            'mipyme_portada_variantes',
             'mipyme_logo',
+            'mipyme_logo_variantes',
             'mipyme_sector',
             'mipyme_descripcion',
             'mipyme_direccion',
@@ -112,7 +136,79 @@ class ProductoSerializer(serializers.ModelSerializer):
             'impuestos_detalles'
         ]
         read_only_fields = ['id', 'costo_de_produccion']
+
+    @staticmethod
+    def optimizar_queryset(queryset):
+        """
+        Carga en bloque todas las relaciones que recorre el serializer, de modo que
+        listar N productos cueste el mismo número de consultas que listar uno.
+        El costo de producción ya está materializado en costo_produccion_cache.
+        """
+        return queryset.select_related('mipyme__sector').prefetch_related(
+            'formulacion__insumo__unidad',
+            'pasodeproduccion_set__proceso',
+            'procesos',
+            'impuestos',
+            'imagenes_adicionales',
+        )
+
+
+class StoreProductoSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the public store feed. Only exposes what a customer sees:
+    no production costs, margins, recipes or internal processes.
+    """
+    mipyme_name = serializers.CharField(source='mipyme.nombre', read_only=True)
+    imagenes_adicionales = ProductoImagenSerializer(many=True, read_only=True)
+    imagen_variantes = VariantesImagenField('imagen')
+    mipyme_portada = serializers.ImageField(source='mipyme.portada', read_only=True)
+    mipyme_portada_variantes = VariantesImagenField('portada', source='mipyme')
+    mipyme_logo = serializers.ImageField(source='mipyme.logo', read_only=True)
+    mipyme_logo_variantes = VariantesImagenField('logo', source='mipyme')
+    mipyme_sector = serializers.CharField(source='mipyme.sector.nombre', read_only=True, default=None)
+    mipyme_descripcion = serializers.CharField(source='mipyme.descripcion', read_only=True)
+    mipyme_direccion = serializers.CharField(source='mipyme.direccion', read_only=True)
+    mipyme_coordenadas = serializers.CharField(source='mipyme.coordenadas', read_only=True)
+    mipyme_telefono = serializers.CharField(source='mipyme.numero_telefono', read_only=True)
+
+    class Meta:
+        model = Producto
+        fields = [
+            'id',
+            'nombre',
+            'descripcion',
+            'imagen',
+            'imagen_variantes',
+            'imagenes_adicionales',
+            'mipyme',
+            'mipyme_name',
+            'mipyme_portada',
+            'mipyme_portada_variantes',
+            'mipyme_logo',
+            'mipyme_logo_variantes',
+            'mipyme_sector',
+            'mipyme_descripcion',
+            'mipyme_direccion',
+            'mipyme_coordenadas',
+            'mipyme_telefono',
+            'precio_venta',
+            'stock_actual',
+            'peso',
+            'tamano_largo',
+            'tamano_ancho',
+            'tamano_alto',
+            'presentacion',
+        ]
+        read_only_fields = fields
+
+    @staticmethod
+    def optimizar_queryset(queryset):
+        """Carga en bloque todo lo que el serializer lee de cada producto."""
+        return queryset.select_related('mipyme__sector').prefetch_related('imagenes_adicionales')
+
+
 from .models import Venta, VentaItem
+from .servicios import registrar_venta, StockInsuficienteError, VentaInvalidaError
 
 
 class VentaItemSerializer(serializers.ModelSerializer):
@@ -132,12 +228,8 @@ class VentaSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         mipyme = self.context['request'].user.mipyme
-        venta = Venta.objects.create(mipyme=mipyme, **validated_data)
-        for item_data in items_data:
-            VentaItem.objects.create(venta=venta, **item_data)
-            # Actualizar stock de producto
-            producto = item_data['producto']
-            producto.stock_actual -= item_data['cantidad']
-            producto.save()
-        venta.calcular_total()
+        try:
+            venta, _ = registrar_venta(mipyme, items_data)
+        except (StockInsuficienteError, VentaInvalidaError) as e:
+            raise serializers.ValidationError({'items': [str(e)]})
         return venta
@@ -0,0 +1,285 @@
+# produccion/servicios.py
+"""
+Operaciones de inventario que deben ejecutarse de forma atómica.
+
+Cada operación bloquea las filas que va a modificar (select_for_update), valida el
+stock con los valores bloqueados y escribe los cambios con un número constante de
+consultas, de modo que dos peticiones concurrentes no puedan vender o consumir
+más stock del que existe.
+"""
+import decimal
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+
+from cuentas.models import Mipyme
+from .models import Producto, Insumo, Formulacion, Venta, VentaItem
+from .cache_tienda import invalidar_tienda
+from .version_datos import invalidar_mipymes
+from .resumen_ventas import acumular_items
+
+
+LARGO_CLAVE_IDEMPOTENCIA = Venta._meta.get_field('clave_idempotencia').max_length
+
+
+class StockInsuficienteError(Exception):
+    """No hay stock suficiente para completar la operación; no se modificó nada."""
+
+
+class VentaInvalidaError(Exception):
+    """La venta no tiene items válidos o incluye productos ajenos a la Mipyme."""
+
+
+def producir_lote(producto, cantidad_unidades):
+    """
+    Descuenta del inventario los insumos de la receta para producir un lote
+    y suma las unidades producidas al stock del producto.
+    Lanza StockInsuficienteError si falta cualquier insumo.
+    """
+    receta = Formulacion.objects.filter(producto=producto).values_list('insumo_id', 'cantidad', 'porcentaje_desperdicio')
+    requeridos = {}
+    for insumo_id, cantidad, porcentaje_desperdicio in receta:
+        cantidad_total = cantidad * cantidad_unidades
+        requeridos[insumo_id] = cantidad_total * (1 + (porcentaje_desperdicio / 100))
+
+    with transaction.atomic():
+        # Bloqueamos los insumos en orden de id para evitar interbloqueos entre lotes
+        insumos = list(
+            Insumo.objects.select_for_update(of=('self',)).select_related('unidad')
+            .filter(pk__in=requeridos).order_by('pk')
+        )
+        for insumo in insumos:
+            requerido = requeridos[insumo.pk]
+            if insumo.stock_actual < requerido:
+                raise StockInsuficienteError(
+                    f"No hay suficiente stock de {insumo.nombre}. "
+                    f"Disponible: {insumo.stock_actual} {insumo.unidad.abreviatura}, "
+                    f"requerido: {requerido:.2f} {insumo.unidad.abreviatura}."
+                )
+
+        for insumo in insumos:
+            insumo.stock_actual -= requeridos[insumo.pk]
+        if insumos:
+            Insumo.objects.bulk_update(insumos, ['stock_actual'])
+
+        Producto.objects.filter(pk=producto.pk).update(stock_actual=F('stock_actual') + cantidad_unidades)
+        invalidar_tienda()
+        invalidar_mipymes([producto.mipyme_id])
+
+    producto.stock_actual += cantidad_unidades
+    return producto
+
+
+def _id_producto(producto):
+    return producto.pk if isinstance(producto, Producto) else int(producto)
+
+
+def _normalizar_items(items):
+    """Convierte los items a (producto_id, cantidad, precio_unitario) y suma las cantidades por producto."""
+    lineas = []
+    requeridos = defaultdict(int)
+    for item in items:
+        try:
+            producto_id = _id_producto(item['producto'])
+            cantidad = int(item['cantidad'])
+            precio_unitario = item.get('precio_unitario')
+            if precio_unitario is not None:
+                precio_unitario = decimal.Decimal(str(precio_unitario))
+        except (KeyError, TypeError, ValueError, decimal.InvalidOperation):
+            raise VentaInvalidaError("Cada item debe indicar 'producto' y 'cantidad' válidos.")
+        if cantidad <= 0:
+            raise VentaInvalidaError("La cantidad de cada producto debe ser mayor que cero.")
+        if precio_unitario is not None and precio_unitario < 0:
+            raise VentaInvalidaError("El precio unitario no puede ser negativo.")
+        lineas.append((producto_id, cantidad, precio_unitario))
+        requeridos[producto_id] += cantidad
+    if not lineas:
+        raise VentaInvalidaError("Debe agregar al menos un producto a la venta.")
+    return lineas, requeridos
+
+
+def _bloquear_productos(mipyme, ids):
+    """Bloquea los productos de la Mipyme en orden de id para evitar interbloqueos."""
+    return {
+        p.pk: p for p in
+        Producto.objects.select_for_update()
+        .filter(mipyme=mipyme, pk__in=ids).order_by('pk')
+        .only('id', 'nombre', 'precio_venta', 'stock_actual', 'costo_produccion_cache')
+    }
+
+
+def _descontar_stock(requeridos, tamano_lote=500):
+    """
+    Descuenta el stock de varios productos con un UPDATE por cada `tamano_lote` productos.
+    La condición stock_actual >= cantidad va en el WHERE: si otra transacción vendió el
+    stock entretanto, alguna fila no se actualiza y se lanza StockInsuficienteError
+    para revertir la transacción completa.
+    """
+    pendientes = list(requeridos.items())
+    for inicio in range(0, len(pendientes), tamano_lote):
+        lote = pendientes[inicio:inicio + tamano_lote]
+        condicion = Q()
+        for producto_id, cantidad in lote:
+            condicion |= Q(pk=producto_id, stock_actual__gte=cantidad)
+        actualizados = Producto.objects.filter(condicion).update(
+            stock_actual=Case(
+                *[When(pk=producto_id, then=F('stock_actual') - cantidad) for producto_id, cantidad in lote],
+                default=F('stock_actual'),
+            )
+        )
+        if actualizados != len(lote):
+            raise StockInsuficienteError("El stock cambió mientras se registraba la venta. Intente de nuevo.")
+    # update() no emite señales: el stock nuevo debe verse en la tienda
+    invalidar_tienda()
+
+
+def _construir_items(lineas, productos):
+    """Crea los VentaItem en memoria (bulk_create no llama a save()) y devuelve (items, total)."""
+    venta_items = []
+    total = decimal.Decimal('0.00')
+    for producto_id, cantidad, precio_unitario in lineas:
+        producto = productos[producto_id]
+        precio = producto.precio_venta if precio_unitario is None else precio_unitario
+        subtotal = decimal.Decimal(cantidad) * precio
+        total += subtotal
+        venta_items.append(VentaItem(
+            producto=producto, cantidad=cantidad, precio_unitario=precio, subtotal=subtotal,
+            costo_unitario=producto.costo_produccion_cache,
+        ))
+    return venta_items, total
+
+
+def registrar_venta(mipyme, items):
+    """
+    Registra una venta de la Mipyme en una sola transacción.
+
+    `items` es una lista de dicts con 'producto' (instancia o id), 'cantidad' y,
+    opcionalmente, 'precio_unitario' (por defecto el precio de venta actual).
+    Devuelve (venta, items_creados). Lanza VentaInvalidaError o StockInsuficienteError
+    sin dejar nada escrito.
+    """
+    lineas, requeridos = _normalizar_items(items)
+
+    with transaction.atomic():
+        productos = _bloquear_productos(mipyme, requeridos)
+        faltantes = set(requeridos) - set(productos)
+        if faltantes:
+            raise VentaInvalidaError(f"Productos no encontrados: {', '.join(str(pk) for pk in sorted(faltantes))}.")
+        for producto_id, cantidad in requeridos.items():
+            producto = productos[producto_id]
+            if cantidad > producto.stock_actual:
+                raise StockInsuficienteError(
+                    f"No hay suficiente stock para {producto.nombre}. "
+                    f"Stock disponible: {producto.stock_actual} unidades."
+                )
+
+        _descontar_stock(requeridos)
+        venta_items, total = _construir_items(lineas, productos)
+        venta = Venta.objects.create(mipyme=mipyme, total=total)
+        for venta_item in venta_items:
+            venta_item.venta = venta
+        VentaItem.objects.bulk_create(venta_items)
+        acumular_items(mipyme, venta_items)
+
+    for producto_id, cantidad in requeridos.items():
+        productos[producto_id].stock_actual -= cantidad
+    return venta, venta_items
+
+
+def registrar_ventas_en_lote(mipyme, ventas):
+    """
+    Registra muchas ventas de la Mipyme (por ejemplo, las acumuladas sin conexión por
+    un punto de venta) con un número de consultas que no depende de cuántas sean.
+
+    Cada venta es un dict con 'items' y, opcionalmente, 'clave_idempotencia'. Las ventas
+    se evalúan en orden: una venta sin stock suficiente se rechaza sin afectar a las
+    demás, y una venta cuya clave ya fue registrada se informa como duplicada.
+    Devuelve un resultado por venta, en el mismo orden.
+    """
+    resultados = [None] * len(ventas)
+    candidatas = []  # (indice, clave, lineas, requeridos)
+    for indice, datos in enumerate(ventas):
+        clave = datos.get('clave_idempotencia') if isinstance(datos, dict) else None
+        clave = str(clave) if clave not in (None, '') else None
+        try:
+            if not isinstance(datos, dict):
+                raise VentaInvalidaError("Cada venta debe ser un objeto con 'items'.")
+            # Una clave recortada podría coincidir con la de otra venta y marcarla como duplicada
+            if clave and len(clave) > LARGO_CLAVE_IDEMPOTENCIA:
+                raise VentaInvalidaError(
+                    f"La clave de idempotencia no puede superar {LARGO_CLAVE_IDEMPOTENCIA} caracteres."
+                )
+            lineas, requeridos = _normalizar_items(datos.get('items') or [])
+        except VentaInvalidaError as e:
+            resultados[indice] = {'indice': indice, 'clave_idempotencia': clave, 'estado': 'rechazada', 'error': str(e)}
+            continue
+        candidatas.append((indice, clave, lineas, requeridos))
+
+    with transaction.atomic():
+        # Bloquear la Mipyme serializa las cargas concurrentes de la misma empresa,
+        # así dos reintentos simultáneos no pueden insertar la misma clave
+        Mipyme.objects.select_for_update().only('id').get(pk=mipyme.pk)
+
+        claves = {clave for _, clave, _, _ in candidatas if clave}
+        existentes = {
+            clave: (venta_id, total) for venta_id, clave, total in
+            Venta.objects.filter(mipyme=mipyme, clave_idempotencia__in=claves)
+            .values_list('id', 'clave_idempotencia', 'total')
+        } if claves else {}
+
+        ids_productos = set()
+        for _, _, _, requeridos in candidatas:
+            ids_productos.update(requeridos)
+        productos = _bloquear_productos(mipyme, ids_productos)
+        disponible = {pk: producto.stock_actual for pk, producto in productos.items()}
+
+        aceptadas = []  # (indice, venta, venta_items)
+        descontar = defaultdict(int)
+        claves_vistas = set()
+        for indice, clave, lineas, requeridos in candidatas:
+            resultado = {'indice': indice, 'clave_idempotencia': clave}
+            resultados[indice] = resultado
+            if clave in existentes:
+                venta_id, total = existentes[clave]
+                resultado.update(estado='duplicada', id=venta_id, total=str(total))
+                continue
+            if clave and clave in claves_vistas:
+                resultado.update(estado='duplicada', error="Clave repetida dentro del mismo lote.")
+                continue
+            faltantes = set(requeridos) - set(productos)
+            if faltantes:
+                resultado.update(estado='rechazada', error=f"Productos no encontrados: {', '.join(str(pk) for pk in sorted(faltantes))}.")
+                continue
+            sin_stock = next((pk for pk, cantidad in requeridos.items() if cantidad > disponible[pk]), None)
+            if sin_stock is not None:
+                producto = productos[sin_stock]
+                resultado.update(
+                    estado='rechazada',
+                    error=f"No hay suficiente stock para {producto.nombre}. Stock disponible: {disponible[sin_stock]} unidades.",
+                )
+                continue
+
+            for producto_id, cantidad in requeridos.items():
+                disponible[producto_id] -= cantidad
+                descontar[producto_id] += cantidad
+            if clave:
+                claves_vistas.add(clave)
+            venta_items, total = _construir_items(lineas, productos)
+            aceptadas.append((indice, Venta(mipyme=mipyme, total=total, clave_idempotencia=clave), venta_items))
+
+        if aceptadas:
+            _descontar_stock(descontar)
+            nuevas = Venta.objects.bulk_create([venta for _, venta, _ in aceptadas], batch_size=500)
+            todos_los_items = []
+            for (indice, _, venta_items), venta in zip(aceptadas, nuevas):
+                for venta_item in venta_items:
+                    venta_item.venta = venta
+                todos_los_items.extend(venta_items)
+                resultados[indice].update(estado='creada', id=venta.pk, total=str(venta.total))
+            VentaItem.objects.bulk_create(todos_los_items, batch_size=1000)
+            acumular_items(mipyme, todos_los_items)
+            # bulk_create no emite post_save de Venta
+            invalidar_mipymes([mipyme.pk])
+
+    return resultados
@@ -1,7 +1,15 @@
 # produccion/signals.py
+from django.db import transaction
+from django.db.models import QuerySet
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Formulacion, PasoDeProduccion, Producto, Impuesto
+from cuentas.models import Mipyme
+from .models import Formulacion, PasoDeProduccion, Producto, ProductoImagen, Impuesto, Insumo, Proceso, Venta, VentaItem
+from .costos import programar_recalculo
+from .cache_tienda import invalidar_tienda
+from .imagenes import actualizar_variantes, campos_de, campos_desactualizados, eliminar_variantes
+from .resumen_ventas import mes_de, programar_reconstruccion
+from .version_datos import invalidar_mipymes
 
 @receiver(post_save, sender=Formulacion)
 @receiver(post_delete, sender=Formulacion)
@@ -10,8 +18,8 @@ def recalcular_precio_producto_por_formulacion(sender, instance, **kwargs):
     Recalcula el precio de venta del producto cuando se guarda o elimina
     un item de la formulación.
     """
-    producto = instance.producto
-    producto.save() # El método save de Producto ya recalcula el precio
+    # El recálculo se agrupa con los demás cambios de la transacción
+    programar_recalculo(productos=[instance.producto_id])
 
 @receiver(post_save, sender=PasoDeProduccion)
 @receiver(post_delete, sender=PasoDeProduccion)
@@ -20,8 +28,35 @@ def recalcular_precio_producto_por_paso(sender, instance, **kwargs):
     Recalcula el precio de venta del producto cuando se guarda o elimina
     un paso de producción.
     """
-    producto = instance.producto
-    producto.save()
+    programar_recalculo(productos=[instance.producto_id])
+
+@receiver(post_save, sender=Insumo)
+def recalcular_precio_producto_por_insumo(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Reprecia los productos que usan el insumo cuando cambia su costo unitario.
+    """
+    if update_fields is not None and 'costo_unitario' not in update_fields:
+        return
+    # Un insumo recién creado todavía no forma parte de ninguna receta, y si solo
+    # cambió el stock o el nombre no hay nada que repreciar
+    cambio = instance.costo_cambio
+    instance._costo_unitario_original = instance.costo_unitario
+    if created or not cambio:
+        return
+    programar_recalculo(insumos=[instance.pk])
+
+@receiver(post_save, sender=Proceso)
+def recalcular_precio_producto_por_proceso(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Reprecia los productos que usan el proceso cuando cambia su costo por hora.
+    """
+    if update_fields is not None and 'costo_por_hora' not in update_fields:
+        return
+    cambio = instance.costo_cambio
+    instance._costo_por_hora_original = instance.costo_por_hora
+    if created or not cambio:
+        return
+    programar_recalculo(procesos=[instance.pk])
 
 @receiver(post_save, sender=Impuesto)
 @receiver(post_delete, sender=Impuesto)
@@ -30,10 +65,116 @@ def recalcular_precio_producto_por_impuesto(sender, instance, **kwargs):
     Recalcula el precio de venta de todos los productos asociados a una MiPyME
     cuando se actualiza o elimina un impuesto.
     """
-    # Como un impuesto puede afectar a muchos productos, iteramos sobre ellos
-    # Esta aproximación puede ser ineficiente si hay miles de productos.
-    # Considerar una actualización en lote si el rendimiento es un problema.
-    if hasattr(instance, 'mipyme'):
-        productos_afectados = Producto.objects.filter(mipyme=instance.mipyme)
-        for producto in productos_afectados:
-            producto.save()
\ No newline at end of file
+    # Un impuesto puede afectar a miles de productos: se recalculan en bloque
+    # con consultas agregadas y un único bulk_update.
+    if instance.mipyme_id:
+        programar_recalculo(mipymes=[instance.mipyme_id])
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=ProductoImagen)
+@receiver(post_delete, sender=ProductoImagen)
+@receiver(post_save, sender=Mipyme)
+def invalidar_catalogo_tienda(sender, instance, **kwargs):
+    """
+    Invalida las páginas cacheadas de la tienda cuando cambia un producto,
+    una imagen o los datos y la visibilidad de una Mipyme.
+    """
+    invalidar_tienda()
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Insumo)
+@receiver(post_delete, sender=Insumo)
+@receiver(post_save, sender=Proceso)
+@receiver(post_delete, sender=Proceso)
+@receiver(post_save, sender=Impuesto)
+@receiver(post_delete, sender=Impuesto)
+@receiver(post_save, sender=Venta)
+@receiver(post_delete, sender=Venta)
+def invalidar_version_datos_mipyme(sender, instance, **kwargs):
+    """
+    Cambia la versión de datos de la Mipyme para que se descarten los cachés
+    derivados de ella (por ejemplo, el contexto del asistente).
+    """
+    invalidar_mipymes([instance.mipyme_id])
+
+@receiver(post_save, sender=Venta)
+@receiver(post_delete, sender=Venta)
+def reconstruir_resumen_por_venta(sender, instance, created=False, **kwargs):
+    """
+    Reconstruye el mes de la venta en el resumen cuando se edita o elimina.
+    Las ventas nuevas ya las suman los servicios con acumular_items().
+    """
+    if not created:
+        programar_reconstruccion([(instance.mipyme_id, mes_de(instance.fecha))])
+
+def _venta_de_item(instance, origin):
+    # Al borrar varios items la venta se busca una sola vez y se guarda en el QuerySet de origen
+    if not isinstance(origin, QuerySet):
+        return instance.venta
+    ventas = origin.__dict__.setdefault('_ventas_resumen', {})
+    if instance.venta_id not in ventas:
+        ventas[instance.venta_id] = Venta.objects.only('mipyme_id', 'fecha').get(pk=instance.venta_id)
+    return ventas[instance.venta_id]
+
+@receiver(post_save, sender=VentaItem)
+@receiver(post_delete, sender=VentaItem)
+def reconstruir_resumen_por_item(sender, instance, origin=None, **kwargs):
+    """
+    Reconstruye el mes de la venta cuando un item se guarda uno por uno (los servicios
+    los crean con bulk_create, que no envía señales) o se elimina.
+    """
+    # En un borrado en cascada no se hace nada por item: la venta reconstruye su mes
+    # en su propia señal, y al borrar un producto o una Mipyme sus filas del resumen
+    # se borran con ellos
+    modelo_origen = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin is not None and modelo_origen is not VentaItem:
+        return
+    venta = _venta_de_item(instance, origin)
+    programar_reconstruccion([(venta.mipyme_id, mes_de(venta.fecha))])
+
+@receiver(post_save, sender=Formulacion)
+@receiver(post_delete, sender=Formulacion)
+@receiver(post_save, sender=PasoDeProduccion)
+@receiver(post_delete, sender=PasoDeProduccion)
+def invalidar_version_datos_por_receta(sender, instance, **kwargs):
+    """
+    Los cambios en la receta o en los pasos de producción también cambian los datos de la Mipyme.
+    """
+    mipyme_id = Producto.objects.filter(pk=instance.producto_id).values_list('mipyme_id', flat=True).first()
+    invalidar_mipymes([mipyme_id])
+
+@receiver(post_save, sender=Mipyme)
+def invalidar_version_datos_empresa(sender, instance, **kwargs):
+    invalidar_mipymes([instance.pk])
+
+@receiver(post_save, sender=Producto)
+@receiver(post_save, sender=ProductoImagen)
+@receiver(post_save, sender=Mipyme)
+def programar_variantes_imagen(sender, instance, **kwargs):
+    """
+    Genera las variantes de las imágenes nuevas o reemplazadas al confirmar la
+    transacción, para no redimensionar imágenes de un guardado que se revierte.
+    """
+    if not campos_desactualizados(instance):
+        return
+
+    def generar():
+        actual = sender.objects.filter(pk=instance.pk).first()
+        if actual is not None and campos_desactualizados(actual):
+            actualizar_variantes(actual)
+            # La tienda cacheada tenía las URLs de los originales
+            invalidar_tienda()
+
+    transaction.on_commit(generar)
+
+@receiver(post_delete, sender=Producto)
+@receiver(post_delete, sender=ProductoImagen)
+@receiver(post_delete, sender=Mipyme)
+def eliminar_variantes_imagen(sender, instance, **kwargs):
+    variantes = instance.variantes_imagen or {}
+    for campo in campos_de(instance):
+        if variantes.get(campo):
+            storage = getattr(instance, campo).storage
+            transaction.on_commit(lambda storage=storage, v=variantes[campo]: eliminar_variantes(storage, v))
@@ -0,0 +1,236 @@
+import json
+import decimal
+
+import pytest
+from django.core.cache import caches
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from produccion.models import Producto, Venta, Insumo, Proceso, Formulacion, PasoDeProduccion, UnidadMedida, Impuesto
+from cuentas.models import Mipyme, SectorEconomico
+
+User = get_user_model()
+
+@pytest.fixture
+def api_mipyme(db):
+    """
+    Usuario con Mipyme y un cliente de API autenticado.
+    """
+    user = User.objects.create_user(username='pos_user', email='pos@test.com', password='password')
+    sector = SectorEconomico.objects.create(nombre='Comercio')
+    mipyme = Mipyme.objects.create(propietario=user, nombre='Tienda POS', sector=sector)
+    user.mipyme = mipyme
+    user.save()
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client, mipyme
+
+@pytest.mark.django_db
+def test_ventas_en_lote_ndjson_es_idempotente(api_mipyme):
+    """
+    La carga masiva registra las ventas válidas, rechaza las que no tienen stock
+    y un reintento con las mismas claves no duplica nada.
+    """
+    client, mipyme = api_mipyme
+    pan = Producto.objects.create(nombre='Pan', mipyme=mipyme, stock_actual=5)
+    Producto.objects.filter(pk=pan.pk).update(precio_venta=decimal.Decimal('1.50'))
+    ventas = [
+        {'clave_idempotencia': 'pos1-1', 'items': [{'producto': pan.pk, 'cantidad': 2}]},
+        {'clave_idempotencia': 'pos1-2', 'items': [{'producto': pan.pk, 'cantidad': 4}]},
+        {'clave_idempotencia': 'pos1-3', 'items': [{'producto': pan.pk, 'cantidad': 3, 'precio_unitario': '1.00'}]},
+    ]
+    cuerpo = '\n'.join(json.dumps(v) for v in ventas)
+    url = reverse('produccion_api:ventas_lote')
+
+    response = client.post(url, cuerpo, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.data['creadas'] == 2
+    assert response.data['rechazadas'] == 1
+    assert [r['estado'] for r in response.data['resultados']] == ['creada', 'rechazada', 'creada']
+    assert response.data['resultados'][0]['total'] == '3.00'
+    assert response.data['resultados'][2]['total'] == '3.00'
+
+    pan.refresh_from_db()
+    assert pan.stock_actual == 0
+
+    # Reintento: las ventas ya registradas vuelven como duplicadas
+    response = client.post(url, {'ventas': ventas}, format='json')
+    assert response.data['duplicadas'] == 2
+    assert Venta.objects.filter(mipyme=mipyme).count() == 2
+
+    # Las claves demasiado largas se rechazan en lugar de recortarse
+    larga = 'pos1-' + 'x' * 64
+    response = client.post(url, {'ventas': [{'clave_idempotencia': larga, 'items': [{'producto': pan.pk, 'cantidad': 1}]}]}, format='json')
+    assert response.data['resultados'][0]['estado'] == 'rechazada'
+    assert response.data['resultados'][0]['clave_idempotencia'] == larga
+
+@pytest.mark.django_db
+def test_catalogo_tienda_cacheado_y_revalidable(api_mipyme, django_capture_on_commit_callbacks, settings):
+    """
+    El catálogo público no expone costos, responde 304 a un ETag vigente
+    y deja de servir la página cacheada cuando cambia un producto.
+    """
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}}
+    _, mipyme = api_mipyme
+    Mipyme.objects.filter(pk=mipyme.pk).update(tienda_visible=True)
+    with django_capture_on_commit_callbacks(execute=True):
+        producto = Producto.objects.create(nombre='Queso', mipyme=mipyme, imagen='productos/queso.jpg', stock_actual=3)
+    client = APIClient()
+    url = reverse('produccion_api:store_products')
+
+    response = client.get(url)
+    assert response.status_code == 200
+    resultado = response.data['results'][0]
+    assert resultado['nombre'] == 'Queso'
+    assert 'costo_de_produccion' not in resultado and 'formulacion' not in resultado
+
+    etag = response['ETag']
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+    # La versión es compartida: otro proceso, con su caché local vacía, da el mismo ETag
+    caches['default'].clear()
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    with django_capture_on_commit_callbacks(execute=True):
+        producto.presentacion = 'Rueda de 1 kg'
+        producto.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data['results'][0]['presentacion'] == 'Rueda de 1 kg'
+
+@pytest.mark.django_db
+def test_lista_productos_sin_consultas_n_mas_1(api_mipyme):
+    """
+    Listar productos cuesta el mismo número de consultas sin importar cuántos haya.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    client, mipyme = api_mipyme
+    unidad = UnidadMedida.objects.create(nombre='Kilogramo', abreviatura='kg')
+    insumo = Insumo.objects.create(nombre='Harina', mipyme=mipyme, unidad=unidad, costo_unitario=1, stock_actual=10)
+    proceso = Proceso.objects.create(nombre='Horneado', mipyme=mipyme, costo_por_hora=6)
+    impuesto = Impuesto.objects.create(mipyme=mipyme, nombre='IVA', porcentaje=15)
+    url = reverse('produccion_api:lista_productos')
+
+    def crear_productos(cantidad, inicio):
+        for i in range(inicio, inicio + cantidad):
+            producto = Producto.objects.create(nombre=f'Producto {i}', mipyme=mipyme)
+            Formulacion.objects.create(producto=producto, insumo=insumo, cantidad=1)
+            PasoDeProduccion.objects.create(producto=producto, proceso=proceso, tiempo_en_minutos=10)
+            producto.impuestos.add(impuesto)
+
+    crear_productos(2, 0)
+    with CaptureQueriesContext(connection) as pocos:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert len(response.data) == 2
+    assert response.data[0]['formulacion'][0]['unidad'] == 'kg'
+
+    crear_productos(8, 2)
+    with CaptureQueriesContext(connection) as muchos:
+        response = client.get(url)
+    assert len(response.data) == 10
+    assert len(muchos) == len(pocos)
+
+@pytest.mark.django_db
+def test_imagen_subida_genera_variantes_livianas(api_mipyme, django_capture_on_commit_callbacks, settings):
+    """
+    Al subir una imagen se generan variantes WebP reducidas junto al original,
+    y la tienda las expone además de la URL del original.
+    """
+    import io
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image
+    from produccion.models import ProductoImagen
+
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}}
+    _, mipyme = api_mipyme
+    Mipyme.objects.filter(pk=mipyme.pk).update(tienda_visible=True)
+
+    buf = io.BytesIO()
+    Image.new('RGB', (3000, 2000), 'orange').save(buf, 'JPEG', quality=95)
+    with django_capture_on_commit_callbacks(execute=True):
+        producto = Producto.objects.create(
+            nombre='Mango', mipyme=mipyme, stock_actual=5,
+            imagen=SimpleUploadedFile('mango.jpg', buf.getvalue(), content_type='image/jpeg'),
+        )
+        ProductoImagen.objects.create(producto=producto, imagen=SimpleUploadedFile('mango2.jpg', buf.getvalue()))
+
+    producto.refresh_from_db()
+    variantes = producto.variantes_imagen['imagen']
+    assert variantes['origen'] == producto.imagen.name
+    storage = producto.imagen.storage
+    with storage.open(variantes['card']) as archivo:
+        card = Image.open(archivo)
+        assert card.format == 'WEBP' and max(card.size) == 480
+    with storage.open(variantes['thumb']) as archivo:
+        assert max(Image.open(archivo).size) == 160
+    assert storage.size(variantes['detalle']) < storage.size(producto.imagen.name) / 5
+
+    resultado = APIClient().get(reverse('produccion_api:store_products')).data['results'][0]
+    assert resultado['imagen_variantes']['thumb'].endswith('__thumb.webp')
+    assert resultado['imagenes_adicionales'][0]['imagen_variantes']['card'].endswith('__card.webp')
+    # Sin logo no hay variantes
+    assert resultado['mipyme_logo_variantes'] is None
+
+    # Al reemplazar la imagen, las variantes anteriores se descartan
+    anterior = variantes['card']
+    with django_capture_on_commit_callbacks(execute=True):
+        producto.imagen = SimpleUploadedFile('mango_nuevo.png', buf.getvalue())
+        producto.save()
+    producto.refresh_from_db()
+    assert producto.variantes_imagen['imagen']['origen'] == producto.imagen.name
+    assert not storage.exists(anterior)
+
+@pytest.mark.django_db
+def test_carga_en_bloque_de_imagenes_respeta_el_limite(api_mipyme, django_capture_on_commit_callbacks, settings):
+    """
+    Las imágenes se suben en paralelo y se insertan en una sola consulta, sin
+    superar el máximo de 20 por producto; las que no caben no quedan en el storage.
+    Las variantes no se generan en la petición sino en el worker.
+    Las subidas directas se confirman solo si el objeto existe y es del producto.
+    """
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from produccion.carga_imagenes import MAX_IMAGENES, agregar_imagenes, generar_variantes_pendientes
+    from produccion.models import ProductoImagen
+
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}}
+    client, mipyme = api_mipyme
+    producto = Producto.objects.create(nombre='Jarra', mipyme=mipyme)
+    ProductoImagen.objects.bulk_create([
+        ProductoImagen(producto=producto, imagen=f'productos/adicionales/previa{i}.jpg', orden=i) for i in range(17)
+    ])
+
+    archivos = [SimpleUploadedFile(f'foto{i}.jpg', b'no es una imagen') for i in range(5)]
+    with django_capture_on_commit_callbacks(execute=True), CaptureQueriesContext(connection) as consultas:
+        creadas, rechazadas = agregar_imagenes(producto, archivos)
+    assert (len(creadas), rechazadas) == (3, 2)
+    assert sum('INSERT INTO "produccion_productoimagen"' in q['sql'] for q in consultas.captured_queries) == 1
+    assert producto.imagenes_adicionales.count() == MAX_IMAGENES
+    assert [imagen.orden for imagen in creadas] == [17, 18, 19]
+    assert all(default_storage.exists(imagen.imagen.name) for imagen in creadas)
+    assert not default_storage.exists('productos/adicionales/foto3.jpg')
+
+    pendientes = ProductoImagen.objects.filter(variantes_pendientes=True)
+    assert [imagen.variantes_imagen for imagen in pendientes] == [{}, {}, {}]
+    assert generar_variantes_pendientes() == 3
+    assert generar_variantes_pendientes() == 0
+    assert [imagen.variantes_imagen for imagen in ProductoImagen.objects.filter(pk__in=[c.pk for c in creadas]).order_by('orden')] == [
+        {'imagen': {'origen': imagen.imagen.name}} for imagen in creadas
+    ]
+
+    url = reverse('produccion_api:confirmar_imagenes', args=[producto.pk])
+    ajena = default_storage.save('productos/adicionales/999/x.jpg', ContentFile(b'x'))
+    assert client.post(url, {'nombres': [ajena]}, format='json').status_code == 400
+
+    ProductoImagen.objects.filter(producto=producto).order_by('-orden')[0].delete()
+    subida = default_storage.save(f'productos/adicionales/{producto.pk}/directa.jpg', ContentFile(b'x'))
+    sobrante = default_storage.save(f'productos/adicionales/{producto.pk}/sobrante.jpg', ContentFile(b'x'))
+    response = client.post(url, {'nombres': [subida, sobrante]}, format='json')
+    assert response.status_code == 201
+    assert response.data['rechazadas'] == [sobrante]
+    assert response.data['imagenes'][0]['imagen'].endswith('directa.jpg')
+    assert not default_storage.exists(sobrante)
@@ -1,6 +1,6 @@
 import pytest
 from django.contrib.auth import get_user_model
-from produccion.models import Insumo, Producto, Proceso, Formulacion, UnidadMedida, Impuesto
+from produccion.models import Insumo, Producto, Proceso, Formulacion, PasoDeProduccion, UnidadMedida, Impuesto
 from cuentas.models import Mipyme, SectorEconomico
 import decimal
 
@@ -168,4 +168,415 @@ def test_impuesto_inactivo_no_afecta_calculo(setup_db):
     precio_con_impuestos = producto.precio_con_impuestos  # 0.75 + (0.75 * 0.15) = 0.8625
 
     assert costo_produccion == decimal.Decimal('0.75')
-    assert precio_con_impuestos == decimal.Decimal('0.8625')  # Solo IVA activo (15%)
\ No newline at end of file
+    assert precio_con_impuestos == decimal.Decimal('0.8625')  # Solo IVA activo (15%)
+
+
+@pytest.mark.django_db
+def test_costos_materializados_se_actualizan(setup_db, django_capture_on_commit_callbacks, monkeypatch):
+    """
+    Prueba que las columnas de costo materializadas sigan a la formulación,
+    a los pasos de producción y a los cambios de costo de insumos y procesos.
+    """
+    from produccion import costos
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+
+    producto = Producto.objects.create(nombre='Pan Materializado', mipyme=mipyme, porcentaje_ganancia=50)
+    recalculos = []
+    recalcular_costos = costos.recalcular_costos
+    monkeypatch.setattr(costos, 'recalcular_costos', lambda productos: recalculos.append(1) or recalcular_costos(productos))
+    with django_capture_on_commit_callbacks(execute=True):
+        Formulacion.objects.create(producto=producto, insumo=insumo, cantidad=2)
+        PasoDeProduccion.objects.create(producto=producto, proceso=proceso, tiempo_en_minutos=30)
+    # Los cambios de la receta se agrupan en un solo recálculo al hacer commit
+    assert len(recalculos) == 1
+
+    producto.refresh_from_db()
+    assert producto.costo_insumos_cache == decimal.Decimal('3.00')  # 2 * 1.5
+    assert producto.costo_procesos_cache == decimal.Decimal('5.00')  # 0.5 h * 10
+    assert producto.costo_produccion_cache == decimal.Decimal('8.00')
+
+    assert producto.precio_venta == decimal.Decimal('12.00')
+
+    with django_capture_on_commit_callbacks(execute=True):
+        insumo.costo_unitario = decimal.Decimal('2.00')
+        insumo.save()
+        proceso.costo_por_hora = decimal.Decimal('20.00')
+        proceso.save()
+
+    producto.refresh_from_db()
+    assert producto.costo_insumos_cache == decimal.Decimal('4.00')
+    assert producto.costo_procesos_cache == decimal.Decimal('10.00')
+    assert producto.costo_produccion_cache == producto.costo_de_produccion
+
+
+@pytest.mark.django_db
+def test_recalculo_sobrevive_savepoint_revertido(setup_db, django_capture_on_commit_callbacks):
+    """
+    Si se revierte un savepoint que ya había agendado el recálculo, los cambios
+    posteriores de la misma transacción se siguen recalculando al hacer commit.
+    """
+    from django.db import transaction
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    producto = Producto.objects.create(nombre='Pan Savepoint', mipyme=mipyme)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        try:
+            with transaction.atomic():
+                Formulacion.objects.create(producto=producto, insumo=insumo, cantidad=5)
+                raise ValueError
+        except ValueError:
+            pass
+        Formulacion.objects.create(producto=producto, insumo=insumo, cantidad=2)
+
+    producto.refresh_from_db()
+    assert producto.costo_insumos_cache == decimal.Decimal('3.00')
+
+
+@pytest.mark.django_db
+def test_recalcular_costos_en_bloque(setup_db):
+    """
+    Prueba que el motor de recálculo use un número constante de consultas
+    y deje los mismos valores que Producto.save().
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from produccion.costos import recalcular_costos
+
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    productos = [Producto.objects.create(nombre=f'Pan {i}', mipyme=mipyme, porcentaje_ganancia=10) for i in range(20)]
+    Formulacion.objects.bulk_create([
+        Formulacion(producto=p, insumo=insumo, cantidad=i + 1, porcentaje_desperdicio=5) for i, p in enumerate(productos)
+    ])
+    PasoDeProduccion.objects.bulk_create([
+        PasoDeProduccion(producto=p, proceso=proceso, tiempo_en_minutos=15) for p in productos
+    ])
+
+    with CaptureQueriesContext(connection) as consultas:
+        actualizados = recalcular_costos(Producto.objects.filter(mipyme=mipyme))
+    assert actualizados == 20
+    assert len(consultas) <= 5
+
+    for producto in Producto.objects.filter(mipyme=mipyme):
+        assert producto.costo_produccion_cache == producto.costo_de_produccion.quantize(decimal.Decimal('0.01'))
+        esperado = Producto.calcular_precio_venta(producto.costo_de_produccion, producto.porcentaje_ganancia)
+        assert producto.precio_venta == esperado.quantize(decimal.Decimal('0.01'))
+
+
+@pytest.mark.django_db
+def test_cambio_de_costo_solo_reprecia_productos_afectados(setup_db, django_capture_on_commit_callbacks):
+    """
+    Prueba que un cambio de costo de insumo solo reprecie los productos que lo usan
+    y que guardar el insumo sin cambiar su costo no dispare recálculos.
+    """
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    azucar = Insumo.objects.create(nombre='Azúcar', mipyme=mipyme, unidad=insumo.unidad, costo_unitario=1, stock_actual=10)
+    with django_capture_on_commit_callbacks(execute=True):
+        pan = Producto.objects.create(nombre='Pan Afectado', mipyme=mipyme)
+        dulce = Producto.objects.create(nombre='Dulce No Afectado', mipyme=mipyme)
+        Formulacion.objects.create(producto=pan, insumo=insumo, cantidad=1)
+        Formulacion.objects.create(producto=dulce, insumo=azucar, cantidad=1)
+
+    from produccion.costos import ejecutar_recalculos_pendientes
+    insumo = Insumo.objects.get(pk=insumo.pk)
+    with django_capture_on_commit_callbacks() as callbacks:
+        insumo.stock_actual = 50
+        insumo.save()
+    assert ejecutar_recalculos_pendientes not in callbacks
+
+    with django_capture_on_commit_callbacks(execute=True):
+        insumo.costo_unitario = decimal.Decimal('3.00')
+        insumo.save()
+
+    pan.refresh_from_db()
+    dulce.refresh_from_db()
+    assert pan.costo_insumos_cache == decimal.Decimal('3.00')
+    assert dulce.costo_insumos_cache == decimal.Decimal('1.00')
+
+@pytest.mark.django_db
+def test_producir_lote_es_atomico(setup_db):
+    """
+    Un lote sin stock suficiente no debe descontar ningún insumo ni sumar unidades.
+    """
+    from produccion.servicios import producir_lote, StockInsuficienteError
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    azucar = Insumo.objects.create(nombre='Azúcar', mipyme=mipyme, unidad=insumo.unidad, costo_unitario=2, stock_actual=1)
+    producto = Producto.objects.create(nombre='Pan dulce', mipyme=mipyme)
+    Formulacion.objects.create(producto=producto, insumo=insumo, cantidad=1)
+    Formulacion.objects.create(producto=producto, insumo=azucar, cantidad=decimal.Decimal('0.5'))
+
+    with pytest.raises(StockInsuficienteError):
+        producir_lote(producto, 10)
+    insumo.refresh_from_db()
+    producto.refresh_from_db()
+    assert insumo.stock_actual == 100
+    assert producto.stock_actual == 0
+
+    producir_lote(producto, 2)
+    insumo.refresh_from_db()
+    azucar.refresh_from_db()
+    producto.refresh_from_db()
+    assert insumo.stock_actual == 98
+    assert azucar.stock_actual == 0
+    assert producto.stock_actual == 2
+
+@pytest.mark.django_db
+def test_registrar_venta_en_bloque(setup_db, django_assert_max_num_queries):
+    """
+    Una venta de 50 líneas se registra con un número constante de consultas
+    y una venta con stock insuficiente no deja nada escrito.
+    """
+    from produccion.models import Venta
+    from produccion.servicios import registrar_venta, StockInsuficienteError
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    productos = [
+        Producto(nombre=f'Producto {i}', mipyme=mipyme, precio_venta=decimal.Decimal('2.50'), stock_actual=10)
+        for i in range(50)
+    ]
+    Producto.objects.bulk_create(productos)
+    items = [{'producto': p, 'cantidad': 2} for p in productos]
+
+    with django_assert_max_num_queries(8):
+        venta, venta_items = registrar_venta(mipyme, items)
+
+    venta.refresh_from_db()
+    assert venta.total == decimal.Decimal('250.00')
+    assert venta.items.count() == 50
+    assert set(Producto.objects.filter(mipyme=mipyme).values_list('stock_actual', flat=True)) == {8}
+
+    with pytest.raises(StockInsuficienteError):
+        registrar_venta(mipyme, [{'producto': productos[0], 'cantidad': 5}, {'producto': productos[1], 'cantidad': 9}])
+    assert Venta.objects.count() == 1
+    assert Producto.objects.get(pk=productos[0].pk).stock_actual == 8
+
+@pytest.mark.django_db
+def test_exportar_excel_productos(setup_db, django_capture_on_commit_callbacks):
+    """
+    El Excel de productos se genera en modo write_only con sus cuatro hojas.
+    """
+    import io
+    from openpyxl import load_workbook
+    from produccion.excel import escribir_excel_productos
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    producto = Producto.objects.create(nombre='Pan Excel', mipyme=mipyme, porcentaje_ganancia=50)
+    with django_capture_on_commit_callbacks(execute=True):
+        Formulacion.objects.create(producto=producto, insumo=insumo, cantidad=2)
+        PasoDeProduccion.objects.create(producto=producto, proceso=proceso, tiempo_en_minutos=30)
+
+    destino = io.BytesIO()
+    escribir_excel_productos(mipyme, destino)
+    wb = load_workbook(io.BytesIO(destino.getvalue()))
+
+    assert wb.sheetnames == ['Productos', 'Formulación', 'Procesos', 'Estándares']
+    fila = [celda.value for celda in wb['Productos'][2]]
+    assert fila[0] == 'Pan Excel'
+    assert fila[5] == 8.0  # costo de producción materializado
+    assert fila[8] == 4.0  # margen calculado en SQL
+    assert wb['Formulación'].max_row == 2
+    assert wb['Procesos']['B2'].value == 'Mezclado'
+
+@pytest.mark.django_db
+def test_exportacion_excel_en_worker_y_vencimiento(setup_db, settings):
+    """
+    La exportación en segundo plano solo se encola en la web; el worker la genera,
+    una nueva reemplaza a la anterior y los archivos vencidos se borran del storage.
+    """
+    import datetime
+    from django.core.files.storage import default_storage
+    from django.utils import timezone
+    from produccion.excel import estado_exportacion, iniciar_exportacion, limpiar_exportaciones_vencidas, procesar_exportaciones
+    from produccion.models import ExportacionExcel
+    settings.STORAGES = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}}
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    Producto.objects.create(nombre='Pan Worker', mipyme=mipyme)
+
+    assert estado_exportacion(mipyme.pk) is None
+    assert iniciar_exportacion(mipyme) == {'estado': 'en_proceso'}
+    iniciar_exportacion(mipyme)
+    assert ExportacionExcel.objects.count() == 1  # no se encola dos veces
+    assert estado_exportacion(mipyme.pk) == {'estado': 'en_proceso'}
+
+    assert procesar_exportaciones() == 1
+    primera = ExportacionExcel.objects.get()
+    assert estado_exportacion(mipyme.pk)['estado'] == 'lista'
+    assert default_storage.exists(primera.ruta)
+
+    iniciar_exportacion(mipyme)
+    assert procesar_exportaciones() == 1
+    assert not default_storage.exists(primera.ruta)
+    segunda = ExportacionExcel.objects.get()
+
+    ExportacionExcel.objects.filter(pk=segunda.pk).update(vence=timezone.now() - datetime.timedelta(seconds=1))
+    assert estado_exportacion(mipyme.pk) is None
+    assert limpiar_exportaciones_vencidas() == 1
+    assert not default_storage.exists(segunda.ruta)
+    assert not ExportacionExcel.objects.exists()
+
+
+@pytest.mark.django_db
+def test_exportar_ventas_csv_y_ndjson(setup_db, client):
+    """
+    Las exportaciones de ventas generan una fila por item y respetan el rango de fechas.
+    """
+    import json
+    from django.urls import reverse
+    from produccion import exportaciones
+    from produccion.servicios import registrar_venta
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    producto = Producto.objects.create(nombre='Pan Exportado', mipyme=mipyme, stock_actual=10)
+    Producto.objects.filter(pk=producto.pk).update(precio_venta=decimal.Decimal('2.00'))
+    registrar_venta(mipyme, [{'producto': producto, 'cantidad': 3}])
+
+    columnas, filas = exportaciones.filas_ventas(mipyme)
+    lineas = ''.join(exportaciones.generar_csv(columnas, filas)).splitlines()
+    assert lineas[0].startswith('venta_id,fecha,total_venta')
+    assert lineas[1].endswith('Pan Exportado,3,2.00,6.00')
+
+    columnas, filas = exportaciones.filas_ventas(mipyme)
+    registro = json.loads(next(exportaciones.generar_ndjson(columnas, filas)))
+    assert registro['subtotal'] == '6.00'
+
+    columnas, filas = exportaciones.filas_ventas(mipyme, desde='2000-01-01', hasta='2000-12-31')
+    assert list(filas) == []
+
+    # Con ASGI la respuesta sigue siendo un iterador (asíncrono) y no una lista armada de antemano
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    async_client = AsyncClient()
+    async_client.force_login(user)
+    response = async_to_sync(async_client.get)(reverse('produccion:exportar_datos', args=['ventas', 'csv']))
+    assert response.is_async
+
+    async def leer(partes):
+        return b''.join([parte async for parte in partes])
+    assert async_to_sync(leer)(response.streaming_content).decode().splitlines() == lineas
+
+    # Una fecha inexistente o mal escrita es un error del cliente, no un 500
+    client.force_login(user)
+    for recurso, fecha in [('ventas', '2024-02-30'), ('resumen', '2024-13-01'), ('ventas', 'ayer')]:
+        url = reverse('produccion:exportar_datos', args=[recurso, 'csv'])
+        assert client.get(url, {'desde': fecha}).status_code == 400
+
+@pytest.mark.django_db
+def test_rentabilidad_datos_json(setup_db, client):
+    """
+    La serie de rentabilidad del panel se entrega en JSON, sin generar imágenes.
+    """
+    from django.urls import reverse
+    from produccion.servicios import registrar_venta
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    producto = Producto.objects.create(nombre='Pan Rentable', mipyme=mipyme, stock_actual=10)
+    Producto.objects.filter(pk=producto.pk).update(precio_venta=decimal.Decimal('100.00'))
+    registrar_venta(mipyme, [{'producto': producto, 'cantidad': 5}])
+
+    client.force_login(user)
+    datos = client.get(reverse('produccion:rentabilidad_datos')).json()
+    assert datos['tiene_datos'] is True
+    assert datos['umbral_ganancias'] == 365.0
+    assert datos['rentabilidades'] == [135.0]  # 500 en ventas - 365 de costos fijos
+    assert datos['tabla'][0]['estado'] == 'neutral'
+
+@pytest.mark.django_db
+def test_resumen_ventas_mensual(setup_db, django_capture_on_commit_callbacks):
+    """
+    El resumen mensual se actualiza con cada venta, la reconstrucción (y la migración
+    que lo llena) da el mismo resultado, y editar o eliminar ventas lo corrige.
+    """
+    import datetime
+    import importlib
+    from django.apps import apps
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from django.utils import timezone
+    from produccion.models import Venta
+    from produccion.models import ResumenVentasMensual
+    from produccion.resumen_ventas import reconstruir_resumen
+    from produccion.servicios import registrar_venta, registrar_ventas_en_lote
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    producto = Producto.objects.create(nombre='Pan Resumen', mipyme=mipyme, stock_actual=20)
+    Producto.objects.filter(pk=producto.pk).update(
+        precio_venta=decimal.Decimal('3.00'), costo_produccion_cache=decimal.Decimal('1.25')
+    )
+
+    registrar_venta(mipyme, [{'producto': producto, 'cantidad': 2}])
+    registrar_ventas_en_lote(mipyme, [{'items': [{'producto': producto.pk, 'cantidad': 4}]}])
+
+    def valores():
+        return list(ResumenVentasMensual.objects.filter(mipyme=mipyme).values_list('producto_id', 'ingresos', 'unidades', 'costo'))
+
+    assert valores() == [(producto.pk, decimal.Decimal('18.00'), 6, decimal.Decimal('7.50'))]
+    incremental = valores()
+    ResumenVentasMensual.objects.all().delete()
+    assert reconstruir_resumen() == 1
+    assert valores() == incremental
+
+    ResumenVentasMensual.objects.all().delete()
+    migracion = importlib.import_module('produccion.migrations.0020_resumen_ventas_mensual')
+    migracion.calcular_resumen_existente(apps, None)
+    assert valores() == incremental
+
+    # Editar un item o eliminar una venta (por ejemplo, desde el admin) reconstruye el resumen
+    venta_lote = Venta.objects.filter(mipyme=mipyme).latest('id')
+    with django_capture_on_commit_callbacks(execute=True):
+        item = venta_lote.items.get()
+        item.cantidad = 1
+        item.save()
+    assert valores() == [(producto.pk, decimal.Decimal('9.00'), 3, decimal.Decimal('3.75'))]
+    with django_capture_on_commit_callbacks(execute=True):
+        venta_lote.delete()
+    assert valores() == [(producto.pk, decimal.Decimal('6.00'), 2, decimal.Decimal('2.50'))]
+
+    # Solo se reconstruye el mes afectado: la fila de otro mes no se vuelve a calcular
+    antigua, _ = registrar_venta(mipyme, [{'producto': producto, 'cantidad': 1}])
+    Venta.objects.filter(pk=antigua.pk).update(fecha=timezone.make_aware(datetime.datetime(2020, 1, 15, 12)))
+    reconstruir_resumen()
+    ResumenVentasMensual.objects.filter(mipyme=mipyme, mes=datetime.date(2020, 1, 1)).update(unidades=99)
+    with django_capture_on_commit_callbacks(execute=True):
+        item = Venta.objects.filter(mipyme=mipyme).exclude(pk=antigua.pk).get().items.get()
+        item.cantidad = 3
+        item.save()
+    assert sorted(ResumenVentasMensual.objects.filter(mipyme=mipyme).values_list('unidades', flat=True)) == [3, 99]
+
+    # Borrar una venta en cascada cuesta lo mismo con uno o con muchos items
+    def consultas_al_borrar(cantidad_items):
+        registrar_ventas_en_lote(mipyme, [{'items': [{'producto': producto.pk, 'cantidad': 1}] * cantidad_items}])
+        venta = Venta.objects.filter(mipyme=mipyme).latest('id')
+        with CaptureQueriesContext(connection) as consultas, django_capture_on_commit_callbacks(execute=True):
+            venta.delete()
+        return len(consultas)
+
+    assert consultas_al_borrar(1) == consultas_al_borrar(4)
+
+@pytest.mark.django_db
+def test_historial_ventas_paginado_por_cursor(setup_db, client):
+    """
+    Recorrer el historial con el cursor devuelve cada venta una sola vez y en orden.
+    """
+    from produccion.models import Venta
+    from produccion.historial import filtrar_ventas, pagina_ventas
+    from produccion.servicios import registrar_ventas_en_lote
+    user, mipyme, insumo, proceso, unidad_un = setup_db
+    pan = Producto.objects.create(nombre='Pan Historial', mipyme=mipyme, stock_actual=100)
+    torta = Producto.objects.create(nombre='Torta Historial', mipyme=mipyme, stock_actual=100)
+    registrar_ventas_en_lote(mipyme, [
+        {'items': [{'producto': pan.pk if i % 2 else torta.pk, 'cantidad': 1}]} for i in range(7)
+    ])
+
+    vistas, cursor = [], None
+    while True:
+        pagina, cursor = pagina_ventas(filtrar_ventas(mipyme), cursor=cursor, tamano=3)
+        vistas.extend(v.id for v in pagina)
+        if not cursor:
+            break
+    esperadas = list(Venta.objects.filter(mipyme=mipyme).order_by('-fecha', 'id').values_list('id', flat=True))
+    assert vistas == esperadas
+
+    pagina, cursor = pagina_ventas(filtrar_ventas(mipyme, producto=pan.pk), tamano=10)
+    assert len(pagina) == 3 and cursor is None
+    assert filtrar_ventas(mipyme, desde='2000-01-01', hasta='2000-01-31').count() == 0
+
+    # Fechas inválidas en los filtros: 400 en lugar de un error del servidor
+    from django.urls import reverse
+    client.force_login(user)
+    assert client.get(reverse('produccion:historial_ventas'), {'hasta': '2024-02-30'}).status_code == 400
+    response = client.get(reverse('produccion:historial_ventas_datos'), {'desde': '2024-02-30'})
+    assert response.status_code == 400 and 'error' in response.json()
@@ -11,8 +11,12 @@ urlpatterns = [
     # se ejecutará la vista 'panel_produccion'.
     # El 'name' nos permite referirnos a esta URL fácilmente en las plantillas y vistas.
     path('', views.panel_produccion, name='panel'),
+    path('panel/rentabilidad/', views.rentabilidad_datos, name='rentabilidad_datos'),
+    path('panel/rentabilidad.png', views.rentabilidad_grafica, name='rentabilidad_grafica'),
     path('productos/', views.lista_productos, name='lista_productos'),
     path('productos/exportar-excel/', views.exportar_productos_excel, name='exportar_productos_excel'),
+    path('productos/exportar-excel/estado/', views.estado_exportacion_excel, name='estado_exportacion_excel'),
+    path('exportar/<slug:recurso>/<slug:formato>/', views.exportar_datos, name='exportar_datos'),
     path('productos/nuevo/', views.crear_producto, name='crear_producto'),
     path('productos/<int:producto_id>/', views.detalle_producto, name='detalle_producto'),
     path('productos/<int:producto_id>/calculadora/', views.calculadora_lotes, name='calculadora_lotes'),
@@ -49,6 +53,7 @@ urlpatterns = [
     # --- VENTAS / FACTURACIÓN ---
     path('ventas/registrar/', views.registrar_venta, name='registrar_venta'),
     path('ventas/historial/', views.historial_ventas, name='historial_ventas'),
+    path('ventas/historial/datos/', views.historial_ventas_datos, name='historial_ventas_datos'),
     # --- CONFIGURACIÓN ---
     path('configuracion/', views.configuracion, name='configuracion'),
     path('configuracion/cambiar-contrasena/', views.cambiar_contrasena, name='cambiar_contrasena'),
@@ -0,0 +1,42 @@
+# produccion/version_datos.py
+"""
+Versión de los datos de producción y ventas de cada Mipyme.
+
+Los módulos que cachean información derivada de una Mipyme (por ejemplo, el
+contexto del asistente) incluyen esta versión en sus claves. Cualquier cambio en
+productos, recetas, insumos, procesos, impuestos o ventas llama a invalidar_mipymes(),
+que cambia la versión al confirmar la transacción y deja obsoletas esas entradas.
+La versión vive en la caché 'compartida' para que los cambios hechos en otro
+proceso (worker, comandos) también invaliden las entradas de este.
+"""
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+
+
+def _clave(mipyme_id):
+    return f'mipyme:version_datos:{mipyme_id}'
+
+
+def version_mipyme(mipyme_id):
+    """Devuelve la versión actual de los datos de la Mipyme."""
+    versiones = caches['compartida']
+    version = versiones.get(_clave(mipyme_id))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not versiones.add(_clave(mipyme_id), version, None):
+            version = versiones.get(_clave(mipyme_id)) or version
+    return version
+
+
+def invalidar_mipymes(mipyme_ids):
+    """Cambia la versión de datos de las Mipymes indicadas cuando se confirma la transacción."""
+    ids = {mipyme_id for mipyme_id in mipyme_ids if mipyme_id}
+    if not ids:
+        return
+
+    def _invalidar():
+        caches['compartida'].set_many({_clave(mipyme_id): uuid.uuid4().hex for mipyme_id in ids}, None)
+
+    transaction.on_commit(_invalidar)
@@ -2,20 +2,22 @@
 
 import decimal
 import json
-import io
-import base64
 from datetime import datetime, timedelta
-from django.db.models import Sum
-from openpyxl import Workbook
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, FileResponse, StreamingHttpResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
-from .models import Producto, Insumo, Formulacion, PasoDeProduccion, Proceso, Venta, VentaItem, Impuesto, ProductoImagen
+from .models import Producto, Insumo, Formulacion, PasoDeProduccion, Proceso, VentaItem, Impuesto, ProductoImagen
 from .forms import ProductoForm, FormulacionForm, InsumoForm, FormulacionUpdateForm, ProcesoForm, PasoUpdateForm, PasoDeProduccionForm, CalculadoraLotesForm, VentaItemFormSet, ImpuestoForm
+from . import exportaciones
+from .historial import filtrar_ventas, pagina_ventas, venta_a_dict
+from .rentabilidad import serie_rentabilidad, grafica_rentabilidad_png
+from .excel import generar_excel_temporal, iniciar_exportacion, estado_exportacion, nombre_archivo, CONTENT_TYPE_XLSX
+from .carga_imagenes import agregar_imagenes, LimiteImagenesError, MAX_IMAGENES
+from .servicios import producir_lote, registrar_venta as registrar_venta_servicio, StockInsuficienteError, VentaInvalidaError
 from cuentas.decorators import rol_requerido, mipyme_requerida
+from mipymes_project.streaming import por_partes
 from cuentas.forms import CambiarContrasenaForm, ActualizarPerfilForm, ConfigurarAvatarForm, EditarInformacionEmpresaForm, ConfigurarImagenesEmpresaForm, CambiarSectorEconomicoForm, ConfigurarParametrosProduccionForm
-from cuentas.models import Usuario
 from django.contrib.auth import update_session_auth_hash
 from django.contrib import messages
 
@@ -26,133 +28,38 @@ def panel_produccion(request):
     """
     Vista principal de la aplicación 'produccion'.
     Solo accesible para usuarios con una Mipyme asociada.
+    La gráfica de rentabilidad se dibuja en el navegador con los datos de rentabilidad_datos.
     """
     # Gracias al decorador, ahora podemos estar SEGUROS de que
     # request.user.mipyme existe y no es None.
 
     mipyme = request.user.mipyme
 
-    # Calcular costos mensuales para umbrales
-    num_usuarios = Usuario.objects.filter(mipyme=mipyme).count()
-    costo_admin = decimal.Decimal(365)  # Salario admin
-    costo_empleados = decimal.Decimal(350) * (num_usuarios - 1) if num_usuarios > 1 else decimal.Decimal(0)
-    costos_mensuales = costo_admin + costo_empleados
-    umbral_perdidas = -float(costos_mensuales)  # Línea roja para pérdidas
-    umbral_ganancias = float(costos_mensuales)  # Línea verde para ganancias
-
-    # Obtener ventas agrupadas por mes, últimos 12 meses con datos
-    from django.db.models.functions import TruncMonth
-    ventas_por_mes = Venta.objects.filter(mipyme=mipyme).annotate(
-        mes=TruncMonth('fecha')
-    ).values('mes').annotate(
-        total_ventas=Sum('total')
-    ).order_by('-mes')[:12]
-
-    meses = []
-    rentabilidades = []
-
-    for venta_mes in reversed(list(ventas_por_mes)):
-        mes = venta_mes['mes']
-        ventas_mes = venta_mes['total_ventas'] or decimal.Decimal(0)
-        rentabilidad = float(ventas_mes - costos_mensuales)
-
-        meses.append(mes.strftime('%b %Y'))
-        rentabilidades.append(rentabilidad)
-
-    # Si no hay ventas, mostrar mensaje o gráfica vacía
-    if not meses:
-        meses = ['Sin datos']
-        rentabilidades = [0]
-
-    # Preparar datos para tabla alternativa
-    datos_tabla = []
-    for i, mes in enumerate(meses):
-        datos_tabla.append({
-            'mes': mes,
-            'rentabilidad': rentabilidades[i] if i < len(rentabilidades) else 0,
-            'estado': 'ganancia' if rentabilidades[i] > umbral_ganancias else ('perdida' if rentabilidades[i] < umbral_perdidas else 'neutral')
-        })
-    
-    # Intentar generar gráfica con matplotlib
-    grafica_generada = False
-    error_grafica = None
-    
-    try:
-        import matplotlib
-        matplotlib.use('Agg')  # Usar backend no interactivo
-        import matplotlib.pyplot as plt
-        import numpy as np
-
-        # Generar gráfica
-        rentabilidades_array = np.array(rentabilidades)
-        plt.figure(figsize=(10, 5))
-        plt.plot(meses, rentabilidades, marker='o', color='blue', linewidth=2, label='Rentabilidad')
-        plt.axhline(y=umbral_perdidas, color='red', linestyle='--', linewidth=2, label=f'Umbral Pérdidas (${umbral_perdidas:.0f})')
-        plt.axhline(y=umbral_ganancias, color='green', linestyle='--', linewidth=2, label=f'Umbral Ganancias (${umbral_ganancias:.0f})')
-        plt.fill_between(meses, umbral_perdidas, rentabilidades_array, where=(rentabilidades_array < umbral_perdidas), color='red', alpha=0.3)
-        plt.fill_between(meses, umbral_ganancias, rentabilidades_array, where=(rentabilidades_array > umbral_ganancias), color='green', alpha=0.3)
-        plt.title('Rentabilidad del Negocio - Últimos 12 Meses')
-        plt.xlabel('Mes')
-        plt.ylabel('Rentabilidad ($)')
-        plt.xticks(rotation=45)
-        plt.grid(True)
-        plt.legend()
-        plt.tight_layout()
-
-        # Convertir a base64
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        image_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        buf.close()
-        plt.close()
-        
-        grafica_generada = True
-        grafica_rentabilidad = image_base64
-        
-    except ImportError as e:
-        # Si matplotlib no está disponible o hay problemas con librerías del sistema
-        error_msg = str(e)
-        if 'libstdc++' in error_msg:
-            error_grafica = "No se puede generar la gráfica debido a librerías del sistema faltantes (libstdc++). Se muestra tabla de datos como alternativa."
-        else:
-            error_grafica = f"No se pudo cargar matplotlib: {error_msg}"
-        grafica_rentabilidad = None
-        
-    except Exception as e:
-        # Capturar cualquier otro error durante la generación de la gráfica
-        error_grafica = f"Error al generar la gráfica: {str(e)}"
-        grafica_rentabilidad = None
-    
-    # Preparar datos para Chart.js
-    chart_data = {
-        'labels': meses,
-        'datasets': [{
-            'label': 'Rentabilidad ($)',
-            'data': rentabilidades,
-            'borderColor': 'rgba(75, 192, 192, 1)',
-            'backgroundColor': 'rgba(75, 192, 192, 0.2)',
-            'borderWidth': 2,
-            'pointBackgroundColor': 'rgba(75, 192, 192, 1)',
-            'pointRadius': 4,
-            'tension': 0.1
-        }]
-    }
-
-    # Construir contexto
     contexto = {
         'titulo': 'Panel de Producción',
         'usuario': request.user,
         'nombrepine': mipyme.nombre,
-        'chart_data': json.dumps(chart_data),
-        'error_grafica': error_grafica,
-        'datos_tabla': datos_tabla,
-        'umbral_perdidas': umbral_perdidas,
-        'umbral_ganancias': umbral_ganancias,
-        'tiene_datos': len(datos_tabla) > 0 and datos_tabla[0]['mes'] != 'Sin datos'
     }
 
     return render(request, 'produccion/panel.html', contexto)
+
+
+@login_required
+@mipyme_requerida
+def rentabilidad_datos(request):
+    """
+    Devuelve en JSON la serie mensual de rentabilidad del panel y sus umbrales.
+    """
+    return JsonResponse(serie_rentabilidad(request.user.mipyme))
+
+
+@login_required
+@mipyme_requerida
+def rentabilidad_grafica(request):
+    """
+    Imagen PNG de la rentabilidad (para correos o PDF), cacheada por Mipyme y mes.
+    """
+    return HttpResponse(grafica_rentabilidad_png(request.user.mipyme), content_type='image/png')
 @login_required
 def lista_productos(request):
     """
@@ -175,6 +82,20 @@ def lista_productos(request):
     return render(request, 'produccion/lista_productos.html', contexto)
 
 
+def _agregar_imagenes_adicionales(request, producto):
+    """Sube las imágenes adicionales del formulario en bloque; devuelve cuántas se agregaron."""
+    imagenes = request.FILES.getlist('imagenes_adicionales')
+    if not imagenes:
+        return 0
+    try:
+        agregadas, rechazadas = agregar_imagenes(producto, imagenes)
+    except LimiteImagenesError:
+        agregadas, rechazadas = [], len(imagenes)
+    if rechazadas:
+        messages.warning(request, f'Se alcanzó el límite de {MAX_IMAGENES} imágenes. Solo se agregaron {len(agregadas)} imágenes.')
+    return len(agregadas)
+
+
 @login_required
 @mipyme_requerida
 @rol_requerido('ADMIN', 'EDITOR')
@@ -204,17 +125,7 @@ def crear_producto(request):
             nuevo_producto.save()
 
             # --- PROCESAR IMÁGENES ADICIONALES ---
-            imagenes = request.FILES.getlist('imagenes_adicionales')
-            if imagenes:
-                # Limitar a 20 imágenes en total (incluyendo la principal si se cuenta)
-                # Aquí solo contamos las adicionales para simplificar, o validamos el total
-                for i, imagen in enumerate(imagenes):
-                    if i >= 20: break # Límite de seguridad
-                    ProductoImagen.objects.create(
-                        producto=nuevo_producto,
-                        imagen=imagen,
-                        orden=i
-                    )
+            _agregar_imagenes_adicionales(request, nuevo_producto)
 
             # Redirige al usuario a la lista de productos para que vea el nuevo item
             return redirect('produccion:lista_productos')
@@ -404,17 +315,7 @@ def editar_producto(request, producto_id):
             producto_editado.save()
 
             # --- PROCESAR IMÁGENES ADICIONALES ---
-            imagenes = request.FILES.getlist('imagenes_adicionales')
-            if imagenes:
-                # Contar cuántas ya tiene
-                count_existentes = producto.imagenes_adicionales.count()
-                for i, imagen in enumerate(imagenes):
-                    if count_existentes + i >= 20: break # Límite
-                    ProductoImagen.objects.create(
-                        producto=producto,
-                        imagen=imagen,
-                        orden=count_existentes + i
-                    )
+            _agregar_imagenes_adicionales(request, producto)
 
             return redirect('produccion:lista_productos') # Redirigimos a la lista de productos
     else:
@@ -685,10 +586,8 @@ def calculadora_lotes(request, producto_id):
 
             # Calcular insumos para el lote
             resultados = []
-            insumos_a_restar = []
-            for item in producto.formulacion.all():
+            for item in producto.formulacion.select_related('insumo__unidad'):
                 cantidad_total = item.cantidad * cantidad_unidades
-                cantidad_con_desperdicio = cantidad_total * (1 + (item.porcentaje_desperdicio / 100))
                 costo_unitario = item.insumo.costo_unitario
                 costo_con_desperdicio = cantidad_total * costo_unitario * (1 + (item.porcentaje_desperdicio / 100))
                 costo_total_insumos += costo_con_desperdicio
@@ -699,13 +598,9 @@ def calculadora_lotes(request, producto_id):
                     'cantidad_total': cantidad_total,
                     'costo': costo_con_desperdicio,
                 })
-                insumos_a_restar.append({
-                    'insumo': item.insumo,
-                    'cantidad_a_restar': cantidad_con_desperdicio,
-                })
 
             # Calcular procesos para el lote
-            for paso in producto.pasodeproduccion_set.all():
+            for paso in producto.pasodeproduccion_set.select_related('proceso'):
                 costo_proceso_lote = (decimal.Decimal(paso.tiempo_en_minutos) / 60) * paso.proceso.costo_por_hora * cantidad_unidades
                 costo_total_procesos += costo_proceso_lote
 
@@ -715,24 +610,16 @@ def calculadora_lotes(request, producto_id):
 
             # Si se solicita producir el lote
             if 'producir_lote' in request.POST:
-                # Validar stock de insumos
-                for insumo_data in insumos_a_restar:
-                    if insumo_data['insumo'].stock_actual < insumo_data['cantidad_a_restar']:
-                        error_stock = f"No hay suficiente stock de {insumo_data['insumo'].nombre}. Disponible: {insumo_data['insumo'].stock_actual} {insumo_data['insumo'].unidad.abreviatura}, requerido: {insumo_data['cantidad_a_restar']:.2f} {insumo_data['insumo'].unidad.abreviatura}."
-                        break
+                # La validación de stock y los descuentos se hacen en una sola transacción
+                # con los insumos bloqueados, para que dos lotes simultáneos no consuman
+                # el mismo stock
+                try:
+                    producir_lote(producto, cantidad_unidades)
+                except StockInsuficienteError as e:
+                    error_stock = str(e)
                 else:
-                    # Restar stock de insumos
-                    for insumo_data in insumos_a_restar:
-                        insumo_data['insumo'].stock_actual -= insumo_data['cantidad_a_restar']
-                        insumo_data['insumo'].save(update_fields=['stock_actual'])
-
-                    # Aumentar stock del producto
-                    producto.stock_actual += cantidad_unidades
-                    producto.save(update_fields=['stock_actual'])
-
                     produccion_exitosa = True
                     # Redirigir con mensaje de éxito
-                    from django.contrib import messages
                     messages.success(request, f'Se produjo exitosamente {cantidad_unidades} unidades de {producto.nombre}.')
                     return redirect('produccion:detalle_producto', producto_id=producto.id)
     else:
@@ -786,63 +673,33 @@ def registrar_venta(request):
             queryset=VentaItem.objects.none()
         )
         if formset.is_valid():
-            venta = Venta.objects.create(mipyme=request.user.mipyme)
-            items_data = []
-            total_items = 0
-
-            for form in formset:
-                if not form.cleaned_data or form.cleaned_data.get('DELETE'):
-                    continue
-
-                producto = form.cleaned_data['producto']
-                cantidad = form.cleaned_data['cantidad']
-
-                # Validación de stock por seguridad (además del clean del form)
-                if cantidad > producto.stock_actual:
-                    venta.delete()
-                    contexto = {
-                        'formset': formset,
-                        'titulo': 'Registrar Venta',
-                        'nombrepine': request.user.mipyme.nombre,
-                        'productos_json': productos_json,
-                        'error': f"No hay suficiente stock para {producto.nombre}. Stock disponible: {producto.stock_actual} unidades."
-                    }
-                    return render(request, 'produccion/registrar_venta.html', contexto)
-
-                # Crear item con precio actual del producto
-                item = VentaItem(
-                    venta=venta,
-                    producto=producto,
-                    cantidad=cantidad,
-                    precio_unitario=producto.precio_venta
-                )
-                item.save()
-
-                # Restar del stock del producto
-                producto.stock_actual -= cantidad
-                producto.save(update_fields=['stock_actual'])
-
-                items_data.append({
-                    'producto': producto.nombre,
-                    'cantidad': cantidad,
-                    'precio_unitario': float(item.precio_unitario),
-                    'subtotal': float(item.subtotal),
-                })
-                total_items += 1
-
-            if total_items == 0:
-                venta.delete()
+            items = [
+                {'producto': form.cleaned_data['producto'], 'cantidad': form.cleaned_data['cantidad']}
+                for form in formset
+                if form.cleaned_data and not form.cleaned_data.get('DELETE')
+            ]
+            # La venta, sus items y el descuento de stock se escriben en una sola transacción
+            try:
+                venta, venta_items = registrar_venta_servicio(request.user.mipyme, items)
+            except (StockInsuficienteError, VentaInvalidaError) as e:
                 contexto = {
                     'formset': formset,
                     'titulo': 'Registrar Venta',
                     'nombrepine': request.user.mipyme.nombre,
                     'productos_json': productos_json,
-                    'error': 'Debe agregar al menos un producto a la venta.'
+                    'error': str(e)
                 }
                 return render(request, 'produccion/registrar_venta.html', contexto)
 
-            # Calcular total de la venta
-            venta.calcular_total()
+            items_data = [
+                {
+                    'producto': item.producto.nombre,
+                    'cantidad': item.cantidad,
+                    'precio_unitario': float(item.precio_unitario),
+                    'subtotal': float(item.subtotal),
+                }
+                for item in venta_items
+            ]
 
             venta_dict = {
                 'id': venta.id,
@@ -887,15 +744,44 @@ def registrar_venta(request):
 def historial_ventas(request):
     """
     Lista el historial de ventas de la MIPYME.
+    Solo se carga la primera página; las siguientes se piden a historial_ventas_datos
+    al desplazarse, con los mismos filtros (desde, hasta, producto).
     """
-    ventas = Venta.objects.filter(mipyme=request.user.mipyme).prefetch_related('items__producto').order_by('-fecha')
+    mipyme = request.user.mipyme
+    filtros = {clave: request.GET.get(clave, '') for clave in ('desde', 'hasta', 'producto')}
+    try:
+        ventas, siguiente = pagina_ventas(filtrar_ventas(mipyme, **filtros))
+    except exportaciones.FechaInvalidaError as e:
+        return HttpResponseBadRequest(str(e))
     contexto = {
         'ventas': ventas,
+        'siguiente': siguiente,
+        'filtros': filtros,
+        'productos': Producto.objects.filter(mipyme=mipyme).order_by('nombre').values('id', 'nombre'),
         'titulo': 'Historial de Ventas',
-        'nombrepine': request.user.mipyme.nombre,
+        'nombrepine': mipyme.nombre,
     }
     return render(request, 'produccion/historial_ventas.html', contexto)
 
+
+@login_required
+@mipyme_requerida
+def historial_ventas_datos(request):
+    """
+    Página siguiente del historial de ventas en JSON, para el desplazamiento infinito.
+    """
+    try:
+        ventas = filtrar_ventas(
+            request.user.mipyme,
+            desde=request.GET.get('desde'),
+            hasta=request.GET.get('hasta'),
+            producto=request.GET.get('producto'),
+        )
+    except exportaciones.FechaInvalidaError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    ventas, siguiente = pagina_ventas(ventas, cursor=request.GET.get('cursor'))
+    return JsonResponse({'ventas': [venta_a_dict(v) for v in ventas], 'siguiente': siguiente})
+
 # --- CONFIGURACIÓN ---
 
 @login_required
@@ -1104,106 +990,53 @@ def exportar_productos_excel(request):
     """
     Exporta todos los productos de la Mipyme del usuario a un archivo Excel,
     incluyendo datos relevantes y relacionados.
+    El archivo se genera en disco y se envía por partes. Con ?segundo_plano=1 se
+    encola para que lo genere el worker y lo guarde en el storage; el enlace se
+    consulta en estado_exportacion_excel.
     """
     mipyme = request.user.mipyme
-    productos = Producto.objects.filter(mipyme=mipyme).prefetch_related('formulacion__insumo', 'pasodeproduccion_set__proceso', 'estándares').order_by('nombre')
-
-    # Crear workbook
-    wb = Workbook()
-    ws_productos = wb.active
-    ws_productos.title = "Productos"
-
-    # Hoja de Productos
-    headers_productos = [
-        'Nombre', 'Descripción', 'Precio Venta', 'Porcentaje Ganancia', 'Stock Actual',
-        'Costo Producción', 'Costo Insumos', 'Costo Procesos', 'Margen Ganancia',
-        'Peso (kg)', 'Largo (cm)', 'Ancho (cm)', 'Alto (cm)', 'Presentación'
-    ]
-    ws_productos.append(headers_productos)
-
-    for producto in productos:
-        row = [
-            producto.nombre,
-            producto.descripcion or '',
-            float(producto.precio_venta) if producto.precio_venta else 0,
-            float(producto.porcentaje_ganancia) if producto.porcentaje_ganancia else 0,
-            producto.stock_actual,
-            float(producto.costo_de_produccion),
-            float(producto.costo_insumos),
-            float(producto.costo_procesos),
-            float(producto.margen_de_ganancia),
-            float(producto.peso) if producto.peso else '',
-            float(producto.tamano_largo) if producto.tamano_largo else '',
-            float(producto.tamano_ancho) if producto.tamano_ancho else '',
-            float(producto.tamano_alto) if producto.tamano_alto else '',
-            producto.presentacion or ''
-        ]
-        ws_productos.append(row)
-
-    # Hoja de Formulación (Insumos)
-    ws_formulacion = wb.create_sheet("Formulación")
-    headers_formulacion = ['Producto', 'Insumo', 'Cantidad', 'Unidad', 'Costo Unitario', 'Porcentaje Desperdicio']
-    ws_formulacion.append(headers_formulacion)
-
-    for producto in productos:
-        for item in producto.formulacion.all():
-            row = [
-                producto.nombre,
-                item.insumo.nombre,
-                float(item.cantidad),
-                item.insumo.unidad.abreviatura,
-                float(item.insumo.costo_unitario),
-                float(item.porcentaje_desperdicio)
-            ]
-            ws_formulacion.append(row)
-
-    # Hoja de Procesos
-    ws_procesos = wb.create_sheet("Procesos")
-    headers_procesos = ['Producto', 'Proceso', 'Tiempo (minutos)', 'Costo por Hora']
-    ws_procesos.append(headers_procesos)
-
-    for producto in productos:
-        for paso in producto.pasodeproduccion_set.all():
-            row = [
-                producto.nombre,
-                paso.proceso.nombre,
-                paso.tiempo_en_minutos,
-                float(paso.proceso.costo_por_hora)
-            ]
-            ws_procesos.append(row)
-
-    # Hoja de Estándares (si existen)
-    ws_estandares = wb.create_sheet("Estándares")
-    headers_estandares = [
-        'Producto', 'Peso Mín', 'Peso Máx', 'Largo Mín', 'Largo Máx',
-        'Ancho Mín', 'Ancho Máx', 'Alto Mín', 'Alto Máx', 'Presentación Estándar'
-    ]
-    ws_estandares.append(headers_estandares)
-
-    for producto in productos:
-        if hasattr(producto, 'estándares') and producto.estándares:
-            est = producto.estándares
-            row = [
-                producto.nombre,
-                float(est.peso_min) if est.peso_min else '',
-                float(est.peso_max) if est.peso_max else '',
-                float(est.tamano_largo_min) if est.tamano_largo_min else '',
-                float(est.tamano_largo_max) if est.tamano_largo_max else '',
-                float(est.tamano_ancho_min) if est.tamano_ancho_min else '',
-                float(est.tamano_ancho_max) if est.tamano_ancho_max else '',
-                float(est.tamano_alto_min) if est.tamano_alto_min else '',
-                float(est.tamano_alto_max) if est.tamano_alto_max else '',
-                est.presentacion_estandar or ''
-            ]
-            ws_estandares.append(row)
+    if request.GET.get('segundo_plano'):
+        return JsonResponse(iniciar_exportacion(mipyme))
+
+    archivo = generar_excel_temporal(mipyme)
+    # FileResponse envía el archivo por bloques y lo cierra (y lo borra) al terminar
+    return por_partes(request, FileResponse(
+        archivo, as_attachment=True, filename=nombre_archivo(mipyme), content_type=CONTENT_TYPE_XLSX
+    ))
+
+
+@login_required
+@mipyme_requerida
+def estado_exportacion_excel(request):
+    """
+    Devuelve en JSON el estado de la última exportación en segundo plano
+    y, cuando terminó, el enlace de descarga.
+    """
+    estado = estado_exportacion(request.user.mipyme.pk) or {'estado': 'sin_exportacion'}
+    return JsonResponse(estado)
 
-    # Preparar respuesta HTTP
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="productos_{mipyme.nombre.replace(" ", "_")}.xlsx"'
+@login_required
+@mipyme_requerida
+def exportar_datos(request, recurso, formato):
+    """
+    Exporta ventas, insumos o productos en CSV o NDJSON, enviando las filas a medida
+    que se leen de la base de datos. Las ventas aceptan ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD.
+    """
+    if recurso not in exportaciones.RECURSOS or formato not in exportaciones.GENERADORES:
+        raise Http404("Exportación no disponible.")
 
-    # Guardar workbook en la respuesta
-    wb.save(response)
-    return response
+    try:
+        columnas, filas = exportaciones.RECURSOS[recurso](
+            request.user.mipyme, desde=request.GET.get('desde'), hasta=request.GET.get('hasta')
+        )
+    except exportaciones.FechaInvalidaError as e:
+        return HttpResponseBadRequest(str(e))
+    response = StreamingHttpResponse(
+        exportaciones.GENERADORES[formato](columnas, filas),
+        content_type=exportaciones.FORMATOS[formato],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{recurso}_{request.user.mipyme.pk}.{formato}"'
+    return por_partes(request, response)
 
 @login_required
 @mipyme_requerida
@@ -1329,22 +1162,9 @@ def mi_tiendita_detalle(request, producto_id):
             messages.success(request, 'Imágenes seleccionadas eliminadas.')
 
         # 3. Agregar Nuevas Imágenes Adicionales
-        imagenes_nuevas = request.FILES.getlist('imagenes_adicionales')
-        if imagenes_nuevas:
-            count_existentes = producto.imagenes_adicionales.count()
-            agregadas = 0
-            for i, imagen in enumerate(imagenes_nuevas):
-                if count_existentes + i >= 20:
-                    messages.warning(request, f'Se alcanzó el límite de 20 imágenes. Solo se agregaron {agregadas} imágenes.')
-                    break
-                ProductoImagen.objects.create(
-                    producto=producto,
-                    imagen=imagen,
-                    orden=count_existentes + i
-                )
-                agregadas += 1
-            if agregadas > 0:
-                messages.success(request, f'Se agregaron {agregadas} imágenes nuevas.')
+        agregadas = _agregar_imagenes_adicionales(request, producto)
+        if agregadas > 0:
+            messages.success(request, f'Se agregaron {agregadas} imágenes nuevas.')
 
         return redirect('produccion:mi_tiendita_detalle', producto_id=producto.id)
 